@@ -1,17 +1,21 @@
 import time
 from collections import defaultdict
 from datetime import datetime, timedelta
+from pathlib import Path
 from typing import Any, List, Dict, Tuple, Optional
 
 import pytz
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
+from sqlalchemy.orm import Session
 
 from app import schemas
 from app.chain.storage import StorageChain
 from app.core.config import settings
 from app.core.event import eventmanager
+from app.db import db_query, db_update
 from app.db.downloadhistory_oper import DownloadHistoryOper
+from app.db.models.transferhistory import TransferHistory
 from app.db.transferhistory_oper import TransferHistoryOper
 from app.log import logger
 from app.plugins import _PluginBase
@@ -27,7 +31,7 @@ class AutoClean(_PluginBase):
     # 插件图标
     plugin_icon = "clean.png"
     # 插件版本
-    plugin_version = "2.1"
+    plugin_version = "2.2"
     # 插件作者
     plugin_author = "thsrite"
     # 作者主页
@@ -49,6 +53,7 @@ class AutoClean(_PluginBase):
     _cleantype = None
     _cleandate = None
     _cleanuser = None
+    _dryrun = False
     _downloadhis = None
     _transferhis = None
 
@@ -67,6 +72,7 @@ class AutoClean(_PluginBase):
             self._cleantype = config.get("cleantype")
             self._cleandate = config.get("cleandate")
             self._cleanuser = config.get("cleanuser")
+            self._dryrun = config.get("dryrun")
 
             # 加载模块
         if self._enabled:
@@ -90,6 +96,7 @@ class AutoClean(_PluginBase):
                     "enabled": self._enabled,
                     "cleanuser": self._cleanuser,
                     "notify": self._notify,
+                    "dryrun": self._dryrun,
                 })
 
                 # 启动任务
@@ -181,23 +188,52 @@ class AutoClean(_PluginBase):
             # 将DownloadHistory对象添加到对应分组的列表中
             downloadhis_grouped_dict[(dtype, tmdbid)].append(downloadhis)
 
-        # 输出分组结果
+        # 一次查询所有下载历史对应的转移记录
+        download_hashs = list({downloadhis.download_hash for downloadhis in downloadhis_list
+                               if downloadhis.download_hash})
+        transferhis_dict: Dict[str, List[TransferHistory]] = defaultdict(list)
+        for history in self.__list_transfer_his_by_hashs(download_hashs, db=None) or []:
+            transferhis_dict[history.download_hash].append(history)
+
+        # 删除计划：存储 -> 目录 -> 文件
+        delete_plan: Dict[str, Dict[str, List[schemas.FileItem]]] = defaultdict(lambda: defaultdict(list))
+        # 已加入计划的文件
+        planned_files = set()
+        # 删除后需检查是否为空的媒体库目录，源文件目录不做清理
+        media_dirs = set()
+        # 需要删除的转移记录ID
+        del_transferhis_ids = []
+        # 需要发送删除事件的源文件
+        del_srcs = []
+        # 预计释放空间
+        total_size = 0
+        # 各媒体的清理结果
+        media_results = []
+
+        def __add_to_plan(_fileitem: dict, is_media: bool) -> int:
+            """
+            加入删除计划，返回文件大小
+            """
+            if not _fileitem or not _fileitem.get("path"):
+                return 0
+            fileitem = schemas.FileItem(**_fileitem)
+            if (fileitem.storage, fileitem.path) in planned_files:
+                return 0
+            planned_files.add((fileitem.storage, fileitem.path))
+            dir_path = Path(fileitem.path).parent.as_posix()
+            delete_plan[fileitem.storage][dir_path].append(fileitem)
+            if is_media:
+                media_dirs.add((fileitem.storage, dir_path))
+            return self.__get_file_size(fileitem)
+
         for key, downloadhis_list in downloadhis_grouped_dict.items():
-            logger.info(f"开始清理 {key}")
             del_transferhis_cnt = 0
-            del_media_name = downloadhis_list[0].title
-            del_media_user = downloadhis_list[0].username
-            del_media_type = downloadhis_list[0].type
-            del_media_year = downloadhis_list[0].year
-            del_media_season = downloadhis_list[0].seasons
-            del_media_episode = downloadhis_list[0].episodes
-            del_image = downloadhis_list[0].image
+            del_size = 0
             for downloadhis in downloadhis_list:
                 if not downloadhis.download_hash:
                     logger.debug(f'下载历史 {downloadhis.id} {downloadhis.title} 未获取到download_hash，跳过处理')
                     continue
-                # 根据hash获取转移记录
-                transferhis_list = self._transferhis.list_by_hash(download_hash=downloadhis.download_hash)
+                transferhis_list = transferhis_dict.get(downloadhis.download_hash)
                 if not transferhis_list:
                     logger.warn(f"下载历史 {downloadhis.download_hash} 未查询到转移记录，跳过处理")
                     continue
@@ -205,48 +241,165 @@ class AutoClean(_PluginBase):
                 for history in transferhis_list:
                     # 册除媒体库文件
                     if clean_type in ["dest", "all"]:
-                        dest_fileitem = schemas.FileItem(**history.dest_fileitem)
-                        StorageChain().delete_file(dest_fileitem)
+                        del_size += __add_to_plan(history.dest_fileitem, is_media=True)
                         # 删除记录
-                        self._transferhis.delete(history.id)
+                        del_transferhis_ids.append(history.id)
                     # 删除源文件
                     if clean_type in ["src", "all"]:
-                        src_fileitem = schemas.FileItem(**history.src_fileitem)
-                        StorageChain().delete_file(src_fileitem)
-                        # 发送事件
-                        eventmanager.send_event(
-                            EventType.DownloadFileDeleted,
-                            {
-                                "src": history.src
-                            }
-                        )
+                        del_size += __add_to_plan(history.src_fileitem, is_media=False)
+                        if history.src and history.src not in del_srcs:
+                            del_srcs.append(history.src)
 
                 # 累加删除数量
                 del_transferhis_cnt += len(transferhis_list)
 
             if del_transferhis_cnt:
-                # 发送消息
-                if self._notify:
-                    self.post_message(
-                        mtype=NotificationType.MediaServer,
-                        title="【定时清理媒体库任务完成】",
-                        text=f"清理媒体名称 {del_media_name}\n"
-                             f"下载媒体用户 {del_media_user}\n"
-                             f"删除历史记录 {del_transferhis_cnt}")
-
-                pulgin_history.append({
-                    "type": del_media_type,
-                    "title": del_media_name,
-                    "year": del_media_year,
-                    "season": del_media_season,
-                    "episode": del_media_episode,
-                    "image": del_image,
-                    "del_time": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(time.time()))
-                })
+                logger.info(f"{key} 计划删除转移记录 {del_transferhis_cnt} 条，"
+                            f"释放空间 {self.__format_size(del_size)}")
+                total_size += del_size
+                media_results.append((downloadhis_list[0], del_transferhis_cnt, del_size))
+
+        if not media_results:
+            logger.info(f"日期 {date} 之前的下载记录没有需要清理的文件")
+            return
+
+        file_cnt = sum(len(files) for dirs in delete_plan.values() for files in dirs.values())
+        # 仅预览，不实际删除
+        if self._dryrun:
+            report = [f"{downloadhis.title} {downloadhis.year or ''} "
+                      f"转移记录 {cnt} 条，{self.__format_size(size)}"
+                      for downloadhis, cnt, size in media_results]
+            logger.info(f"【预览】清理 {date} 之前的下载记录，将删除文件 {file_cnt} 个，"
+                        f"转移记录 {len(del_transferhis_ids)} 条，预计释放空间 {self.__format_size(total_size)}：\n"
+                        + "\n".join(report))
+            if self._notify:
+                self.post_message(
+                    mtype=NotificationType.MediaServer,
+                    title="【定时清理媒体库预览】",
+                    text=f"清理日期 {date} 之前\n"
+                         f"删除文件 {file_cnt} 个\n"
+                         f"删除历史记录 {len(del_transferhis_ids)}\n"
+                         f"预计释放空间 {self.__format_size(total_size)}")
+            return
+
+        # 按存储、目录执行删除计划
+        self.__execute_plan(delete_plan, media_dirs)
+
+        # 分批删除转移记录
+        for i in range(0, len(del_transferhis_ids), 500):
+            self.__delete_transfer_his(del_transferhis_ids[i:i + 500], db=None)
+
+        # 发送事件
+        for src in del_srcs:
+            eventmanager.send_event(
+                EventType.DownloadFileDeleted,
+                {
+                    "src": src
+                }
+            )
+
+        for downloadhis, del_transferhis_cnt, del_size in media_results:
+            # 发送消息
+            if self._notify:
+                self.post_message(
+                    mtype=NotificationType.MediaServer,
+                    title="【定时清理媒体库任务完成】",
+                    text=f"清理媒体名称 {downloadhis.title}\n"
+                         f"下载媒体用户 {downloadhis.username}\n"
+                         f"删除历史记录 {del_transferhis_cnt}\n"
+                         f"释放空间 {self.__format_size(del_size)}")
+
+            pulgin_history.append({
+                "type": downloadhis.type,
+                "title": downloadhis.title,
+                "year": downloadhis.year,
+                "season": downloadhis.seasons,
+                "episode": downloadhis.episodes,
+                "image": downloadhis.image,
+                "del_time": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(time.time()))
+            })
 
         # 保存历史
         self.save_data("history", pulgin_history)
 
+    @staticmethod
+    def __execute_plan(delete_plan: Dict[str, Dict[str, List[schemas.FileItem]]], media_dirs: set):
+        """
+        执行删除计划，删除文件后清理不再包含媒体文件的媒体库目录
+        """
+        storagechain = StorageChain()
+        for storage, dirs in delete_plan.items():
+            # 先处理深层目录
+            for dir_path in sorted(dirs.keys(), key=lambda x: x.count("/"), reverse=True):
+                for fileitem in dirs[dir_path]:
+                    logger.info(f"删除文件：{storage} {fileitem.path}")
+                    storagechain.delete_file(fileitem)
+                if (storage, dir_path) not in media_dirs:
+                    continue
+                # 目录下已无媒体文件及子目录时删除目录
+                dir_item = schemas.FileItem(
+                    storage=storage,
+                    type="dir",
+                    path=dir_path.rstrip("/") + "/",
+                    name=Path(dir_path).name,
+                    basename=Path(dir_path).name
+                )
+                files = storagechain.list_files(dir_item)
+                if files is None:
+                    continue
+                if any(file.type == "dir"
+                       or (file.extension and f".{file.extension.lower()}" in settings.RMT_MEDIAEXT)
+                       for file in files):
+                    continue
+                logger.info(f"删除空媒体目录：{storage} {dir_path}")
+                storagechain.delete_file(dir_item)
+
+    @staticmethod
+    def __get_file_size(fileitem: schemas.FileItem) -> int:
+        """
+        获取文件大小，转移记录中未记录时读取本地文件
+        """
+        if fileitem.size:
+            return fileitem.size
+        if fileitem.storage == "local":
+            try:
+                return Path(fileitem.path).stat().st_size
+            except OSError:
+                pass
+        return 0
+
+    @staticmethod
+    def __format_size(size: int) -> str:
+        """
+        格式化文件大小
+        """
+        for unit in ["B", "KB", "MB", "GB"]:
+            if size < 1024:
+                return f"{size:.2f}{unit}"
+            size /= 1024
+        return f"{size:.2f}TB"
+
+    @staticmethod
+    @db_query
+    def __list_transfer_his_by_hashs(download_hashs: List[str], db: Session = None) -> List[TransferHistory]:
+        """
+        按下载hash批量查询转移记录
+        """
+        historys = []
+        for i in range(0, len(download_hashs), 500):
+            historys.extend(db.query(TransferHistory)
+                            .filter(TransferHistory.download_hash.in_(download_hashs[i:i + 500]))
+                            .all())
+        return historys
+
+    @staticmethod
+    @db_update
+    def __delete_transfer_his(ids: List[int], db: Session = None):
+        """
+        在一个事务中批量删除转移记录
+        """
+        db.query(TransferHistory).filter(TransferHistory.id.in_(ids)).delete(synchronize_session=False)
+
     def get_state(self) -> bool:
         return self._enabled
 
@@ -294,7 +447,7 @@ class AutoClean(_PluginBase):
                                 'component': 'VCol',
                                 'props': {
                                     'cols': 12,
-                                    'md': 4
+                                    'md': 3
                                 },
                                 'content': [
                                     {
@@ -310,7 +463,7 @@ class AutoClean(_PluginBase):
                                 'component': 'VCol',
                                 'props': {
                                     'cols': 12,
-                                    'md': 4
+                                    'md': 3
                                 },
                                 'content': [
                                     {
@@ -326,7 +479,7 @@ class AutoClean(_PluginBase):
                                 'component': 'VCol',
                                 'props': {
                                     'cols': 12,
-                                    'md': 4
+                                    'md': 3
                                 },
                                 'content': [
                                     {
@@ -337,6 +490,22 @@ class AutoClean(_PluginBase):
                                         }
                                     }
                                 ]
+                            },
+                            {
+                                'component': 'VCol',
+                                'props': {
+                                    'cols': 12,
+                                    'md': 3
+                                },
+                                'content': [
+                                    {
+                                        'component': 'VSwitch',
+                                        'props': {
+                                            'model': 'dryrun',
+                                            'label': '仅预览不删除',
+                                        }
+                                    }
+                                ]
                             }
                         ]
                     },
@@ -436,7 +605,8 @@ class AutoClean(_PluginBase):
             "cleantype": "dest",
             "cron": "",
             "cleanuser": "",
-            "cleandate": 30
+            "cleandate": 30,
+            "dryrun": False
         }
 
     def get_page(self) -> List[dict]:
@@ -1,6 +1,6 @@
 import datetime
 import re
-import xml.dom.minidom
+import time
 from threading import Event
 from typing import Tuple, List, Dict, Any
 
@@ -17,9 +17,9 @@ from app.core.context import MediaInfo
 from app.core.metainfo import MetaInfo
 from app.log import logger
 from app.plugins import _PluginBase
+from app.plugins.doubanrank.doubancache import DoubanCache, ExistsChecker
+from app.plugins.doubanrank.feedfetcher import FeedFetcher
 from app.schemas import MediaType
-from app.utils.dom import DomUtils
-from app.utils.http import RequestUtils
 
 
 class DoubanRank(_PluginBase):
@@ -30,7 +30,7 @@ class DoubanRank(_PluginBase):
     # 插件图标
     plugin_icon = "movie.jpg"
     # 插件版本
-    plugin_version = "2.0.0"
+    plugin_version = "2.2.0"
     # 插件作者
     plugin_author = "jxxghp"
     # 作者主页
@@ -68,6 +68,8 @@ class DoubanRank(_PluginBase):
     _clear = False
     _clearflag = False
     _proxy = False
+    # RSS缓存校验信息有效期（秒），超时后完整获取一次
+    _feed_max_age = 12 * 3600
 
     def init_plugin(self, config: dict = None):
         self.downloadchain = DownloadChain()
@@ -536,13 +538,25 @@ class DoubanRank(_PluginBase):
             history = []
         else:
             history: List[dict] = self.get_data('history') or []
+        # 已处理的记录索引
+        history_uniques = {h.get("unique") for h in history}
+        # 豆瓣识别结果缓存，清理历史记录时判断结果一并清除
+        cache = DoubanCache()
+        if self._clearflag:
+            cache.clear_decisions()
+        # 订阅及媒体库数据
+        exists = ExistsChecker()
 
-        for addr in addr_list:
-            if not addr:
-                continue
+        # 并发获取所有RSS，未变化的RSS服务端返回304
+        validators = self.__load_validators()
+        feeds = FeedFetcher(proxies=settings.PROXY if self._proxy else None).fetch_all(addr_list, validators)
+        for addr, feed in feeds.items():
             try:
                 logger.info(f"获取RSS：{addr} ...")
-                rss_infos = self.__get_rss_info(addr)
+                if feed.not_modified:
+                    logger.info(f"RSS地址：{addr} ，无变化，跳过")
+                    continue
+                rss_infos = self.__get_rss_info(feed.items)
                 if not rss_infos:
                     logger.error(f"RSS地址：{addr} ，未查询到数据")
                     continue
@@ -551,6 +565,7 @@ class DoubanRank(_PluginBase):
                 for rss_info in rss_infos:
                     if self._event.is_set():
                         logger.info(f"订阅服务停止")
+                        cache.save()
                         return
                     mtype = None
                     title = rss_info.get('title')
@@ -563,8 +578,25 @@ class DoubanRank(_PluginBase):
                         mtype = MediaType.TV
                     unique_flag = f"doubanrank: {title} (DB:{douban_id})"
                     # 检查是否已处理过
-                    if unique_flag in [h.get("unique") for h in history]:
+                    if unique_flag in history_uniques:
                         continue
+                    if douban_id:
+                        # 近期已判断过的不再重复识别
+                        decision = cache.get_decision(douban_id)
+                        if decision:
+                            logger.debug(f'{title} 近期已处理（{decision}），豆瓣ID：{douban_id}')
+                            continue
+                        if exists.subscribed(doubanid=douban_id):
+                            logger.info(f'{title} 订阅已存在')
+                            cache.set_decision(douban_id, "subscribed")
+                            continue
+                        cached_media = cache.get_media(douban_id)
+                        if self._vote and cached_media \
+                                and (cached_media.get("vote") or 0) < self._vote:
+                            logger.info(f'{title} 评分不符合要求')
+                            continue
+                    else:
+                        cached_media = None
                     # 元数据
                     meta = MetaInfo(title)
                     meta.year = year
@@ -574,19 +606,27 @@ class DoubanRank(_PluginBase):
                     if douban_id:
                         # 识别豆瓣信息
                         if settings.RECOGNIZE_SOURCE == "themoviedb":
-                            tmdbinfo = self.mediachain.get_tmdbinfo_by_doubanid(doubanid=douban_id, mtype=meta.type)
-                            if not tmdbinfo:
-                                logger.warn(f'未能通过豆瓣ID {douban_id} 获取到TMDB信息，标题：{title}，豆瓣ID：{douban_id}')
-                                continue
-                            mediainfo = self.chain.recognize_media(meta=meta, tmdbid=tmdbinfo.get("id"))
+                            tmdbid = cached_media.get("tmdbid") if cached_media else None
+                            if not tmdbid:
+                                tmdbinfo = self.mediachain.get_tmdbinfo_by_doubanid(doubanid=douban_id,
+                                                                                    mtype=meta.type)
+                                if not tmdbinfo:
+                                    logger.warn(f'未能通过豆瓣ID {douban_id} 获取到TMDB信息，标题：{title}，豆瓣ID：{douban_id}')
+                                    cache.set_decision(douban_id, "unrecognized")
+                                    continue
+                                tmdbid = tmdbinfo.get("id")
+                            mediainfo = self.chain.recognize_media(meta=meta, tmdbid=tmdbid)
                             if not mediainfo:
-                                logger.warn(f'TMDBID {tmdbinfo.get("id")} 未识别到媒体信息')
+                                logger.warn(f'TMDBID {tmdbid} 未识别到媒体信息')
+                                cache.set_decision(douban_id, "unrecognized")
                                 continue
                         else:
                             mediainfo = self.chain.recognize_media(meta=meta, doubanid=douban_id)
                             if not mediainfo:
                                 logger.warn(f'豆瓣ID {douban_id} 未识别到媒体信息')
+                                cache.set_decision(douban_id, "unrecognized")
                                 continue
+                        cache.set_media(douban_id, mediainfo)
                     else:
                         # 匹配媒体信息
                         mediainfo: MediaInfo = self.chain.recognize_media(meta=meta)
@@ -598,13 +638,20 @@ class DoubanRank(_PluginBase):
                         logger.info(f'{mediainfo.title_year} 评分不符合要求')
                         continue
                     # 查询缺失的媒体信息
-                    exist_flag, _ = self.downloadchain.get_no_exists_info(meta=meta, mediainfo=mediainfo)
+                    if exists.movie_exists(mediainfo):
+                        exist_flag = True
+                    else:
+                        exist_flag, _ = self.downloadchain.get_no_exists_info(meta=meta, mediainfo=mediainfo)
                     if exist_flag:
                         logger.info(f'{mediainfo.title_year} 媒体库中已存在')
+                        if douban_id:
+                            cache.set_decision(douban_id, "exist")
                         continue
                     # 判断用户是否已经添加订阅
-                    if self.subscribechain.exists(mediainfo=mediainfo, meta=meta):
+                    if exists.subscribed(mediainfo=mediainfo, meta=meta):
                         logger.info(f'{mediainfo.title_year} 订阅已存在')
+                        if douban_id:
+                            cache.set_decision(douban_id, "subscribed")
                         continue
                     # 添加订阅
                     self.subscribechain.add(title=mediainfo.title,
@@ -614,6 +661,7 @@ class DoubanRank(_PluginBase):
                                             season=meta.begin_season,
                                             exist_ok=True,
                                             username="豆瓣榜单")
+                    exists.add_subscribe(mediainfo=mediainfo, meta=meta, doubanid=douban_id)
                     # 存储历史记录
                     history.append({
                         "title": title,
@@ -626,68 +674,70 @@ class DoubanRank(_PluginBase):
                         "time": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
                         "unique": unique_flag
                     })
+                    history_uniques.add(unique_flag)
+                # 处理完成后才记录校验信息，保证未处理的内容下次仍会获取
+                validators[addr] = {**feed.validator, "time": time.time()}
             except Exception as e:
                 logger.error(str(e))
 
         # 保存历史记录
         self.save_data('history', history)
+        cache.save()
+        self.save_data('validators', {addr: validators[addr] for addr in feeds if addr in validators})
+        self.save_data('validators_vote', self._vote)
         # 缓存只清理一次
         self._clearflag = False
         logger.info(f"所有榜单RSS刷新完成")
 
-    def __get_rss_info(self, addr) -> List[dict]:
+    def __load_validators(self) -> Dict[str, dict]:
         """
-        获取RSS
+        加载RSS缓存校验信息，清理历史、评分要求变化或超过有效期时不使用
         """
-        try:
-            if self._proxy:
-                ret = RequestUtils(proxies=settings.PROXY).get_res(addr)
-            else:
-                ret = RequestUtils().get_res(addr)
-            if not ret:
-                return []
-            ret_xml = ret.text
-            ret_array = []
-            # 解析XML
-            dom_tree = xml.dom.minidom.parseString(ret_xml)
-            rootNode = dom_tree.documentElement
-            items = rootNode.getElementsByTagName("item")
-            for item in items:
-                try:
-                    rss_info = {}
-
-                    # 标题
-                    title = DomUtils.tag_value(item, "title", default="")
-                    # 链接
-                    link = DomUtils.tag_value(item, "link", default="")
-                    # 年份
-                    description = DomUtils.tag_value(item, "description", default="")
-
-                    if not title and not link:
-                        logger.warn(f"条目标题和链接均为空，无法处理")
-                        continue
-                    rss_info['title'] = title
-                    rss_info['link'] = link
-
-                    doubanid = re.findall(r"/(\d+)/", link)
-                    if doubanid:
-                        doubanid = doubanid[0]
-                    if doubanid and not str(doubanid).isdigit():
-                        logger.warn(f"解析的豆瓣ID格式不正确：{doubanid}")
-                        continue
-                    rss_info['doubanid'] = doubanid
+        if self._clearflag or self.get_data('validators_vote') != self._vote:
+            return {}
+        now = time.time()
+        return {k: v for k, v in (self.get_data('validators') or {}).items()
+                if now - v.get("time", 0) < self._feed_max_age}
+
+    @staticmethod
+    def __get_rss_info(items: List[dict]) -> List[dict]:
+        """
+        从RSS条目中解析豆瓣ID和年份
+        """
+        ret_array = []
+        for item in items:
+            try:
+                rss_info = {}
 
-                    # 匹配4位独立数字1900-2099年
-                    year = re.findall(r"\b(19\d{2}|20\d{2})\b", description)
-                    if year:
-                        rss_info['year'] = year[0]
+                # 标题
+                title = item.get("title") or ""
+                # 链接
+                link = item.get("link") or ""
+                # 年份
+                description = item.get("description") or ""
 
-                    # 返回对象
-                    ret_array.append(rss_info)
-                except Exception as e1:
-                    logger.error("解析RSS条目失败：" + str(e1))
+                if not title and not link:
+                    logger.warn(f"条目标题和链接均为空，无法处理")
                     continue
-            return ret_array
-        except Exception as e:
-            logger.error("获取RSS失败：" + str(e))
-            return []
+                rss_info['title'] = title
+                rss_info['link'] = link
+
+                doubanid = re.findall(r"/(\d+)/", link)
+                if doubanid:
+                    doubanid = doubanid[0]
+                if doubanid and not str(doubanid).isdigit():
+                    logger.warn(f"解析的豆瓣ID格式不正确：{doubanid}")
+                    continue
+                rss_info['doubanid'] = doubanid
+
+                # 匹配4位独立数字1900-2099年
+                year = re.findall(r"\b(19\d{2}|20\d{2})\b", description)
+                if year:
+                    rss_info['year'] = year[0]
+
+                # 返回对象
+                ret_array.append(rss_info)
+            except Exception as e1:
+                logger.error("解析RSS条目失败：" + str(e1))
+                continue
+        return ret_array
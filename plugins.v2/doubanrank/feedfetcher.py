@@ -0,0 +1,148 @@
+import io
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from app.core.config import settings
+from app.log import logger
+from app.utils.http import RequestUtils
+from app.utils.string import StringUtils
+
+
+@dataclass
+class FeedResult:
+    # RSS地址
+    url: str
+    # 是否获取成功
+    success: bool = False
+    # 服务端返回304，内容未变化
+    not_modified: bool = False
+    # 解析后的条目
+    items: List[dict] = field(default_factory=list)
+    # 缓存校验信息：etag、last_modified
+    validator: Dict[str, str] = field(default_factory=dict)
+
+
+class FeedFetcher:
+    """
+    并发获取RSS，支持条件请求（If-None-Match/If-Modified-Since），流式解析XML
+    """
+
+    def __init__(self, proxies: dict = None, timeout: int = 30, max_workers: int = 4):
+        self._proxies = proxies
+        self._timeout = timeout
+        self._max_workers = max_workers
+
+    def fetch_all(self, urls: List[str], validators: Dict[str, dict] = None) -> Dict[str, FeedResult]:
+        """
+        并发获取多个RSS
+        :param urls: RSS地址列表
+        :param validators: 上次获取时保存的校验信息 {url: {"etag": "", "last_modified": ""}}
+        :return: {url: FeedResult}
+        """
+        validators = validators or {}
+        urls = list(dict.fromkeys(url for url in urls if url))
+        if not urls:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(self._max_workers, len(urls))) as executor:
+            results = executor.map(lambda u: self.fetch(u, validators.get(u)), urls)
+            return {result.url: result for result in results}
+
+    def fetch(self, url: str, validator: Optional[dict] = None) -> FeedResult:
+        """
+        获取单个RSS，内容未变化时不下载报文
+        """
+        result = FeedResult(url=url)
+        headers = {"User-Agent": settings.USER_AGENT}
+        if validator:
+            if validator.get("etag"):
+                headers["If-None-Match"] = validator.get("etag")
+            if validator.get("last_modified"):
+                headers["If-Modified-Since"] = validator.get("last_modified")
+        try:
+            ret = RequestUtils(proxies=self._proxies, headers=headers,
+                               timeout=self._timeout).get_res(url)
+            if ret is None:
+                logger.error(f"获取RSS失败：{url}")
+                return result
+            if ret.status_code == 304:
+                result.success = True
+                result.not_modified = True
+                result.validator = dict(validator or {})
+                return result
+            if ret.status_code != 200:
+                logger.error(f"获取RSS失败：{url}，状态码：{ret.status_code}")
+                return result
+            result.items = self.parse(ret.content)
+            result.success = True
+            result.validator = {
+                "etag": ret.headers.get("ETag") or "",
+                "last_modified": ret.headers.get("Last-Modified") or ""
+            }
+        except Exception as e:
+            logger.error(f"获取RSS失败：{url}，{str(e)}")
+        return result
+
+    @staticmethod
+    def __local_name(tag: str) -> str:
+        """
+        去掉命名空间前缀
+        """
+        return tag.rsplit("}", 1)[-1] if "}" in tag else tag
+
+    @classmethod
+    def parse(cls, content: bytes) -> List[dict]:
+        """
+        流式解析RSS/Atom报文，每个条目解析完成后立即释放
+        :return: [{"title", "link", "description", "enclosure", "size", "pubdate"}]
+        """
+        items = []
+        if not content:
+            return items
+        try:
+            for _, elem in ET.iterparse(io.BytesIO(content.strip()), events=("end",)):
+                if cls.__local_name(elem.tag) not in ("item", "entry"):
+                    continue
+                item = cls.__parse_item(elem)
+                if item:
+                    items.append(item)
+                elem.clear()
+        except ET.ParseError as e:
+            logger.error(f"解析RSS报文失败：{str(e)}")
+        return items
+
+    @classmethod
+    def __parse_item(cls, elem: ET.Element) -> Optional[dict]:
+        """
+        解析一个条目
+        """
+        title = link = description = enclosure = pubdate = ""
+        size = 0
+        for child in elem:
+            name = cls.__local_name(child.tag)
+            text = (child.text or "").strip()
+            if name == "title":
+                title = text
+            elif name == "link":
+                # Atom的链接在href属性中
+                link = text or child.get("href") or link
+            elif name in ("description", "summary") or (name == "content" and not description):
+                description = text
+            elif name == "enclosure":
+                enclosure = child.get("url") or ""
+                length = child.get("length")
+                if length and str(length).isdigit():
+                    size = int(length)
+            elif name in ("pubDate", "published") or (name == "updated" and not pubdate):
+                pubdate = text
+        if not title and not link:
+            return None
+        return {
+            "title": title,
+            "link": link,
+            "description": description,
+            "enclosure": enclosure or link,
+            "size": size,
+            "pubdate": StringUtils.get_time(pubdate) if pubdate else None
+        }
@@ -22,6 +22,7 @@ from app.core.metainfo import MetaInfo
 from app.helper.rss import RssHelper
 from app.log import logger
 from app.plugins import _PluginBase
+from app.plugins.doubansync.doubancache import DoubanCache, ExistsChecker
 from app.schemas.types import EventType
 
 lock = Lock()
@@ -35,7 +36,7 @@ class DoubanSync(_PluginBase):
     # 插件图标
     plugin_icon = "douban.png"
     # 插件版本
-    plugin_version = "2.0.1"
+    plugin_version = "2.1.0"
     # 插件作者
     plugin_author = "jxxghp"
     # 作者主页
@@ -521,6 +522,14 @@ class DoubanSync(_PluginBase):
             history = []
         else:
             history: List[dict] = self.get_data('history') or []
+        # 已处理的豆瓣ID索引
+        history_doubanids = {h.get("doubanid") for h in history}
+        # 豆瓣识别结果缓存，清理历史记录时判断结果一并清除
+        cache = DoubanCache()
+        if self._clearflag:
+            cache.clear_decisions()
+        # 订阅及媒体库数据
+        exists = ExistsChecker()
         for user_id in self._users.split(","):
             # 同步每个用户的豆瓣数据
             if not user_id:
@@ -557,32 +566,55 @@ class DoubanSync(_PluginBase):
                             continue
                     douban_id = result.get("link", "").split("/")[-2]
                     # 检查是否处理过
-                    if not douban_id or douban_id in [h.get("doubanid") for h in history]:
+                    if not douban_id or douban_id in history_doubanids:
                         logger.info(f'标题：{title}，豆瓣ID：{douban_id} 已处理过')
                         continue
+                    # 近期无法识别的不再重复识别
+                    if cache.get_decision(douban_id) == "unrecognized":
+                        logger.info(f'标题：{title}，豆瓣ID：{douban_id} 近期未能识别，跳过')
+                        continue
                     # 识别媒体信息
                     meta = MetaInfo(title=title)
-                    douban_info = self.chain.douban_info(doubanid=douban_id)
-                    meta.type = MediaType.MOVIE if douban_info.get("type") == "movie" else MediaType.TV
+                    cached_media = cache.get_media(douban_id)
+                    if cached_media and cached_media.get("type"):
+                        meta.type = MediaType(cached_media.get("type"))
+                    else:
+                        douban_info = self.chain.douban_info(doubanid=douban_id)
+                        meta.type = MediaType.MOVIE if douban_info.get("type") == "movie" else MediaType.TV
                     if settings.RECOGNIZE_SOURCE == "themoviedb":
-                        tmdbinfo = self.mediachain.get_tmdbinfo_by_doubanid(doubanid=douban_id, mtype=meta.type)
-                        if not tmdbinfo:
-                            logger.warn(f'未能通过豆瓣ID {douban_id} 获取到TMDB信息，标题：{title}，豆瓣ID：{douban_id}')
-                            continue
-                        mediainfo = self.chain.recognize_media(meta=meta, tmdbid=tmdbinfo.get("id"))
+                        tmdbid = cached_media.get("tmdbid") if cached_media else None
+                        if not tmdbid:
+                            tmdbinfo = self.mediachain.get_tmdbinfo_by_doubanid(doubanid=douban_id, mtype=meta.type)
+                            if not tmdbinfo:
+                                logger.warn(f'未能通过豆瓣ID {douban_id} 获取到TMDB信息，标题：{title}，豆瓣ID：{douban_id}')
+                                cache.set_decision(douban_id, "unrecognized")
+                                continue
+                            tmdbid = tmdbinfo.get("id")
+                        mediainfo = self.chain.recognize_media(meta=meta, tmdbid=tmdbid)
                         if not mediainfo:
-                            logger.warn(f'TMDBID {tmdbinfo.get("id")} 未识别到媒体信息')
+                            logger.warn(f'TMDBID {tmdbid} 未识别到媒体信息')
+                            cache.set_decision(douban_id, "unrecognized")
                             continue
                     else:
                         mediainfo = self.chain.recognize_media(meta=meta, doubanid=douban_id)
                         if not mediainfo:
                             logger.warn(f'豆瓣ID {douban_id} 未识别到媒体信息')
+                            cache.set_decision(douban_id, "unrecognized")
                             continue
+                    cache.set_media(douban_id, mediainfo)
                     # 查询缺失的媒体信息
-                    exist_flag, no_exists = self.downloadchain.get_no_exists_info(meta=meta, mediainfo=mediainfo)
+                    if exists.movie_exists(mediainfo):
+                        exist_flag = True
+                    else:
+                        exist_flag, no_exists = self.downloadchain.get_no_exists_info(meta=meta, mediainfo=mediainfo)
                     if exist_flag:
                         logger.info(f'{mediainfo.title_year} 媒体库中已存在')
+                        cache.set_decision(douban_id, "exist")
                         action = "exist"
+                    elif exists.subscribed(doubanid=douban_id, mediainfo=mediainfo, meta=meta):
+                        logger.info(f'{mediainfo.title_year} 订阅已存在')
+                        cache.set_decision(douban_id, "subscribed")
+                        action = "subscribe"
                     else:
                         # 用户转换
                         real_name = self.__get_username_by_douban(user_id)
@@ -595,6 +627,7 @@ class DoubanSync(_PluginBase):
                                                 season=meta.begin_season,
                                                 exist_ok=True,
                                                 username=real_name or "豆瓣想看")
+                        exists.add_subscribe(mediainfo=mediainfo, meta=meta, doubanid=douban_id)
                         action = "subscribe"
                     # 存储历史记录
                     history.append({
@@ -608,11 +641,13 @@ class DoubanSync(_PluginBase):
                         "doubanid": douban_id,
                         "time": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
                     })
+                    history_doubanids.add(douban_id)
                 except Exception as err:
                     logger.error(f'同步用户 {user_id} 豆瓣想看数据出错：{str(err)}')
             logger.info(f"用户 {user_id} 豆瓣想看同步完成")
         # 保存历史记录
         self.save_data('history', history)
+        cache.save()
         # 缓存只清理一次
         self._clearflag = False
 
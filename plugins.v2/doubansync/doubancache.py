@@ -0,0 +1,178 @@
+import time
+from threading import Lock
+from typing import Optional, Set, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.core.context import MediaInfo
+from app.core.metainfo import MetaBase
+from app.db import db_query
+from app.db.models.mediaserver import MediaServerItem
+from app.db.plugindata_oper import PluginDataOper
+from app.db.subscribe_oper import SubscribeOper
+from app.log import logger
+from app.schemas.types import MediaType
+
+# 仅保证同一插件内的并发保存互斥，两个插件各自持有一份
+lock = Lock()
+
+
+class DoubanCache:
+    """
+    豆瓣ID识别结果缓存，豆瓣榜单与豆瓣想看共用
+    缓存内容：{doubanid: {"tmdbid", "type", "vote", "mapped", "decision", "expire"}}
+    """
+    # 缓存存储位置
+    _plugin_id = "DoubanCache"
+    _key = "media"
+    # 豆瓣ID对应媒体信息的缓存时间（秒）
+    _map_ttl = 30 * 86400
+    # 各判断结果的缓存时间（秒）
+    _decision_ttls = {
+        # 无法识别
+        "unrecognized": 86400,
+        # 媒体库中已存在
+        "exist": 3 * 86400,
+        # 订阅已存在
+        "subscribed": 3 * 86400
+    }
+
+    def __init__(self):
+        self._oper = PluginDataOper()
+        self._data = self.__load()
+        # 本次运行中更新过的豆瓣ID
+        self._changed = set()
+
+    def __load(self) -> dict:
+        """
+        加载缓存，去掉已全部过期的条目
+        """
+        now = time.time()
+        data = self._oper.get_data(self._plugin_id, self._key) or {}
+        return {k: v for k, v in data.items()
+                if v.get("mapped", 0) > now or v.get("expire", 0) > now}
+
+    def __entry(self, doubanid: str) -> dict:
+        self._changed.add(str(doubanid))
+        return self._data.setdefault(str(doubanid), {})
+
+    def get_media(self, doubanid: str) -> Optional[dict]:
+        """
+        查询未过期的豆瓣ID对应媒体信息
+        :return: {"tmdbid", "type", "vote"}
+        """
+        entry = self._data.get(str(doubanid))
+        if not entry or entry.get("mapped", 0) <= time.time():
+            return None
+        return entry
+
+    def set_media(self, doubanid: str, mediainfo: MediaInfo):
+        """
+        记录豆瓣ID对应的媒体信息
+        """
+        self.__entry(doubanid).update({
+            "tmdbid": mediainfo.tmdb_id,
+            "type": mediainfo.type.value if mediainfo.type else None,
+            "vote": mediainfo.vote_average,
+            "mapped": time.time() + self._map_ttl
+        })
+
+    def get_decision(self, doubanid: str) -> Optional[str]:
+        """
+        查询未过期的判断结果
+        """
+        entry = self._data.get(str(doubanid))
+        if not entry or entry.get("expire", 0) <= time.time():
+            return None
+        return entry.get("decision")
+
+    def set_decision(self, doubanid: str, decision: str):
+        """
+        记录判断结果，缓存期内不再重复识别
+        """
+        self.__entry(doubanid).update({
+            "decision": decision,
+            "expire": time.time() + self._decision_ttls.get(decision, 86400)
+        })
+
+    def clear_decisions(self):
+        """
+        清除所有判断结果，豆瓣ID对应的媒体信息保留，用于清理历史记录后重新处理
+        """
+        for doubanid, entry in self._data.items():
+            if "decision" in entry or "expire" in entry:
+                entry.pop("decision", None)
+                entry.pop("expire", None)
+                self._changed.add(doubanid)
+
+    def save(self):
+        """
+        合并保存缓存：保存前重新读取已存储的数据，只覆盖本次更新过的条目，
+        另一个插件在此之前写入的条目得以保留
+        """
+        if not self._changed:
+            return
+        with lock:
+            # 重新读取，合并另一个插件已保存的数据
+            data = self.__load()
+            data.update({k: self._data[k] for k in self._changed if k in self._data})
+            self._oper.save(self._plugin_id, self._key, data)
+        logger.debug(f"豆瓣识别缓存已更新 {len(self._changed)} 条，共 {len(data)} 条")
+        self._changed.clear()
+
+
+class ExistsChecker:
+    """
+    每次运行开始时一次性读取订阅和媒体库数据，替代逐条查询
+    """
+
+    def __init__(self):
+        subscribes = SubscribeOper().list() or []
+        self._subscribe_doubanids: Set[str] = {str(s.doubanid) for s in subscribes if s.doubanid}
+        self._subscribe_keys: Set[Tuple[int, Optional[int]]] = {
+            (s.tmdbid, s.season if s.type == MediaType.TV.value else None) for s in subscribes if s.tmdbid
+        }
+        self._library_movies: Set[int] = self.__get_library_movies(db=None)
+
+    @staticmethod
+    def __subscribe_key(mediainfo: MediaInfo, meta: MetaBase) -> Tuple[int, Optional[int]]:
+        if mediainfo.type == MediaType.TV:
+            return mediainfo.tmdb_id, meta.begin_season or 1
+        return mediainfo.tmdb_id, None
+
+    def subscribed(self, doubanid: str = None, mediainfo: MediaInfo = None, meta: MetaBase = None) -> bool:
+        """
+        判断是否已有订阅
+        """
+        if doubanid and str(doubanid) in self._subscribe_doubanids:
+            return True
+        if mediainfo and mediainfo.tmdb_id:
+            return self.__subscribe_key(mediainfo, meta) in self._subscribe_keys
+        return False
+
+    def add_subscribe(self, mediainfo: MediaInfo, meta: MetaBase, doubanid: str = None):
+        """
+        记录本次运行新增的订阅
+        """
+        if doubanid:
+            self._subscribe_doubanids.add(str(doubanid))
+        if mediainfo.tmdb_id:
+            self._subscribe_keys.add(self.__subscribe_key(mediainfo, meta))
+
+    def movie_exists(self, mediainfo: MediaInfo) -> bool:
+        """
+        电影是否已在媒体库中，依据媒体服务器同步数据，不在同步数据中时仍需逐条查询
+        """
+        return mediainfo.type == MediaType.MOVIE and mediainfo.tmdb_id in self._library_movies
+
+    @staticmethod
+    @db_query
+    def __get_library_movies(db: Session = None) -> Set[int]:
+        """
+        查询媒体库中所有电影的TMDBID
+        """
+        rows = db.query(MediaServerItem.tmdbid).filter(
+            MediaServerItem.item_type == MediaType.MOVIE.value,
+            MediaServerItem.tmdbid.isnot(None)
+        ).all()
+        return {row[0] for row in rows if row[0]}
@@ -2,6 +2,7 @@ import pytz
 import time
 import requests
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Any, List, Dict, Tuple, Optional
 from urllib.parse import urljoin
@@ -32,7 +33,7 @@ class GroupChatZoneTest(_PluginBase):
     # 插件图标
     plugin_icon = "https://raw.githubusercontent.com/KoWming/MoviePilot-Plugins/main/icons/GroupChat.png"
     # 插件版本
-    plugin_version = "2.1"
+    plugin_version = "2.2"
     # 插件作者
     plugin_author = "lun"
     # 作者主页
@@ -71,6 +72,11 @@ class GroupChatZoneTest(_PluginBase):
     _cache_ttl: int = 3600  # 缓存过期时间（秒）
     _site_cache: Optional[TTLCache] = None
     _cache_initialized: bool = False
+    # 同时发送消息的站点数
+    _max_workers: int = 8
+    # 本次运行的站点用户信息缓存 {站点地址: {"user_id": 用户ID, "username": 用户名}}
+    _user_cache: Dict[str, dict] = {}
+    _user_cache_lock = threading.Lock()
 
     def init_plugin(self, config: Optional[dict] = None):
         self._lock = threading.Lock()
@@ -738,48 +744,29 @@ class GroupChatZoneTest(_PluginBase):
             logger.info("没有需要发送消息的站点！")
             return
 
-        # 执行站点发送消息
-        site_results = {}
-        all_feedback = []
-        
+        # 用户信息只在本次运行内缓存
+        with self._user_cache_lock:
+            self._user_cache = {}
+
+        # 各站点并发发送，站点内按间隔依次发送
+        site_tasks = []
         for site in selected_sites:
             site_name = site.get("name")
-            logger.info(f"开始处理站点: {site_name}")
             messages = site_msgs.get(site_name, [])
-
             if not messages:
                 logger.warning(f"站点 {site_name} 没有需要发送的消息！")
                 continue
+            site_tasks.append((site, messages))
 
-            success_count = 0
-            failure_count = 0
-            failed_messages = []
-            site_feedback = []
-
-            for i, message in enumerate(messages):
-                try:
-                    feedback = self.send_message_to_site(site, message)
-                    success_count += 1
-                    if feedback:
-                        site_feedback.append(feedback)
-                        all_feedback.append(feedback)
-                except Exception as e:
-                    logger.error(f"向站点 {site_name} 发送消息 '{message}' 失败: {str(e)}")
-                    failure_count += 1
-                    failed_messages.append(message)
-
-                if i < len(messages) - 1:
-                    logger.info(f"等待 {self._interval_cnt} 秒后继续发送下一条消息...")
-                    start_time = time.time()
-                    time.sleep(self._interval_cnt)
-                    logger.debug(f"实际等待时间：{time.time() - start_time:.2f} 秒")
-            
-            site_results[site_name] = {
-                "success_count": success_count,
-                "failure_count": failure_count,
-                "failed_messages": failed_messages,
-                "feedback": site_feedback
-            }
+        site_results = {}
+        all_feedback = []
+        if site_tasks:
+            with ThreadPoolExecutor(max_workers=min(self._max_workers, len(site_tasks))) as executor:
+                results = executor.map(lambda task: self.__send_site_msgs(*task), site_tasks)
+                # 按站点顺序汇总结果
+                for (site, _), result in zip(site_tasks, results):
+                    site_results[site.get("name")] = result
+                    all_feedback.extend(result["feedback"])
 
         # 发送通知
         if self._notify:
@@ -887,6 +874,59 @@ class GroupChatZoneTest(_PluginBase):
 
         self.__update_config(refresh_cache=False)
 
+    def __send_site_msgs(self, site: CommentedMap, messages: List[str]) -> dict:
+        """
+        向单个站点依次发送消息，两次发送的开始时间至少间隔设定的秒数
+        """
+        site_name = site.get("name")
+        logger.info(f"开始处理站点: {site_name}")
+        success_count = 0
+        failure_count = 0
+        failed_messages = []
+        site_feedback = []
+        next_time = 0.0
+
+        for i, message in enumerate(messages):
+            wait_time = next_time - time.time()
+            if wait_time > 0:
+                logger.info(f"站点 {site_name} 等待 {wait_time:.0f} 秒后继续发送下一条消息...")
+                time.sleep(wait_time)
+            next_time = time.time() + self._interval_cnt
+            try:
+                feedback = self.send_message_to_site(site, message)
+                success_count += 1
+                if feedback:
+                    site_feedback.append(feedback)
+            except Exception as e:
+                logger.error(f"向站点 {site_name} 发送消息 '{message}' 失败: {str(e)}")
+                failure_count += 1
+                failed_messages.append(message)
+
+        return {
+            "success_count": success_count,
+            "failure_count": failure_count,
+            "failed_messages": failed_messages,
+            "feedback": site_feedback
+        }
+
+    def __get_cached_user(self, site_info: CommentedMap, key: str) -> Tuple[bool, Optional[str]]:
+        """
+        查询本次运行缓存的用户信息
+        :return: (是否已缓存, 值)
+        """
+        site_url = site_info.get("url", "").strip()
+        with self._user_cache_lock:
+            user = self._user_cache.get(site_url, {})
+            return key in user, user.get(key)
+
+    def __set_cached_user(self, site_info: CommentedMap, key: str, value: Optional[str]):
+        """
+        缓存用户信息，本次运行内同一站点只查询一次
+        """
+        site_url = site_info.get("url", "").strip()
+        with self._user_cache_lock:
+            self._user_cache.setdefault(site_url, {})[key] = value
+
     def send_message_to_site(self, site_info: CommentedMap, message: str):
         """
         向站点发送消息
@@ -1746,6 +1786,10 @@ class GroupChatZoneTest(_PluginBase):
         import re  # 确保导入re模块
         site_name = site_info.get("name", "").strip()
         site_url = site_info.get("url", "").strip()
+
+        cached, user_id = self.__get_cached_user(site_info, "user_id")
+        if cached:
+            return user_id
         
         try:
             # 访问个人信息页面
@@ -1773,6 +1817,7 @@ class GroupChatZoneTest(_PluginBase):
                 if userid_elem:
                     user_id = userid_elem.get('value')
             
+            self.__set_cached_user(site_info, "user_id", user_id)
             return user_id
         except Exception as e:
             logger.error(f"获取站点 {site_name} 的用户ID失败: {str(e)}")
@@ -1788,6 +1833,10 @@ class GroupChatZoneTest(_PluginBase):
         import re  # 确保导入re模块
         site_name = site_info.get("name", "").strip()
         site_url = site_info.get("url", "").strip()
+
+        cached, username = self.__get_cached_user(site_info, "username")
+        if cached:
+            return username
         
         try:
             # 访问个人信息页面
@@ -1828,6 +1877,7 @@ class GroupChatZoneTest(_PluginBase):
                         username = potential_username
                         break
             
+            self.__set_cached_user(site_info, "username", username)
             return username
         except Exception as e:
             logger.error(f"获取站点 {site_name} 的用户名失败: {str(e)}")
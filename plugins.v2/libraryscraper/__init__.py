@@ -1,7 +1,11 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 from pathlib import Path
 from threading import Event
-from typing import List, Tuple, Dict, Any
+from typing import List, Tuple, Dict, Any, Optional
 
 import pytz
 from apscheduler.schedulers.background import BackgroundScheduler
@@ -16,7 +20,6 @@ from app.helper.nfo import NfoReader
 from app.log import logger
 from app.plugins import _PluginBase
 from app.schemas import MediaType
-from app.utils.system import SystemUtils
 
 
 class LibraryScraper(_PluginBase):
@@ -27,7 +30,7 @@ class LibraryScraper(_PluginBase):
     # 插件图标
     plugin_icon = "scraper.png"
     # 插件版本
-    plugin_version = "2.1.1"
+    plugin_version = "2.2"
     # 插件作者
     plugin_author = "jxxghp"
     # 作者主页
@@ -53,6 +56,15 @@ class LibraryScraper(_PluginBase):
     _exclude_paths = ""
     # 退出事件
     _event = Event()
+    # 并发刮削数
+    _max_workers = 4
+    # 各接口最小调用间隔（秒）
+    _api_intervals = {
+        "recognize": 0.5,
+        "images": 0.5
+    }
+    _api_lock = threading.Lock()
+    _api_last_time: Dict[str, float] = {}
 
     def init_plugin(self, config: dict = None):
         self.mediachain = MediaChain()
@@ -302,11 +314,13 @@ class LibraryScraper(_PluginBase):
         if not self._scraper_paths:
             return
         # 排除目录
-        exclude_paths = self._exclude_paths.split("\n")
+        exclude_paths = [Path(path) for path in self._exclude_paths.split("\n") if path]
         # 已选择的目录
         paths = self._scraper_paths.split("\n")
-        # 需要适削的媒体文件夹
-        scraper_paths = []
+        # 需要适削的媒体文件夹 -> 目录最新修改时间
+        dir_mtimes: Dict[Path, float] = {}
+        # 需要适削的媒体文件夹 -> 媒体类型
+        dir_types: Dict[Path, MediaType] = {}
         for path in paths:
             if not path:
                 continue
@@ -324,50 +338,153 @@ class LibraryScraper(_PluginBase):
                 logger.warning(f"媒体库刮削路径不存在：{path}")
                 continue
             logger.info(f"开始检索目录：{path} {mtype} ...")
-            # 遍历所有文件
-            files = SystemUtils.list_files(scraper_path, settings.RMT_MEDIAEXT)
-            for file_path in files:
-                if self._event.is_set():
-                    logger.info(f"媒体库刮削服务停止")
-                    return
-                # 排除目录
-                exclude_flag = False
-                for exclude_path in exclude_paths:
+            self.__scan_dir(path=scraper_path, mtype=mtype, exclude_paths=exclude_paths,
+                            dir_mtimes=dir_mtimes, dir_types=dir_types, root=scraper_path)
+            if self._event.is_set():
+                logger.info(f"媒体库刮削服务停止")
+                return
+        if not dir_mtimes:
+            logger.info(f"未发现需要刮削的目录")
+            return
+        # 检查点：目录 -> 上次刮削完成时的修改时间，覆盖模式下不跳过
+        checkpoint: Dict[str, float] = self.get_data("checkpoint") or {}
+        scrape_items = []
+        for media_path, mtime in dir_mtimes.items():
+            if not self._mode and checkpoint.get(str(media_path), 0) >= mtime:
+                logger.debug(f"{media_path} 上次刮削后未发生变化，跳过 ...")
+                continue
+            scrape_items.append((media_path, dir_types.get(media_path)))
+        if not scrape_items:
+            logger.info(f"所有目录均未发生变化，无需刮削")
+            return
+        logger.info(f"共发现 {len(dir_mtimes)} 个目录，需要刮削 {len(scrape_items)} 个")
+        # 开始刮削
+        try:
+            with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+                futures = {executor.submit(self.__scrape_item, path=item[0], mtype=item[1]): item[0]
+                           for item in scrape_items}
+                for future in as_completed(futures):
+                    media_path = futures[future]
                     try:
-                        if file_path.is_relative_to(Path(exclude_path)):
-                            exclude_flag = True
-                            break
+                        if future.result():
+                            # 刮削会写入nfo和图片，以刮削后的修改时间作为检查点
+                            checkpoint[str(media_path)] = self.__get_dir_mtime(media_path)
                     except Exception as err:
-                        print(str(err))
-                if exclude_flag:
-                    logger.debug(f"{file_path} 在排除目录中，跳过 ...")
+                        logger.error(f"刮削目录 {media_path} 出错：{str(err)}")
+        finally:
+            # 清理已不存在的目录
+            checkpoint = {k: v for k, v in checkpoint.items() if Path(k).exists()}
+            self.save_data("checkpoint", checkpoint)
+        logger.info(f"媒体库刮削完成")
+
+    def __scan_dir(self, path: Path, mtype: Optional[MediaType], exclude_paths: List[Path],
+                   dir_mtimes: Dict[Path, float], dir_types: Dict[Path, MediaType], root: Path = None):
+        """
+        递归检索媒体文件夹，已收集的媒体文件夹下不再识别文件，仅更新修改时间
+        :param root: 刮削路径，只有其下的媒体文件夹才会跳过子目录的识别
+        """
+        root = root or path
+
+        def __below_root(_path: Path) -> bool:
+            return _path != root and _path.is_relative_to(root)
+
+        if self._event.is_set():
+            return
+        # 排除目录
+        for exclude_path in exclude_paths:
+            try:
+                if path.is_relative_to(exclude_path):
+                    logger.debug(f"{path} 在排除目录中，跳过 ...")
+                    return
+            except Exception as err:
+                print(str(err))
+        try:
+            path_mtime = path.stat().st_mtime
+            with os.scandir(path) as it:
+                entries = list(it)
+        except OSError as err:
+            logger.warn(f"读取目录 {path} 失败：{str(err)}")
+            return
+        # 当前目录是否已属于某个已收集的媒体文件夹
+        media_path = next((parent for parent in [path, *path.parents]
+                           if parent in dir_mtimes and __below_root(parent)), None)
+        if media_path:
+            dir_mtimes[media_path] = max(dir_mtimes[media_path], path_mtime)
+        else:
+            for entry in entries:
+                if not entry.is_file() or os.path.splitext(entry.name)[-1].lower() not in settings.RMT_MEDIAEXT:
                     continue
-                # 识别是电影还是电视剧
-                if not mtype:
-                    file_meta = MetaInfoPath(file_path)
-                    mtype = file_meta.type
+                file_path = Path(entry.path)
+                # 识别是电影还是电视剧，同一目录下只识别一次
+                file_mtype = mtype
+                if not file_mtype:
+                    file_mtype = MetaInfoPath(file_path).type
                 # 重命名格式
                 rename_format = settings.TV_RENAME_FORMAT \
-                    if mtype == MediaType.TV else settings.MOVIE_RENAME_FORMAT
+                    if file_mtype == MediaType.TV else settings.MOVIE_RENAME_FORMAT
                 # 计算重命名中的文件夹层数
                 rename_format_level = len(rename_format.split("/")) - 1
                 if rename_format_level < 1:
                     continue
                 # 取相对路径的第1层目录
-                media_path = file_path.parents[rename_format_level - 1]
-                dir_item = (media_path, mtype)
-                if dir_item not in scraper_paths:
-                    logger.info(f"发现目录：{dir_item}")
-                    scraper_paths.append(dir_item)
-        # 开始刮削
-        if scraper_paths:
-            for item in scraper_paths:
-                logger.info(f"开始刮削目录：{item[0]} ...")
-                self.__scrape_dir(path=item[0], mtype=item[1])
-        else:
-            logger.info(f"未发现需要刮削的目录")
+                media_path = file_path.parents[rename_format_level - 1] \
+                    if rename_format_level <= len(file_path.parents) else None
+                # 超出刮削路径时（如刮削路径下直接存放的文件、刮削路径本身是剧集目录）按文件所在目录处理
+                if not media_path or not __below_root(media_path):
+                    media_path = file_path.parent
+                logger.info(f"发现目录：{media_path} {file_mtype}")
+                try:
+                    media_mtime = max(media_path.stat().st_mtime, path_mtime)
+                except OSError:
+                    media_mtime = path_mtime
+                dir_mtimes[media_path] = media_mtime
+                dir_types[media_path] = file_mtype
+                break
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                self.__scan_dir(path=Path(entry.path), mtype=mtype, exclude_paths=exclude_paths,
+                                dir_mtimes=dir_mtimes, dir_types=dir_types, root=root)
+
+    @staticmethod
+    def __get_dir_mtime(path: Path) -> float:
+        """
+        获取目录及其子目录的最新修改时间
+        """
+        mtime = 0
+        stack = [str(path)]
+        while stack:
+            current = stack.pop()
+            try:
+                mtime = max(mtime, os.stat(current).st_mtime)
+                with os.scandir(current) as it:
+                    stack.extend(entry.path for entry in it if entry.is_dir(follow_symlinks=False))
+            except OSError:
+                continue
+        return mtime
 
-    def __scrape_dir(self, path: Path, mtype: MediaType):
+    def __wait_api(self, api: str):
+        """
+        按接口限速，保证同一接口两次调用间隔不小于设定值
+        """
+        interval = self._api_intervals.get(api) or 0
+        if not interval:
+            return
+        with self._api_lock:
+            wait = self._api_last_time.get(api, 0) + interval - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            self._api_last_time[api] = time.time()
+
+    def __scrape_item(self, path: Path, mtype: MediaType) -> bool:
+        """
+        在线程池中刮削一个目录
+        """
+        if self._event.is_set():
+            return False
+        logger.info(f"开始刮削目录：{path} ...")
+        return self.__scrape_dir(path=path, mtype=mtype)
+
+    def __scrape_dir(self, path: Path, mtype: MediaType) -> bool:
         """
         削刮一个目录，该目录必须是媒体文件目录
         """
@@ -389,15 +506,17 @@ class LibraryScraper(_PluginBase):
         if tmdbid:
             # 按TMDBID识别
             logger.info(f"读取到本地nfo文件的tmdbid：{tmdbid}")
+            self.__wait_api("recognize")
             mediainfo = self.chain.recognize_media(tmdbid=tmdbid, mtype=mtype)
         else:
             # 按名称识别
             meta = MetaInfoPath(path)
             meta.type = mtype
+            self.__wait_api("recognize")
             mediainfo = self.chain.recognize_media(meta=meta)
         if not mediainfo:
             logger.warn(f"未识别到媒体信息：{path}")
-            return
+            return False
 
         # 如果未开启新增已入库媒体是否跟随TMDB信息变化则根据tmdbid查询之前的title
         if not settings.SCRAP_FOLLOW_TMDB:
@@ -406,6 +525,7 @@ class LibraryScraper(_PluginBase):
             if transfer_history:
                 mediainfo.title = transfer_history.title
         # 获取图片
+        self.__wait_api("images")
         self.chain.obtain_images(mediainfo)
         # 刮削
         self.mediachain.scrape_metadata(
@@ -421,6 +541,7 @@ class LibraryScraper(_PluginBase):
             overwrite=True if self._mode else False
         )
         logger.info(f"{path} 刮削完成")
+        return True
 
     @staticmethod
     def __get_tmdbid_from_nfo(file_path: Path):
@@ -1,6 +1,8 @@
+import math
 import re
 import threading
 import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from typing import List, Tuple, Dict, Any, Optional
 
@@ -25,7 +27,7 @@ class QBRssBrush(_PluginBase):
     # 插件描述
     plugin_desc = "自动控制qBittorrent的RSS下载和上传流量管理"
     # 插件版本
-    plugin_version = "1.8"
+    plugin_version = "1.9"
     # 插件作者
     plugin_author = "lun"
     # 作者主页
@@ -60,10 +62,23 @@ class QBRssBrush(_PluginBase):
     _rss_upspeed_min = 0
     _rss_upspeed_max = 0
     _rss_aging_time = 0
-    _processed_torrents = set()
+    # 已处理的RSS条目，按处理时间排序 {title: timestamp}
+    _processed_torrents: OrderedDict = OrderedDict()
+    # 已处理条目保留数量
+    _processed_limit = 1000
+    # 种子价值随发布时间衰减的半衰期（小时）
+    _value_half_life = 4
+    # 体积匹配，只考虑GB
+    _size_pattern = re.compile(r'(\d+(\.\d+)?)\s*GB', re.IGNORECASE)
+    # 做种人数匹配
+    _seeders_pattern = re.compile(r'(?:seeders?|做种(?:人数|数)?)\s*[:：]?\s*(\d+)', re.IGNORECASE)
 
     def init_plugin(self, config: dict = None):
         self.downloader_helper = DownloaderHelper()
+        self._processed_torrents = OrderedDict(
+            (item.get("title"), item.get("time")) for item in (self.get_data("processed") or [])
+            if item.get("title")
+        )
         if config:
             self._enabled = config.get("enabled")
             self._onlyonce = config.get("onlyonce")
@@ -569,51 +584,36 @@ class QBRssBrush(_PluginBase):
                     if len(torrents) > 0:
                         # 删除种子
                         downlader_obj = self.__get_downloader(downloader)
+                        if self._event.is_set():
+                            logger.info(f"自动删种服务停止")
+                            return
+                        ids = [torrent.get("id") for torrent in torrents]
                         if self._action == "pause":
                             message_text = f"{downloader.title()} 共暂停{len(torrents)}个种子"
-                            for torrent in torrents:
-                                if self._event.is_set():
-                                    logger.info(f"自动删种服务停止")
-                                    return
-                                text_item = f"{torrent.get('name')} " \
-                                            f"来自站点：{torrent.get('site')} " \
-                                            f"大小：{StringUtils.str_filesize(torrent.get('size'))} " \
-                                            f"上传大小：{StringUtils.str_filesize(torrent.get('upsize'))}"
-                                # 暂停种子
-                                downlader_obj.stop_torrents(ids=[torrent.get("id")])
-                                logger.info(f"自动删种任务 暂停种子：{text_item}")
-                                message_text = f"{message_text}\n{text_item}"
+                            action_text = "暂停种子"
+                            # 暂停种子
+                            downlader_obj.stop_torrents(ids=ids)
                         elif self._action == "delete":
                             message_text = f"{downloader.title()} 共删除{len(torrents)}个种子"
-                            for torrent in torrents:
-                                if self._event.is_set():
-                                    logger.info(f"自动删种服务停止")
-                                    return
-                                text_item = f"{torrent.get('name')} " \
-                                            f"来自站点：{torrent.get('site')} " \
-                                            f"大小：{StringUtils.str_filesize(torrent.get('size'))} " \
-                                            f"上传大小：{StringUtils.str_filesize(torrent.get('upsize'))}"
-                                # 删除种子
-                                downlader_obj.delete_torrents(delete_file=False,
-                                                            ids=[torrent.get("id")])
-                                logger.info(f"自动删种任务 删除种子：{text_item}")
-                                message_text = f"{message_text}\n{text_item}"
+                            action_text = "删除种子"
+                            # 删除种子
+                            downlader_obj.delete_torrents(delete_file=False, ids=ids)
                         elif self._action == "deletefile":
                             message_text = f"{downloader.title()} 共删除{len(torrents)}个种子及文件"
+                            action_text = "删除种子及文件"
+                            # 先统一暂停，释放文件占用后再统一删除
+                            downlader_obj.stop_torrents(ids=ids)
+                            time.sleep(1)
+                            downlader_obj.delete_torrents(delete_file=True, ids=ids)
+                        else:
+                            message_text = action_text = ""
+                        if action_text:
                             for torrent in torrents:
-                                if self._event.is_set():
-                                    logger.info(f"自动删种服务停止")
-                                    return
                                 text_item = f"{torrent.get('name')} " \
                                             f"来自站点：{torrent.get('site')} " \
                                             f"大小：{StringUtils.str_filesize(torrent.get('size'))} " \
                                             f"上传大小：{StringUtils.str_filesize(torrent.get('upsize'))}"
-                                # 删除种子
-                                downlader_obj.stop_torrents(ids=[torrent.get("id")])
-                                time.sleep(1)
-                                downlader_obj.delete_torrents(delete_file=True,
-                                                            ids=[torrent.get("id")])
-                                logger.info(f"自动删种任务 删除种子及文件：{text_item}")
+                                logger.info(f"自动删种任务 {action_text}：{text_item}")
                                 message_text = f"{message_text}\n{text_item}"
                         if torrents and message_text and self._notify:
                             self.post_message(
@@ -703,19 +703,29 @@ class QBRssBrush(_PluginBase):
                 # 过滤掉过时的文章    
                 if self._rss_aging_time > 0 and item_date < time_threshold:
                     continue
+                # 跳过已处理或没有下载链接的文章
+                if not article_title or not article_link or article_title in self._processed_torrents:
+                    continue
                 # 使用正则表达式匹配体积大小，只考虑GB，并提取纯数字
-                match = re.search(r'(\d+(\.\d+)?)\s*GB', article_title)
+                match = self._size_pattern.search(article_title)
                 if match is None:
                     continue
-                # 如果文章未处理过且有下载链接
-                if article_title and article_link and article_title not in self._processed_torrents:
-                    rss_items.append(
-                            {
-                                "title": article_title,
-                                "url": article_link,
-                                "size": match.group(1)  # 纯数字,GB
-                            }
-                    )
+                # 做种人数，RSS中没有时为None
+                seeders = article_data.get("seeders")
+                if seeders is not None and str(seeders).isdigit():
+                    seeders = int(seeders)
+                else:
+                    seeders_match = self._seeders_pattern.search(article_data.get("description") or "")
+                    seeders = int(seeders_match.group(1)) if seeders_match else None
+                rss_items.append(
+                        {
+                            "title": article_title,
+                            "url": article_link,
+                            "size": float(match.group(1)),  # 纯数字,GB
+                            "date": item_date,
+                            "seeders": seeders
+                        }
+                )
                     
             logger.info(f"RSS检查完成，新增{len(rss_items)}个文章")
             return rss_items
@@ -735,7 +745,9 @@ class QBRssBrush(_PluginBase):
             added_count = 0
             total_size = 0.0  # 用于存储总大小
             added_items = []  # 用于存储添加的任务名称
-            #刷新RSS并添加下载任务
+            # 汇总所有RSS中符合条件的条目
+            candidates = {}
+            regex = re.compile(self._rss_regex) if self._rss_regex else None
             rss_names = self._rss_name.split(",")
             for rss_name in rss_names:
 
@@ -749,34 +761,39 @@ class QBRssBrush(_PluginBase):
                 # 根据正则表达式过滤条目
                 for item in rss_items:
                     item_title = item.get("title", "")
-                    item_url = item.get("url", "")
-                    item_size = float(item.get("size", ""))
-                    # 使用正则表达式匹配
-                    if re.search(self._rss_regex, item_title):
-                        if item_size > remain_size:
-                            logger.info(f"任务体积过大，剩余空间（{remain_size:.2f}GB）不足，跳过: {item_title}")
-                            continue
-                        # 添加下载任务
-                        logger.info(f"添加下载任务: {item_title}")
-                        success = downloader_obj.add_torrent(
-                            content=item_url,
-                            is_paused=False,
-                            download_dir=None,
-                            category=self._rss_category,
-                            tag=None
-                        )
-                        
-                        if success:
-                            added_count += 1
-                            total_size += item_size  # 累加总大小
-                            added_items.append(item_title)  # 收集添加的任务名称
-                            if len(self._processed_torrents) > 1000:  # 设置一个合理的上限
-                                self._processed_torrents = set(list(self._processed_torrents)[-500:])
-                            self._processed_torrents.add(item_title)
-                            remain_size = remain_size - item_size
-                        else:
-                            logger.error(f"添加下载任务失败: {item_title}")
-            
+                    if regex and not regex.search(item_title):
+                        continue
+                    if item.get("size") > remain_size:
+                        logger.info(f"任务体积过大，剩余空间（{remain_size:.2f}GB）不足，跳过: {item_title}")
+                        continue
+                    candidates.setdefault(item_title, item)
+
+            # 按单位体积价值选择本次添加的条目
+            for item in self.__plan_admission(list(candidates.values()), remain_size):
+                item_title = item.get("title")
+                item_size = item.get("size")
+                # 添加下载任务
+                logger.info(f"添加下载任务: {item_title}，体积 {item_size:.2f}GB，价值 {item.get('value'):.2f}")
+                success = downloader_obj.add_torrent(
+                    content=item.get("url"),
+                    is_paused=False,
+                    download_dir=None,
+                    category=self._rss_category,
+                    tag=None
+                )
+
+                if success:
+                    added_count += 1
+                    total_size += item_size  # 累加总大小
+                    added_items.append(item_title)  # 收集添加的任务名称
+                    self.__mark_processed(item_title)
+                    remain_size = remain_size - item_size
+                else:
+                    logger.error(f"添加下载任务失败: {item_title}")
+            if added_count > 0:
+                self.save_data("processed", [{"title": title, "time": t}
+                                             for title, t in self._processed_torrents.items()])
+
             if added_count > 0:
                 added_items_str = ', '.join(added_items)
                 logger.info(f"本次RSS刷新共添加了 {added_count} 个下载任务，总大小为 {total_size:.2f}GB，剩余空间 {remain_size:.2f}GB，任务名称: {added_items_str}")
@@ -791,6 +808,56 @@ class QBRssBrush(_PluginBase):
         except Exception as e:
             logger.error(f"RSS刷新异常：{str(e)}")
 
+    def __mark_processed(self, title: str):
+        """
+        记录已处理条目，超过上限时淘汰最早处理的条目
+        """
+        self._processed_torrents[title] = int(time.time())
+        self._processed_torrents.move_to_end(title)
+        while len(self._processed_torrents) > self._processed_limit:
+            self._processed_torrents.popitem(last=False)
+
+    def __item_value(self, item: dict) -> float:
+        """
+        估算条目的上传价值：体积越大、发布越新、做种人数越少，价值越高
+        """
+        age_hours = max((datetime.now(pytz.UTC) - item.get("date")).total_seconds() / 3600, 0) \
+            if item.get("date") else 0
+        freshness = 0.5 ** (age_hours / self._value_half_life)
+        seeders = item.get("seeders")
+        demand = 10 / (10 + seeders) if seeders is not None else 1
+        return item.get("size") * freshness * demand
+
+    def __plan_admission(self, items: List[dict], remain_size: float) -> List[dict]:
+        """
+        在剩余空间内选择总价值最高的条目（0-1背包），按单位体积价值降序返回
+        """
+        for item in items:
+            item["value"] = self.__item_value(item)
+        items = sorted(items, key=lambda x: x.get("value") / max(x.get("size"), 0.01), reverse=True)
+        if sum(item.get("size") for item in items) <= remain_size:
+            return items
+        # 体积离散化，容量最多2000格，向上取整保证不超出剩余空间
+        unit = max(0.1, remain_size / 2000)
+        capacity = int(remain_size / unit)
+        weights = [max(math.ceil(item.get("size") / unit), 1) for item in items]
+        best = [0.0] * (capacity + 1)
+        keep = [[False] * (capacity + 1) for _ in items]
+        for i, item in enumerate(items):
+            weight = weights[i]
+            for c in range(capacity, weight - 1, -1):
+                value = best[c - weight] + item.get("value")
+                if value > best[c]:
+                    best[c] = value
+                    keep[i][c] = True
+        chosen = []
+        c = capacity
+        for i in range(len(items) - 1, -1, -1):
+            if keep[i][c]:
+                chosen.append(items[i])
+                c -= weights[i]
+        return list(reversed(chosen))
+
     def __get_qb_torrent(self, torrent: Any) -> Optional[dict]:
         """
         检查QB下载任务是否符合条件
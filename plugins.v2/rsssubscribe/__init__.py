@@ -1,5 +1,8 @@
 import datetime
+import hashlib
+import json
 import re
+import time
 import traceback
 from pathlib import Path
 from threading import Lock
@@ -16,9 +19,9 @@ from app.chain.subscribe import SubscribeChain
 from app.core.config import settings
 from app.core.context import MediaInfo, TorrentInfo, Context
 from app.core.metainfo import MetaInfo
-from app.helper.rss import RssHelper
 from app.log import logger
 from app.plugins import _PluginBase
+from app.plugins.rsssubscribe.feedfetcher import FeedFetcher
 from app.schemas import ExistMediaInfo
 from app.schemas.types import SystemConfigKey, MediaType
 
@@ -33,7 +36,7 @@ class RssSubscribe(_PluginBase):
     # 插件图标
     plugin_icon = "rss.png"
     # 插件版本
-    plugin_version = "2.1"
+    plugin_version = "2.3"
     # 插件作者
     plugin_author = "jxxghp"
     # 作者主页
@@ -48,7 +51,6 @@ class RssSubscribe(_PluginBase):
     # 私有变量
     _scheduler: Optional[BackgroundScheduler] = None
     _cache_path: Optional[Path] = None
-    rsshelper = None
     downloadchain = None
     searchchain = None
     subscribechain = None
@@ -68,9 +70,15 @@ class RssSubscribe(_PluginBase):
     _action: str = "subscribe"
     _save_path: str = ""
     _size_range: str = ""
+    # 历史记录保留条数及天数
+    _history_limit: int = 2000
+    _history_days: int = 180
+    # 未通过检查的标题缓存时间（秒）
+    _reject_ttl: int = 12 * 3600
+    # RSS缓存校验信息有效期（秒），超时后完整获取一次
+    _feed_max_age: int = 12 * 3600
 
     def init_plugin(self, config: dict = None):
-        self.rsshelper = RssHelper()
         self.downloadchain = DownloadChain()
         self.searchchain = SearchChain()
         self.subscribechain = SubscribeChain()
@@ -616,17 +624,26 @@ class RssSubscribe(_PluginBase):
         # 读取历史记录
         if self._clearflag:
             history = []
+            rejected = {}
         else:
             history: List[dict] = self.get_data('history') or []
-        for url in self._address.split("\n"):
+            rejected = self.__load_rejected()
+        # 已处理的标题索引
+        history_keys = {h.get("key") for h in history}
+        # 并发获取所有RSS，未变化的RSS服务端返回304
+        urls = [url.strip() for url in self._address.split("\n") if url.strip()]
+        validators = self.__load_validators()
+        feeds = FeedFetcher(proxies=settings.PROXY if self._proxy else None).fetch_all(urls, validators)
+        for url, feed in feeds.items():
             # 处理每一个RSS链接
-            if not url:
-                continue
             logger.info(f"开始刷新RSS：{url} ...")
-            results = self.rsshelper.parse(url, proxy=self._proxy)
+            if feed.not_modified:
+                logger.info(f"RSS {url} 无变化，跳过")
+                continue
+            results = feed.items
             if not results:
                 logger.error(f"未获取到RSS数据：{url}")
-                return
+                continue
             # 过滤规则
             filter_groups = self.systemconfig.get(SystemConfigKey.SubscribeFilterRuleGroups)
             # 解析数据
@@ -639,33 +656,43 @@ class RssSubscribe(_PluginBase):
                     size = result.get("size")
                     pubdate: datetime.datetime = result.get("pubdate")
                     # 检查是否处理过
-                    if not title or title in [h.get("key") for h in history]:
+                    if not title or title in history_keys:
+                        continue
+                    # 检查是否近期已被过滤
+                    if title in rejected:
+                        logger.debug(f"{title} 近期已检查：{rejected[title].get('reason')}，跳过")
                         continue
                     # 检查规则
                     if self._include and not re.search(r"%s" % self._include,
                                                        f"{title} {description}", re.IGNORECASE):
                         logger.info(f"{title} - {description} 不符合包含规则")
+                        self.__reject(rejected, title, "不符合包含规则")
                         continue
                     if self._exclude and re.search(r"%s" % self._exclude,
                                                    f"{title} {description}", re.IGNORECASE):
                         logger.info(f"{title} - {description} 不符合排除规则")
+                        self.__reject(rejected, title, "不符合排除规则")
                         continue
                     if self._size_range:
                         sizes = [float(_size) * 1024 ** 3 for _size in self._size_range.split("-")]
                         if len(sizes) == 1 and float(size) < sizes[0]:
                             logger.info(f"{title} - 种子大小不符合条件")
+                            self.__reject(rejected, title, "种子大小不符合条件")
                             continue
                         elif len(sizes) > 1 and not sizes[0] <= float(size) <= sizes[1]:
                             logger.info(f"{title} - 种子大小不在指定范围")
+                            self.__reject(rejected, title, "种子大小不在指定范围")
                             continue
                     # 识别媒体信息
                     meta = MetaInfo(title=title, subtitle=description)
                     if not meta.name:
                         logger.warn(f"{title} 未识别到有效数据")
+                        self.__reject(rejected, title, "未识别到有效数据")
                         continue
                     mediainfo: MediaInfo = self.chain.recognize_media(meta=meta)
                     if not mediainfo:
                         logger.warn(f'未识别到媒体信息，标题：{title}')
+                        self.__reject(rejected, title, "未识别到媒体信息")
                         continue
                     # 种子
                     torrentinfo = TorrentInfo(
@@ -686,6 +713,7 @@ class RssSubscribe(_PluginBase):
                         )
                         if not result:
                             logger.info(f"{title} {description} 不匹配过滤规则")
+                            self.__reject(rejected, title, "不匹配过滤规则")
                             continue
                     # 媒体库已存在的剧集
                     exist_info: Optional[ExistMediaInfo] = self.chain.media_exists(mediainfo=mediainfo)
@@ -696,10 +724,12 @@ class RssSubscribe(_PluginBase):
                                 exist_episodes = exist_season.get(meta.begin_season)
                                 if exist_episodes and set(meta.episode_list).issubset(set(exist_episodes)):
                                     logger.info(f'{mediainfo.title_year} {meta.season_episode} 己存在')
+                                    self.__reject(rejected, title, "媒体库中已存在")
                                     continue
                     elif exist_info:
                         # 电影已存在
                         logger.info(f'{mediainfo.title_year} 己存在')
+                        self.__reject(rejected, title, "媒体库中已存在")
                         continue
                     # 下载或订阅
                     if self._action == "download":
@@ -721,6 +751,7 @@ class RssSubscribe(_PluginBase):
                         subflag = self.subscribechain.exists(mediainfo=mediainfo, meta=meta)
                         if subflag:
                             logger.info(f'{mediainfo.title_year} {meta.season} 正在订阅中')
+                            self.__reject(rejected, title, "正在订阅中")
                             continue
                         # 添加订阅
                         self.subscribechain.add(title=mediainfo.title,
@@ -741,14 +772,92 @@ class RssSubscribe(_PluginBase):
                         "tmdbid": mediainfo.tmdb_id,
                         "time": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
                     })
+                    history_keys.add(title)
                 except Exception as err:
                     logger.error(f'刷新RSS数据出错：{str(err)} - {traceback.format_exc()}')
+            # 处理完成后才记录校验信息，保证未处理的内容下次仍会获取
+            validators[url] = {**feed.validator, "time": time.time()}
             logger.info(f"RSS {url} 刷新完成")
         # 保存历史记录
-        self.save_data('history', history)
+        self.save_data('history', self.__trim_history(history))
+        self.__save_rejected(rejected)
+        self.__save_validators({url: validators[url] for url in urls if url in validators})
         # 缓存只清理一次
         self._clearflag = False
 
+    def __trim_history(self, history: List[dict]) -> List[dict]:
+        """
+        按保留天数和条数清理历史记录
+        """
+        now = datetime.datetime.now()
+        # 旧版本的历史记录没有时间，视为新记录补上当前时间，之后再按保留天数清理
+        for h in history:
+            if not h.get("time"):
+                h["time"] = now.strftime("%Y-%m-%d %H:%M:%S")
+        expire_time = (now - datetime.timedelta(days=self._history_days)).strftime("%Y-%m-%d %H:%M:%S")
+        history = [h for h in history if h.get("time") >= expire_time]
+        if len(history) > self._history_limit:
+            history = sorted(history, key=lambda x: x.get("time"))[-self._history_limit:]
+        return history
+
+    def __reject_sign(self) -> str:
+        """
+        影响检查结果的配置摘要，配置变化后过滤缓存失效
+        """
+        # 开启过滤规则时，规则组及其引用的规则内容变化也需要重新检查
+        filter_rules = None
+        if self._filter:
+            filter_rules = [self.systemconfig.get(key) for key in (
+                SystemConfigKey.SubscribeFilterRuleGroups,
+                getattr(SystemConfigKey, "UserFilterRuleGroups", None),
+                getattr(SystemConfigKey, "CustomFilterRules", None)
+            ) if key]
+        filter_sign = json.dumps(filter_rules, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.md5(f"{self._include}|{self._exclude}|{self._size_range}|"
+                           f"{self._filter}|{self._action}|{filter_sign}".encode()).hexdigest()
+
+    def __load_validators(self) -> Dict[str, dict]:
+        """
+        加载RSS缓存校验信息，清理历史、配置变化或超过有效期时不使用
+        """
+        if self._clearflag or self.get_data('validators_sign') != self.__reject_sign():
+            return {}
+        now = time.time()
+        return {k: v for k, v in (self.get_data('validators') or {}).items()
+                if now - v.get("time", 0) < self._feed_max_age}
+
+    def __save_validators(self, validators: Dict[str, dict]):
+        """
+        保存RSS缓存校验信息
+        """
+        self.save_data('validators', validators)
+        self.save_data('validators_sign', self.__reject_sign())
+
+    def __load_rejected(self) -> Dict[str, dict]:
+        """
+        加载未过期的过滤缓存
+        """
+        if self.get_data('rejected_sign') != self.__reject_sign():
+            return {}
+        now = time.time()
+        return {k: v for k, v in (self.get_data('rejected') or {}).items() if v.get("expire", 0) > now}
+
+    def __save_rejected(self, rejected: Dict[str, dict]):
+        """
+        保存过滤缓存
+        """
+        self.save_data('rejected', rejected)
+        self.save_data('rejected_sign', self.__reject_sign())
+
+    def __reject(self, rejected: Dict[str, dict], title: str, reason: str):
+        """
+        记录未通过检查的标题，缓存期内不再重复识别
+        """
+        rejected[title] = {
+            "reason": reason,
+            "expire": time.time() + self._reject_ttl
+        }
+
     def __log_and_notify_error(self, message):
         """
         记录错误日志并发送系统通知
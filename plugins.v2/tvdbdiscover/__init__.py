@@ -1,7 +1,12 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from typing import Any, List, Dict, Tuple, Optional
 
-from cachetools import cached, TTLCache
-
 from app import schemas
 from app.core.config import settings
 from app.core.event import eventmanager, Event
@@ -20,7 +25,7 @@ class TvdbDiscover(_PluginBase):
     # 插件图标
     plugin_icon = "TheTVDB_A.png"
     # 插件版本
-    plugin_version = "1.1"
+    plugin_version = "1.2"
     # 插件作者
     plugin_author = "jxxghp"
     # 作者主页
@@ -37,12 +42,29 @@ class TvdbDiscover(_PluginBase):
     _enabled = False
     _proxy = False
     _api_key = None
+    # TVDB每页固定条数
+    _tvdb_page_size = 500
+    # 缓存新鲜期（秒），超过后先返回旧数据再后台刷新
+    _cache_fresh_ttl = 1800
+    # 缓存最长保留时间（秒）
+    _cache_stale_ttl = 7 * 24 * 3600
+    # token有效期（秒），TheTVDB token有效期为一个月
+    _token_ttl = 25 * 24 * 3600
+    _token: Optional[str] = None
+    _token_lock = threading.Lock()
+    # 后台刷新及预取
+    _executor: Optional[ThreadPoolExecutor] = None
+    _pending = set()
+    _pending_lock = threading.Lock()
 
     def init_plugin(self, config: dict = None):
         if config:
             self._enabled = config.get("enabled")
             self._proxy = config.get("proxy")
             self._api_key = config.get("api_key")
+        self._token = None
+        self._executor = ThreadPoolExecutor(max_workers=2)
+        self.__clean_cache()
 
     def get_state(self) -> bool:
         return self._enabled
@@ -145,50 +167,187 @@ class TvdbDiscover(_PluginBase):
     def get_page(self) -> List[dict]:
         pass
 
-    @cached(cache=TTLCache(maxsize=1, ttl=30 * 24 * 3600))
-    def __get_token(self) -> Optional[str]:
+    def __get_token(self, refresh: bool = False) -> Optional[str]:
         """
-        根据APIKEY获取token使用
+        根据APIKEY获取token使用，token持久化保存，重启及多进程共用
         """
-        api_url = f"{self._base_api}/login"
-        headers = {
-            "Accept": "application/json",
-            "Content-Type": "application/json"
-        }
-        data = {
-            "apikey": self._api_key
-        }
-        res = RequestUtils(headers=headers).post_res(
-            api_url,
-            json=data,
-            proxies=settings.PROXY if self._proxy else None
-        )
-        if not res:
-            logger.error("获取TheMovieDB token失败")
-            return None
-        return res.json().get("data", {}).get("token")
+        with self._token_lock:
+            if not refresh:
+                if self._token:
+                    return self._token
+                token_data = self.get_data("token") or {}
+                if token_data.get("token") \
+                        and token_data.get("apikey") == self.__apikey_digest() \
+                        and time.time() - token_data.get("time", 0) < self._token_ttl:
+                    self._token = token_data.get("token")
+                    return self._token
+            api_url = f"{self._base_api}/login"
+            headers = {
+                "Accept": "application/json",
+                "Content-Type": "application/json"
+            }
+            data = {
+                "apikey": self._api_key
+            }
+            res = RequestUtils(headers=headers).post_res(
+                api_url,
+                json=data,
+                proxies=settings.PROXY if self._proxy else None
+            )
+            if not res:
+                logger.error("获取TheMovieDB token失败")
+                return None
+            self._token = res.json().get("data", {}).get("token")
+            if self._token:
+                self.save_data("token", {
+                    "token": self._token,
+                    "apikey": self.__apikey_digest(),
+                    "time": time.time()
+                })
+            return self._token
 
-    @cached(cache=TTLCache(maxsize=32, ttl=1800))
-    def __request(self, mtype: str, **kwargs):
+    def __apikey_digest(self) -> str:
         """
-        请求TheTVDB API
+        APIKEY摘要，APIKEY变化后token失效
+        """
+        return hashlib.sha256(str(self._api_key).encode()).hexdigest()
+
+    def __request_api(self, mtype: str, params: dict) -> Optional[list]:
+        """
+        请求TheTVDB API，token失效时重新获取一次
         """
         api_url = f"{self._base_api}/{mtype}/filter"
-        headers = {
-            "Accept": "application/json",
-            "Authorization": f"Bearer {self.__get_token()}"
-        }
-        res = RequestUtils(headers=headers).get_res(
-            api_url,
-            params=kwargs,
-            proxies=settings.PROXY if self._proxy else None
-        )
+        res = None
+        for refresh in (False, True):
+            headers = {
+                "Accept": "application/json",
+                "Authorization": f"Bearer {self.__get_token(refresh=refresh)}"
+            }
+            res = RequestUtils(headers=headers).get_res(
+                api_url,
+                params=params,
+                proxies=settings.PROXY if self._proxy else None
+            )
+            if res is None or res.status_code != 401:
+                break
         if res is None:
             raise Exception("无法连接TheTVDB，请检查网络连接！")
         if not res.ok:
             raise Exception(f"请求TheTVDB API失败：{res.text}")
         return res.json().get("data")
 
+    @staticmethod
+    def __cache_key(mtype: str, params: dict) -> str:
+        """
+        按规范化的筛选参数生成缓存键，忽略空参数及参数顺序
+        """
+        normalized = {k: str(v) for k, v in params.items() if v not in (None, "")}
+        return hashlib.sha256(json.dumps([mtype, normalized], sort_keys=True).encode()).hexdigest()
+
+    def __cache_file(self, key: str) -> Path:
+        return self.get_data_path() / "cache" / f"{key}.json"
+
+    def __read_cache(self, key: str) -> Optional[dict]:
+        """
+        读取缓存 {"time": 缓存时间, "data": 数据}
+        """
+        cache_file = self.__cache_file(key)
+        try:
+            if not cache_file.exists():
+                return None
+            cache = json.loads(cache_file.read_text(encoding="utf-8"))
+            if time.time() - cache.get("time", 0) > self._cache_stale_ttl:
+                return None
+            return cache
+        except Exception as err:
+            logger.debug(f"读取TheTVDB缓存失败：{str(err)}")
+            return None
+
+    def __write_cache(self, key: str, data: list):
+        """
+        写入缓存，先写临时文件再替换，避免并发读取到不完整的数据
+        """
+        cache_file = self.__cache_file(key)
+        try:
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp_file = cache_file.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            tmp_file.write_text(json.dumps({"time": time.time(), "data": data}, ensure_ascii=False),
+                                encoding="utf-8")
+            tmp_file.replace(cache_file)
+        except Exception as err:
+            logger.warn(f"写入TheTVDB缓存失败：{str(err)}")
+
+    def __clean_cache(self):
+        """
+        清理过期的缓存文件
+        """
+        try:
+            cache_path = self.get_data_path() / "cache"
+            if not cache_path.exists():
+                return
+            expire_time = time.time() - self._cache_stale_ttl
+            for cache_file in cache_path.iterdir():
+                if cache_file.is_file() and cache_file.stat().st_mtime < expire_time:
+                    cache_file.unlink()
+        except Exception as err:
+            logger.warn(f"清理TheTVDB缓存失败：{str(err)}")
+
+    def __refresh(self, mtype: str, params: dict, key: str):
+        """
+        后台刷新缓存
+        """
+        try:
+            data = self.__request_api(mtype, params)
+            if data is not None:
+                self.__write_cache(key, data)
+        except Exception as err:
+            logger.warn(f"后台刷新TheTVDB数据失败：{str(err)}")
+        finally:
+            with self._pending_lock:
+                self._pending.discard(key)
+
+    def __submit_refresh(self, mtype: str, params: dict, key: str):
+        """
+        提交后台刷新任务，同一缓存键同时只刷新一次
+        """
+        if not self._executor:
+            return
+        with self._pending_lock:
+            if key in self._pending:
+                return
+            self._pending.add(key)
+        try:
+            self._executor.submit(self.__refresh, mtype, params, key)
+        except RuntimeError:
+            # 插件停止后线程池已关闭
+            with self._pending_lock:
+                self._pending.discard(key)
+
+    def __request(self, mtype: str, **kwargs) -> Optional[list]:
+        """
+        请求TheTVDB API，优先使用磁盘缓存，缓存过期时先返回旧数据再后台刷新
+        """
+        key = self.__cache_key(mtype, kwargs)
+        cache = self.__read_cache(key)
+        if cache:
+            if time.time() - cache.get("time", 0) > self._cache_fresh_ttl:
+                self.__submit_refresh(mtype, kwargs, key)
+            return cache.get("data")
+        data = self.__request_api(mtype, kwargs)
+        if data is not None:
+            self.__write_cache(key, data)
+        return data
+
+    def __prefetch(self, mtype: str, **kwargs):
+        """
+        后台预取数据，已有新鲜缓存时跳过
+        """
+        key = self.__cache_key(mtype, kwargs)
+        cache = self.__read_cache(key)
+        if cache and time.time() - cache.get("time", 0) <= self._cache_fresh_ttl:
+            return
+        self.__submit_refresh(mtype, kwargs, key)
+
     def tvdb_discover(self, apikey: str, mtype: str = "series",
                       company: int = None, contentRating: int = None, country: str = "usa",
                       genre: int = None, lang: str = "eng", sort: str = "score", sortType: str = "desc",
@@ -282,35 +441,42 @@ class TvdbDiscover(_PluginBase):
 
         if apikey != settings.API_TOKEN:
             return []
+        params = {
+            "company": company,
+            "contentRating": contentRating,
+            "country": country,
+            "genre": genre,
+            "lang": lang,
+            "sort": sort,
+            "sortType": sortType,
+            "status": status,
+            "year": year
+        }
+        # 计算页码，TVDB为固定每页500条
+        start = (page - 1) * count
+        req_page, offset = divmod(start, self._tvdb_page_size)
         try:
-            # 计算页码，TVDB为固定每页500条
-            if page * count > 500:
-                req_page = 500 // count
-            else:
-                req_page = page - 1
-            result = self.__request(
-                mtype,
-                company=company,
-                contentRating=contentRating,
-                country=country,
-                genre=genre,
-                lang=lang,
-                sort=sort,
-                sortType=sortType,
-                status=status,
-                year=year,
-                page=req_page
-            )
+            result = self.__request(mtype, page=req_page, **params)
         except Exception as err:
             logger.error(str(err))
             return []
         if not result:
             return []
+        # 不足500条时已是最后一页
+        has_more = len(result) >= self._tvdb_page_size
+        result = result[offset:offset + count]
+        if has_more and len(result) < count:
+            # 本页跨越两个TVDB分页，补齐剩余条目
+            try:
+                result += (self.__request(mtype, page=req_page + 1, **params) or [])[:count - len(result)]
+            except Exception as err:
+                logger.error(str(err))
+        elif has_more and (start + 2 * count - 1) // self._tvdb_page_size != req_page:
+            # 下一页需要下一个TVDB分页的数据，后台预取
+            self.__prefetch(mtype, page=req_page + 1, **params)
         if mtype == "movies":
-            results = [__movie_to_media(movie) for movie in result]
-        else:
-            results = [__series_to_media(series) for series in result]
-        return results[(page - 1) * count:page * count]
+            return [__movie_to_media(movie) for movie in result]
+        return [__series_to_media(series) for series in result]
 
     @staticmethod
     def tvdb_filter_ui() -> List[dict]:
@@ -640,4 +806,6 @@ class TvdbDiscover(_PluginBase):
         """
         退出插件
         """
-        pass
+        if self._executor:
+            self._executor.shutdown(wait=False)
+            self._executor = None
@@ -4,7 +4,7 @@ import time
 import zipfile
 from datetime import datetime, timedelta
 from pathlib import Path
-from typing import List, Tuple, Dict, Any
+from typing import List, Tuple, Dict, Any, Optional
 
 import pytz
 import requests
@@ -18,6 +18,7 @@ from app.core.config import settings
 from app.core.event import eventmanager, Event
 from app.log import logger
 from app.plugins import _PluginBase
+from app.plugins.cloudflarespeedtest.prober import CloudflareProber, CLOUDFLARE_IPV4, CLOUDFLARE_IPV6
 from app.schemas.types import EventType, NotificationType
 from app.utils.http import RequestUtils
 from app.utils.ip import IpUtils
@@ -32,7 +33,7 @@ class CloudflareSpeedTest(_PluginBase):
     # 插件图标
     plugin_icon = "cloudflare.jpg"
     # 插件版本
-    plugin_version = "1.4"
+    plugin_version = "1.5"
     # 插件作者
     plugin_author = "thsrite"
     # 作者主页
@@ -57,6 +58,14 @@ class CloudflareSpeedTest(_PluginBase):
     _re_install = False
     _notify = False
     _check = False
+    # 内置测速，无需下载CloudflareST
+    _builtin = False
+    # 最多测试的IP数
+    _max_ips = 1000
+    # 下载测速地址，为空不测速
+    _speed_url = None
+    # 下载测速的IP数
+    _speed_top_n = 5
     _cf_path = None
     _cf_ipv4 = None
     _cf_ipv6 = None
@@ -80,6 +89,12 @@ class CloudflareSpeedTest(_PluginBase):
             self._additional_args = config.get("additional_args")
             self._notify = config.get("notify")
             self._check = config.get("check")
+            self._builtin = config.get("builtin", False)
+            try:
+                self._max_ips = int(config.get("max_ips") or 1000)
+            except ValueError:
+                self._max_ips = 1000
+            self._speed_url = config.get("speed_url")
 
         if (self._ipv4 or self._ipv6) and self._onlyonce:
             try:
@@ -138,12 +153,6 @@ class CloudflareSpeedTest(_PluginBase):
             self.__update_config()
             logger.warn(f"Cloudflare CDN优选未指定ip类型，默认ipv4")
 
-        err_flag, release_version = self.__check_environment()
-        if err_flag and release_version:
-            # 更新版本
-            self._version = release_version
-            self.__update_config()
-
         hosts = customHosts.get("hosts")
         if isinstance(hosts, str):
             hosts = str(hosts).split('\n')
@@ -152,92 +161,147 @@ class CloudflareSpeedTest(_PluginBase):
             self.__check_cf_ip(hosts=hosts)
 
         # 开始优选
-        if err_flag:
-            logger.info("正在进行CLoudflare CDN优选，请耐心等待")
-            # 执行优选命令，-dd不测速
-            if SystemUtils.is_windows():
-                cf_command = f'cd \"{self._cf_path}\" && CloudflareST {self._additional_args} -o \"{self._result_file}\"' + (
-                    f' -f \"{self._cf_ipv4}\"' if self._ipv4 else '') + (
-                                 f' -f \"{self._cf_ipv6}\"' if self._ipv6 else '')
-            else:
-                cf_command = f'cd {self._cf_path} && chmod a+x {self._binary_name} && ./{self._binary_name} {self._additional_args} -o {self._result_file}' + (
-                    f' -f {self._cf_ipv4}' if self._ipv4 else '') + (f' -f {self._cf_ipv6}' if self._ipv6 else '')
-            logger.info(f'正在执行优选命令 {cf_command}')
-            if SystemUtils.is_windows():
-                process = subprocess.Popen(cf_command, shell=True)
-                # 执行命令后无法退出 采用异步和设置超时方案
-                # 设置超时时间为120秒
-                if cf_command.__contains__("-dd"):
-                    time.sleep(120)
-                else:
-                    time.sleep(600)
-                # 如果没有在120秒内完成任务，那么杀死该进程
-                if process.poll() is None:
-                    os.system('taskkill /F /IM CloudflareST.exe')
-            else:
-                os.system(cf_command)
+        if self._builtin:
+            best_ip = self.__builtin_speedtest()
+            if not best_ip:
+                logger.error("Cloudflare CDN内置测速未获取到可用ip，请检查网络")
+                return
+        else:
+            err_flag, release_version = self.__check_environment()
+            if err_flag and release_version:
+                # 更新版本
+                self._version = release_version
+                self.__update_config()
+            if not err_flag:
+                logger.error("获取到最优ip格式错误，请重试")
+                self._onlyonce = False
+                self.__update_config()
+                self.stop_service()
+                return
+            best_ip = self.__binary_speedtest()
+        logger.info(f"\n获取到最优ip==>[{best_ip}]")
 
-            # 获取优选后最优ip
-            if SystemUtils.is_windows():
-                powershell_command = f"powershell.exe -Command \"Get-Content \'{self._result_file}\' | Select-Object -Skip 1 -First 1 | Write-Output\""
-                logger.info(f'正在执行powershell命令 {powershell_command}')
-                best_ip = SystemUtils.execute(powershell_command)
-                best_ip = best_ip.split(',')[0]
+        # 替换自定义Hosts插件数据库hosts
+        if IpUtils.is_ipv4(best_ip) or IpUtils.is_ipv6(best_ip):
+            if best_ip == self._cf_ip:
+                logger.info(f"CloudflareSpeedTest CDN优选ip未变，不做处理")
             else:
-                best_ip = SystemUtils.execute("sed -n '2,1p' " + self._result_file + " | awk -F, '{print $1}'")
-            logger.info(f"\n获取到最优ip==>[{best_ip}]")
-
-            # 替换自定义Hosts插件数据库hosts
-            if IpUtils.is_ipv4(best_ip) or IpUtils.is_ipv6(best_ip):
-                if best_ip == self._cf_ip:
-                    logger.info(f"CloudflareSpeedTest CDN优选ip未变，不做处理")
-                else:
-                    # 替换优选ip
-                    err_hosts = customHosts.get("err_hosts")
-
-                    # 处理ip
-                    new_hosts = []
-                    for host in hosts:
-                        if host and host != '\n':
-                            host_arr = str(host).split()
-                            if host_arr[0] == self._cf_ip:
-                                new_hosts.append(host.replace(self._cf_ip, best_ip).replace("\n", "") + "\n")
-                            else:
-                                new_hosts.append(host.replace("\n", "") + "\n")
-
-                    # 更新自定义Hosts
-                    self.update_config(
-                        {
-                            "hosts": ''.join(new_hosts),
-                            "err_hosts": err_hosts,
-                            "enabled": True
-                        }, "CustomHosts"
+                # 替换优选ip
+                err_hosts = customHosts.get("err_hosts")
+
+                # 处理ip
+                new_hosts = []
+                for host in hosts:
+                    if host and host != '\n':
+                        host_arr = str(host).split()
+                        if host_arr[0] == self._cf_ip:
+                            new_hosts.append(host.replace(self._cf_ip, best_ip).replace("\n", "") + "\n")
+                        else:
+                            new_hosts.append(host.replace("\n", "") + "\n")
+
+                # 更新自定义Hosts
+                self.update_config(
+                    {
+                        "hosts": ''.join(new_hosts),
+                        "err_hosts": err_hosts,
+                        "enabled": True
+                    }, "CustomHosts"
+                )
+
+                # 更新优选ip
+                old_ip = self._cf_ip
+                self._cf_ip = best_ip
+                self.__update_config()
+                logger.info(f"Cloudflare CDN优选ip [{best_ip}] 已替换自定义Hosts插件")
+
+                # 解发自定义hosts插件重载
+                logger.info("通知CustomHosts插件重载 ...")
+                self.eventmanager.send_event(EventType.PluginReload,
+                                             {
+                                                 "plugin_id": "CustomHosts"
+                                             })
+                if self._notify:
+                    self.post_message(
+                        mtype=NotificationType.SiteMessage,
+                        title="【Cloudflare优选任务完成】",
+                        text=f"原ip：{old_ip}\n"
+                             f"新ip：{best_ip}"
                     )
 
-                    # 更新优选ip
-                    old_ip = self._cf_ip
-                    self._cf_ip = best_ip
-                    self.__update_config()
-                    logger.info(f"Cloudflare CDN优选ip [{best_ip}] 已替换自定义Hosts插件")
-
-                    # 解发自定义hosts插件重载
-                    logger.info("通知CustomHosts插件重载 ...")
-                    self.eventmanager.send_event(EventType.PluginReload,
-                                                 {
-                                                     "plugin_id": "CustomHosts"
-                                                 })
-                    if self._notify:
-                        self.post_message(
-                            mtype=NotificationType.SiteMessage,
-                            title="【Cloudflare优选任务完成】",
-                            text=f"原ip：{old_ip}\n"
-                                 f"新ip：{best_ip}"
-                        )
+    def __builtin_speedtest(self) -> Optional[str]:
+        """
+        内置测速：从IP段抽样，并发测试TCP连接延迟与丢包，可选对前几名下载测速
+        """
+        cidrs = []
+        if self._ipv4:
+            cidrs.extend(self.__read_cidrs(self._cf_ipv4) or CLOUDFLARE_IPV4)
+        if self._ipv6:
+            cidrs.extend(self.__read_cidrs(self._cf_ipv6) or CLOUDFLARE_IPV6)
+        ips = CloudflareProber.sample_ips(cidrs, max_ips=self._max_ips)
+        logger.info(f"正在进行Cloudflare CDN内置测速，候选ip {len(ips)} 个，请耐心等待")
+        prober = CloudflareProber()
+        results = prober.probe(ips)
+        if not results:
+            return None
+        logger.info(f"延迟测试完成，可用ip {len(results)} 个")
+        if self._speed_url:
+            logger.info(f"开始对延迟最低的 {self._speed_top_n} 个ip下载测速 ...")
+            results = prober.speed_test(results, url=self._speed_url, top_n=self._speed_top_n)
+        for result in results[:10]:
+            logger.info(f"{result.ip} 延迟：{result.latency}ms 丢包：{round(result.loss * 100, 2)}%"
+                        + (f" 速度：{result.speed}KB/s" if self._speed_url else ""))
+        return results[0].ip
+
+    @staticmethod
+    def __read_cidrs(file_path: str) -> List[str]:
+        """
+        读取自定义IP段文件，每行一个IP段
+        """
+        if not file_path or not Path(file_path).exists():
+            return []
+        try:
+            return [line.strip() for line in Path(file_path).read_text().splitlines() if line.strip()]
+        except Exception as err:
+            logger.warn(f"读取IP段文件 {file_path} 失败：{str(err)}")
+            return []
+
+    def __binary_speedtest(self) -> str:
+        """
+        使用CloudflareST测速，返回最优ip
+        """
+        logger.info("正在进行CLoudflare CDN优选，请耐心等待")
+        # 执行优选命令，-dd不测速
+        if SystemUtils.is_windows():
+            cf_command = f'cd \"{self._cf_path}\" && CloudflareST {self._additional_args} -o \"{self._result_file}\"' + (
+                f' -f \"{self._cf_ipv4}\"' if self._ipv4 else '') + (
+                             f' -f \"{self._cf_ipv6}\"' if self._ipv6 else '')
         else:
-            logger.error("获取到最优ip格式错误，请重试")
-            self._onlyonce = False
-            self.__update_config()
-            self.stop_service()
+            cf_command = f'cd {self._cf_path} && chmod a+x {self._binary_name} && ./{self._binary_name} {self._additional_args} -o {self._result_file}' + (
+                f' -f {self._cf_ipv4}' if self._ipv4 else '') + (f' -f {self._cf_ipv6}' if self._ipv6 else '')
+        logger.info(f'正在执行优选命令 {cf_command}')
+        if SystemUtils.is_windows():
+            process = subprocess.Popen(cf_command, shell=True)
+            # 执行命令后无法退出 采用异步和设置超时方案
+            # 设置超时时间为120秒
+            if cf_command.__contains__("-dd"):
+                time.sleep(120)
+            else:
+                time.sleep(600)
+            # 如果没有在120秒内完成任务，那么杀死该进程
+            if process.poll() is None:
+                os.system('taskkill /F /IM CloudflareST.exe')
+        else:
+            os.system(cf_command)
+
+        # 获取优选后最优ip
+        if SystemUtils.is_windows():
+            powershell_command = f"powershell.exe -Command \"Get-Content \'{self._result_file}\' | Select-Object -Skip 1 -First 1 | Write-Output\""
+            logger.info(f'正在执行powershell命令 {powershell_command}')
+            best_ip = SystemUtils.execute(powershell_command)
+            best_ip = best_ip.split(',')[0]
+        else:
+            best_ip = SystemUtils.execute("sed -n '2,1p' " + self._result_file + " | awk -F, '{print $1}'")
+        return best_ip
 
     def __check_cf_ip(self, hosts):
         """
@@ -466,7 +530,10 @@ class CloudflareSpeedTest(_PluginBase):
             "re_install": self._re_install,
             "additional_args": self._additional_args,
             "notify": self._notify,
-            "check": self._check
+            "check": self._check,
+            "builtin": self._builtin,
+            "max_ips": self._max_ips,
+            "speed_url": self._speed_url
         })
 
     def get_state(self) -> bool:
@@ -711,6 +778,61 @@ class CloudflareSpeedTest(_PluginBase):
                             }
                         ]
                     },
+                    {
+                        'component': 'VRow',
+                        'content': [
+                            {
+                                'component': 'VCol',
+                                'props': {
+                                    'cols': 12,
+                                    'md': 4
+                                },
+                                'content': [
+                                    {
+                                        'component': 'VSwitch',
+                                        'props': {
+                                            'model': 'builtin',
+                                            'label': '内置测速',
+                                        }
+                                    }
+                                ]
+                            },
+                            {
+                                'component': 'VCol',
+                                'props': {
+                                    'cols': 12,
+                                    'md': 4
+                                },
+                                'content': [
+                                    {
+                                        'component': 'VTextField',
+                                        'props': {
+                                            'model': 'max_ips',
+                                            'label': '最多测试IP数',
+                                            'placeholder': '1000'
+                                        }
+                                    }
+                                ]
+                            },
+                            {
+                                'component': 'VCol',
+                                'props': {
+                                    'cols': 12,
+                                    'md': 4
+                                },
+                                'content': [
+                                    {
+                                        'component': 'VTextField',
+                                        'props': {
+                                            'model': 'speed_url',
+                                            'label': '下载测速地址',
+                                            'placeholder': '留空不测速'
+                                        }
+                                    }
+                                ]
+                            }
+                        ]
+                    },
                     {
                         'component': 'VRow',
                         'content': [
@@ -726,6 +848,8 @@ class CloudflareSpeedTest(_PluginBase):
                                             'type': 'info',
                                             'variant': 'tonal',
                                             'text': 'F12看请求的Server属性，如果是cloudflare说明该站点支持Cloudflare IP优选。'
+                                                    '开启内置测速时无需下载CloudflareST，高级参数仅对CloudflareST生效；'
+                                                    '自定义IP段可放在插件数据目录的ip.txt、ipv6.txt中。'
                                         }
                                     }
                                 ]
@@ -744,7 +868,10 @@ class CloudflareSpeedTest(_PluginBase):
             "onlyonce": False,
             "re_install": False,
             "notify": True,
-            "additional_args": ""
+            "additional_args": "",
+            "builtin": True,
+            "max_ips": 1000,
+            "speed_url": ""
         }
 
     def get_page(self) -> List[dict]:
@@ -0,0 +1,237 @@
+import asyncio
+import ipaddress
+import random
+import ssl
+import time
+from dataclasses import dataclass
+from typing import Iterable, List, Optional
+from urllib.parse import urlparse
+
+# Cloudflare 公布的IP段 https://www.cloudflare.com/ips/
+CLOUDFLARE_IPV4 = [
+    "173.245.48.0/20",
+    "103.21.244.0/22",
+    "103.22.200.0/22",
+    "103.31.4.0/22",
+    "141.101.64.0/18",
+    "108.162.192.0/18",
+    "190.93.240.0/20",
+    "188.114.96.0/20",
+    "197.234.240.0/22",
+    "198.41.128.0/17",
+    "162.158.0.0/15",
+    "104.16.0.0/13",
+    "104.24.0.0/14",
+    "172.64.0.0/13",
+    "131.0.72.0/22"
+]
+CLOUDFLARE_IPV6 = [
+    "2400:cb00::/32",
+    "2606:4700::/32",
+    "2803:f800::/32",
+    "2405:b500::/32",
+    "2405:8100::/32",
+    "2a06:98c0::/29",
+    "2c0f:f248::/32"
+]
+
+
+@dataclass
+class ProbeResult:
+    # IP地址
+    ip: str
+    # 发送次数
+    sent: int = 0
+    # 成功次数
+    received: int = 0
+    # 平均延迟（毫秒）
+    latency: float = 0
+    # 下载速度（KB/s）
+    speed: float = 0
+
+    @property
+    def loss(self) -> float:
+        """
+        丢包率
+        """
+        if not self.sent:
+            return 1
+        return (self.sent - self.received) / self.sent
+
+
+class CloudflareProber:
+    """
+    Cloudflare IP 延迟、丢包及下载速度测试，使用asyncio并发测试
+    """
+
+    def __init__(self, port: int = 443, ping_times: int = 4, timeout: float = 1.0,
+                 concurrency: int = 200, tls_host: str = None):
+        """
+        :param port: 测试端口
+        :param ping_times: 每个IP测试次数
+        :param timeout: 单次连接超时（秒）
+        :param concurrency: 最大并发连接数
+        :param tls_host: 设置后在TCP连接后完成TLS握手，以该域名作为SNI
+        """
+        self._port = port
+        self._ping_times = ping_times
+        self._timeout = timeout
+        self._concurrency = concurrency
+        self._tls_host = tls_host
+
+    @staticmethod
+    def sample_ips(cidrs: Iterable[str], max_ips: int = 0) -> List[str]:
+        """
+        从IP段中抽样候选IP，IPv4每个/24取一个，IPv6每个IP段随机取256个
+        :param cidrs: IP段或IP
+        :param max_ips: 最多返回的IP数，0为不限制
+        """
+        ips = []
+        for cidr in cidrs:
+            cidr = str(cidr).strip()
+            if not cidr or cidr.startswith("#"):
+                continue
+            try:
+                network = ipaddress.ip_network(cidr, strict=False)
+            except ValueError:
+                continue
+            if network.version == 4:
+                if network.prefixlen >= 24:
+                    subnets = [network]
+                else:
+                    subnets = network.subnets(new_prefix=24)
+                for subnet in subnets:
+                    if subnet.num_addresses <= 2:
+                        ips.append(str(subnet.network_address))
+                    else:
+                        ips.append(str(subnet.network_address + random.randint(1, subnet.num_addresses - 2)))
+            else:
+                if network.num_addresses <= 256:
+                    ips.extend(str(ip) for ip in network)
+                    continue
+                for _ in range(256):
+                    ips.append(str(network.network_address + random.randint(1, network.num_addresses - 1)))
+        ips = list(dict.fromkeys(ips))
+        if max_ips and len(ips) > max_ips:
+            ips = random.sample(ips, max_ips)
+        return ips
+
+    async def _ping_once(self, ip: str) -> Optional[float]:
+        """
+        测试一次连接延迟（毫秒），失败返回None
+        """
+        ssl_context = None
+        if self._tls_host:
+            ssl_context = ssl.create_default_context()
+        start = time.perf_counter()
+        writer = None
+        try:
+            _, writer = await asyncio.wait_for(
+                asyncio.open_connection(ip, self._port, ssl=ssl_context,
+                                        server_hostname=self._tls_host if ssl_context else None),
+                timeout=self._timeout)
+            return (time.perf_counter() - start) * 1000
+        except (OSError, asyncio.TimeoutError, ssl.SSLError):
+            return None
+        finally:
+            if writer:
+                writer.close()
+                try:
+                    await writer.wait_closed()
+                except (OSError, ssl.SSLError):
+                    pass
+
+    async def _ping(self, ip: str, semaphore: asyncio.Semaphore) -> ProbeResult:
+        """
+        测试一个IP的延迟与丢包
+        """
+        result = ProbeResult(ip=ip)
+        latencies = []
+        async with semaphore:
+            for _ in range(self._ping_times):
+                result.sent += 1
+                latency = await self._ping_once(ip)
+                if latency is not None:
+                    latencies.append(latency)
+                # 首次连接失败时不再继续测试，节省时间
+                if not latencies and result.sent == 1:
+                    break
+        result.received = len(latencies)
+        if latencies:
+            result.latency = round(sum(latencies) / len(latencies), 2)
+        return result
+
+    async def _probe(self, ips: List[str]) -> List[ProbeResult]:
+        semaphore = asyncio.Semaphore(self._concurrency)
+        return await asyncio.gather(*[self._ping(ip, semaphore) for ip in ips])
+
+    def probe(self, ips: List[str], max_loss: float = 1.0) -> List[ProbeResult]:
+        """
+        并发测试延迟和丢包，按丢包率、延迟排序，丢弃全部失败及丢包率超过上限的IP
+        """
+        if not ips:
+            return []
+        results = asyncio.run(self._probe(ips))
+        results = [result for result in results if result.received and result.loss <= max_loss]
+        return sorted(results, key=lambda x: (x.loss, x.latency))
+
+    async def _download(self, ip: str, url: str, duration: float) -> float:
+        """
+        连接指定IP下载测速，返回速度（KB/s）
+        """
+        parsed = urlparse(url)
+        https = parsed.scheme == "https"
+        port = parsed.port or (443 if https else 80)
+        path = parsed.path or "/"
+        if parsed.query:
+            path = f"{path}?{parsed.query}"
+        writer = None
+        received = 0
+        start = time.perf_counter()
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(ip, port,
+                                        ssl=ssl.create_default_context() if https else None,
+                                        server_hostname=parsed.hostname if https else None),
+                timeout=self._timeout * 3)
+            writer.write((f"GET {path} HTTP/1.1\r\n"
+                          f"Host: {parsed.hostname}\r\n"
+                          f"User-Agent: Mozilla/5.0\r\n"
+                          f"Connection: close\r\n\r\n").encode())
+            await writer.drain()
+            start = time.perf_counter()
+            deadline = start + duration
+            while True:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    chunk = await asyncio.wait_for(reader.read(65536), timeout=remaining)
+                except asyncio.TimeoutError:
+                    break
+                if not chunk:
+                    break
+                received += len(chunk)
+        except (OSError, asyncio.TimeoutError, ssl.SSLError):
+            pass
+        finally:
+            if writer:
+                writer.close()
+                try:
+                    await writer.wait_closed()
+                except (OSError, ssl.SSLError):
+                    pass
+        elapsed = time.perf_counter() - start
+        if not received or elapsed <= 0:
+            return 0
+        return round(received / 1024 / elapsed, 2)
+
+    def speed_test(self, results: List[ProbeResult], url: str, top_n: int = 5,
+                   duration: float = 5) -> List[ProbeResult]:
+        """
+        对延迟最低的前N个IP依次下载测速，按速度降序排列，测速失败的IP排在最后
+        """
+        candidates = results[:top_n]
+        for result in candidates:
+            result.speed = asyncio.run(self._download(result.ip, url, duration))
+        return sorted(candidates, key=lambda x: (-x.speed, x.loss, x.latency)) + results[top_n:]
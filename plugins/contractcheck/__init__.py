@@ -1,6 +1,8 @@
 import re
+import time
 import warnings
 from datetime import datetime, timedelta
+from types import SimpleNamespace
 from multiprocessing.dummy import Pool as ThreadPool
 from threading import Lock
 from typing import Optional, Any, List, Dict, Tuple
@@ -19,8 +21,10 @@ from app.helper.browser import PlaywrightHelper
 from app.helper.module import ModuleHelper
 from app.helper.sites import SitesHelper
 from app.log import logger
+from app.modules.qbittorrent import Qbittorrent
+from app.modules.transmission import Transmission
 from app.plugins import _PluginBase
-from app.plugins.contractcheck.siteuserinfo import ISiteUserInfo
+from app.plugins.contractcheck.siteuserinfo import ISiteUserInfo, OFFICIAL_TEAMS
 from app.schemas.types import EventType, NotificationType
 from app.utils.http import RequestUtils
 from app.utils.string import StringUtils
@@ -39,7 +43,7 @@ class ContractCheck(_PluginBase):
     # 插件图标
     plugin_icon = "contract.png"
     # 插件版本
-    plugin_version = "1.4"
+    plugin_version = "1.5"
     # 插件作者
     plugin_author = "DzAvril"
     # 作者主页
@@ -76,6 +80,17 @@ class ContractCheck(_PluginBase):
     _scheduler: Optional[BackgroundScheduler] = None
     _sites_data: dict = {}
     _site_schema: List[ISiteUserInfo] = None
+    # 站点抓取结果缓存时间（秒）
+    _crawl_ttl: int = 6 * 3600
+    _crawl_lock = Lock()
+    # tracker域名与站点域名不一致时的映射
+    _tracker_mappings: Dict[str, str] = {
+        "chdbits.xyz": "ptchdbits.co",
+        "agsvpt.trackers.work": "agsvpt.com",
+        "tracker.cinefiles.info": "audiences.me",
+    }
+    # qBittorrent做种状态
+    _qb_seeding_states = ("uploading", "stalledUP", "forcedUP", "queuedUP", "checkingUP")
 
     # 配置属性
     _enabled: bool = False
@@ -85,6 +100,8 @@ class ContractCheck(_PluginBase):
     _queue_cnt: int = 5
     _contract_infos: str = ""
     _dashboard_type: str = "brief"
+    # local：按下载器统计，无法本地判断官种时才抓取站点；site：全部抓取站点
+    _eval_mode: str = "local"
 
     def init_plugin(self, config: dict = None):
         self.sites = SitesHelper()
@@ -101,6 +118,7 @@ class ContractCheck(_PluginBase):
             self._contract_infos = config.get("contract_infos")
             self.parse_contract_infos(self._contract_infos)
             self._dashboard_type = config.get("dashboard_type") or "brief"
+            self._eval_mode = config.get("eval_mode") or "local"
 
         # 获取历史数据
         self._sites_data = self.get_data("contractcheck")
@@ -631,6 +649,23 @@ class ContractCheck(_PluginBase):
                                     }
                                 ],
                             },
+                            {
+                                "component": "VCol",
+                                "props": {"cols": 12, "md": 3},
+                                "content": [
+                                    {
+                                        "component": "VSelect",
+                                        "props": {
+                                            "model": "eval_mode",
+                                            "label": "统计方式",
+                                            "items": [
+                                                {"title": "下载器优先", "value": "local"},
+                                                {"title": "站点抓取", "value": "site"},
+                                            ],
+                                        },
+                                    }
+                                ],
+                            },
                             {
                                 "component": "VCol",
                                 "props": {"cols": 12, "md": 12},
@@ -710,6 +745,7 @@ class ContractCheck(_PluginBase):
             "cron": "5 1 * * *",
             "queue_cnt": 5,
             "dashboard_type": "brief",
+            "eval_mode": "local",
         }
 
     def get_page(self) -> List[dict]:
@@ -879,6 +915,66 @@ class ContractCheck(_PluginBase):
             duration_gap = contract_info.duration - duration
         return is_satisfied, size_gap, num_gap, duration_gap
 
+    def __get_contract_info(self, site_name: str):
+        """
+        获取站点契约信息
+        """
+        contract_info = self.ContractInfo()
+        for info in self.contract_infos:
+            if site_name == info.site_name:
+                contract_info = info
+        return contract_info
+
+    def __update_site_data(self, site_name: str, contract_info, site_user_info):
+        """
+        根据保种数据计算契约达成情况并更新站点数据
+        """
+        is_satisfied, size_gap, num_gap, duration_gap = self._check_seed_states(
+            contract_info, site_user_info
+        )
+
+        self._sites_data.update(
+            {
+                site_name: {
+                    "is_official": "是" if contract_info.official else "否",
+                    "contract_size": StringUtils.str_filesize(
+                        contract_info.size
+                    ),
+                    "contract_num": contract_info.num,
+                    "contract_duration": contract_info.duration,
+                    "contract_start_on": str(contract_info.date),
+                    "total_seed_num": site_user_info.total_seeding_size[0],
+                    "total_seed_size": StringUtils.str_filesize(
+                        site_user_info.total_seeding_size[1]
+                    ),
+                    "official_seed_num": site_user_info.official_seeding_size[
+                        0
+                    ],
+                    "official_seed_size": StringUtils.str_filesize(
+                        site_user_info.official_seeding_size[1]
+                    ),
+                    "is_satisfied": is_satisfied,
+                    "size_gap": StringUtils.str_filesize(size_gap),
+                    "num_gap": num_gap,
+                    "duration_gap": duration_gap,
+                    "err_msg": site_user_info.err_msg,
+                }
+            }
+        )
+
+    def __crawl_site_data(self, site_info: CommentedMap) -> Optional[ISiteUserInfo]:
+        """
+        抓取站点做种列表，解析保种数据
+        """
+        site_name = site_info.get("name")
+        site_user_info: ISiteUserInfo = self.build(site_info=site_info)
+        if not site_user_info:
+            return None
+        # 开始解析
+        site_user_info.parse_official_seeding_info()
+        logger.info(f"站点 {site_name} 解析完成")
+        return site_user_info
+
     def __refresh_site_data(self, site_info: CommentedMap) -> Optional[ISiteUserInfo]:
         """
         更新单个site 数据信息
@@ -890,64 +986,121 @@ class ContractCheck(_PluginBase):
         if not site_url:
             return None
         try:
-            site_user_info: ISiteUserInfo = self.build(site_info=site_info)
+            site_user_info = self.__crawl_site_data(site_info)
             if site_user_info:
-                # 开始解析
-                site_user_info.parse_official_seeding_info()
-                logger.info(f"站点 {site_name} 解析完成")
-
                 # 获取不到数据时，仅返回错误信息，不做历史数据更新
                 if site_user_info.err_msg:
                     self._sites_data.update(
                         {site_name: {"err_msg": site_user_info.err_msg}}
                     )
                     return None
-                contract_info = self.ContractInfo()
-                for info in self.contract_infos:
-                    if site_name == info.site_name:
-                        contract_info = info
+                contract_info = self.__get_contract_info(site_name)
                 if contract_info is None:
                     logger.error(f"站点{site_name}不在契约站点列表中，请检查配置")
                     return site_user_info
 
-                is_satisfied, size_gap, num_gap, duration_gap = self._check_seed_states(
-                    contract_info, site_user_info
-                )
-
-                self._sites_data.update(
-                    {
-                        site_name: {
-                            "is_official": "是" if contract_info.official else "否",
-                            "contract_size": StringUtils.str_filesize(
-                                contract_info.size
-                            ),
-                            "contract_num": contract_info.num,
-                            "contract_duration": contract_info.duration,
-                            "contract_start_on": str(contract_info.date),
-                            "total_seed_num": site_user_info.total_seeding_size[0],
-                            "total_seed_size": StringUtils.str_filesize(
-                                site_user_info.total_seeding_size[1]
-                            ),
-                            "official_seed_num": site_user_info.official_seeding_size[
-                                0
-                            ],
-                            "official_seed_size": StringUtils.str_filesize(
-                                site_user_info.official_seeding_size[1]
-                            ),
-                            "is_satisfied": is_satisfied,
-                            "size_gap": StringUtils.str_filesize(size_gap),
-                            "num_gap": num_gap,
-                            "duration_gap": duration_gap,
-                            "err_msg": site_user_info.err_msg,
-                        }
-                    }
-                )
+                self.__update_site_data(site_name, contract_info, site_user_info)
                 return site_user_info
 
         except Exception as e:
             logger.error(f"站点 {site_name} 获取流量数据失败：{str(e)}")
         return None
 
+    def __refresh_site_data_local(self, site_info: CommentedMap, local_data: dict):
+        """
+        按下载器统计结果更新单个站点数据，官种无法在本地判断时抓取站点（结果缓存）
+        :param site_info: 站点信息
+        :param local_data: 下载器统计结果 {"total": [数量, 大小], "official": [数量, 大小]}
+        """
+        site_name = site_info.get("name")
+        try:
+            contract_info = self.__get_contract_info(site_name)
+            official = local_data.get("official")
+            if contract_info.official and site_name not in OFFICIAL_TEAMS:
+                official = self.__get_crawled_official(site_info)
+                if official is None:
+                    return
+            site_user_info = SimpleNamespace(
+                total_seeding_size=local_data.get("total"),
+                official_seeding_size=official,
+                err_msg=None
+            )
+            self.__update_site_data(site_name, contract_info, site_user_info)
+            logger.info(f"站点 {site_name} 官种信息 {official} 总种信息 {local_data.get('total')}（下载器统计）")
+        except Exception as e:
+            logger.error(f"站点 {site_name} 统计保种数据失败：{str(e)}")
+
+    def __get_crawled_official(self, site_info: CommentedMap) -> Optional[list]:
+        """
+        获取站点统计的官种数据，缓存期内不重复抓取
+        """
+        site_name = site_info.get("name")
+        crawl_cache: dict = self.get_data("crawl_cache") or {}
+        cache = crawl_cache.get(site_name)
+        if cache and time.time() - cache.get("time", 0) < self._crawl_ttl:
+            return cache.get("official")
+        site_user_info = self.__crawl_site_data(site_info)
+        if not site_user_info or site_user_info.err_msg:
+            err_msg = site_user_info.err_msg if site_user_info else "站点数据抓取失败"
+            self._sites_data.update({site_name: {"err_msg": err_msg}})
+            return None
+        official = list(site_user_info.official_seeding_size)
+        with self._crawl_lock:
+            crawl_cache = self.get_data("crawl_cache") or {}
+            crawl_cache[site_name] = {"time": time.time(), "official": official}
+            self.save_data("crawl_cache", crawl_cache)
+        return official
+
+    def __get_local_seeding(self, sites: List[CommentedMap]) -> Dict[str, dict]:
+        """
+        一次遍历下载器中的全部种子，按tracker域名统计各站点做种数量和体积
+        :return: {站点名称: {"total": [数量, 大小], "official": [数量, 大小]}}
+        """
+        domain_sites = {}
+        for site in sites:
+            domain = StringUtils.get_url_domain(site.get("url"))
+            if domain:
+                domain_sites[domain] = site.get("name")
+        stats = {site.get("name"): {"total": [0, 0], "official": [0, 0]} for site in sites}
+        counted = set()
+        for dl_type, downloader in (("qbittorrent", Qbittorrent()), ("transmission", Transmission())):
+            torrents, error = downloader.get_torrents()
+            if error or not torrents:
+                continue
+            for torrent in torrents:
+                if dl_type == "qbittorrent":
+                    if torrent.get("state") not in self._qb_seeding_states:
+                        continue
+                    torrent_hash, name, size = torrent.get("hash"), torrent.get("name"), torrent.get("size")
+                    trackers = [torrent.get("tracker")]
+                else:
+                    if not (torrent.status.seeding or torrent.status.seed_pending):
+                        continue
+                    torrent_hash, name, size = torrent.hashString, torrent.name, torrent.total_size
+                    trackers = [tracker.announce for tracker in (torrent.trackers or [])]
+                site_name = None
+                for tracker in trackers:
+                    if not tracker:
+                        continue
+                    domain = StringUtils.get_url_domain(tracker)
+                    for key, mapped_domain in self._tracker_mappings.items():
+                        if key in tracker:
+                            domain = mapped_domain
+                            break
+                    site_name = domain_sites.get(domain)
+                    if site_name:
+                        break
+                # 多个下载器中的同一种子只统计一次
+                if not site_name or (site_name, torrent_hash) in counted:
+                    continue
+                counted.add((site_name, torrent_hash))
+                stats[site_name]["total"][0] += 1
+                stats[site_name]["total"][1] += size or 0
+                if any(team in (name or "") for team in OFFICIAL_TEAMS.get(site_name, [])):
+                    stats[site_name]["official"][0] += 1
+                    stats[site_name]["official"][1] += size or 0
+        return stats
+
     @eventmanager.register(EventType.PluginAction)
     def refresh(self, event: Event):
         """
@@ -995,9 +1148,16 @@ class ContractCheck(_PluginBase):
             if not refresh_sites:
                 return
 
-            # 并发刷新
-            with ThreadPool(min(len(refresh_sites), int(self._queue_cnt or 5))) as p:
-                p.map(self.__refresh_site_data, refresh_sites)
+            if self._eval_mode == "local":
+                # 按下载器统计，仅需抓取官种数据的站点访问站点
+                local_stats = self.__get_local_seeding(refresh_sites)
+                with ThreadPool(min(len(refresh_sites), int(self._queue_cnt or 5))) as p:
+                    p.starmap(self.__refresh_site_data_local,
+                              [(site, local_stats.get(site.get("name"))) for site in refresh_sites])
+            else:
+                # 并发刷新
+                with ThreadPool(min(len(refresh_sites), int(self._queue_cnt or 5))) as p:
+                    p.map(self.__refresh_site_data, refresh_sites)
 
             # 保存数据
             self.save_data("contractcheck", self._sites_data)
@@ -1050,5 +1210,6 @@ class ContractCheck(_PluginBase):
                 "queue_cnt": self._queue_cnt,
                 "contract_infos": self._contract_infos,
                 "dashboard_type": self._dashboard_type,
+                "eval_mode": self._eval_mode,
             }
         )
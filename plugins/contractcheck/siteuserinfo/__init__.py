@@ -17,6 +17,15 @@ from app.utils.site import SiteUtils
 
 SITE_BASE_ORDER = 1000
 
+# 站点官组，种子标题中包含官组名称的为官种
+OFFICIAL_TEAMS = {
+    "观众": ["Audies", "ADE", "ADWeb", "ADAudio", "ADeBook", "ADMusic"],
+    "UBits": ["UBits"],
+    "听听歌": ["TTG", "WiKi", "DoA", "NGB", "ARiN"],
+    "馒头": ["MTeam", "MTeamTV"],
+    "朋友": ["FRDS"],
+}
+
 
 # 站点框架
 class SiteSchema(Enum):
@@ -64,13 +73,7 @@ class ISiteUserInfo(metaclass=ABCMeta):
         self.official_seeding_size = [0, 0]
 
         # 站点官组
-        self.official_team = {
-            "观众": ["Audies", "ADE", "ADWeb", "ADAudio", "ADeBook", "ADMusic"],
-            "UBits": ["UBits"],
-            "听听歌": ["TTG", "WiKi", "DoA", "NGB", "ARiN"],
-            "馒头": ["MTeam", "MTeamTV"],
-            "朋友": ["FRDS"],
-        }
+        self.official_team = OFFICIAL_TEAMS
 
         # 错误信息
         self.err_msg = None
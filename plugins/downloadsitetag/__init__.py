@@ -1,8 +1,13 @@
 import datetime
+import time
+from collections import defaultdict
+
 import pytz
 import threading
 from typing import List, Tuple, Dict, Any, Optional
 
+from sqlalchemy.orm import Session
+
 from app.core.context import Context
 from app.core.event import eventmanager, Event
 from app.schemas.types import EventType, MediaType
@@ -11,6 +16,7 @@ from app.log import logger
 from app.plugins import _PluginBase
 from app.modules.qbittorrent import Qbittorrent
 from app.modules.transmission import Transmission
+from app.db import db_query
 from app.db.downloadhistory_oper import DownloadHistoryOper
 from app.db.models.downloadhistory import DownloadHistory
 from apscheduler.schedulers.background import BackgroundScheduler
@@ -27,7 +33,7 @@ class DownloadSiteTag(_PluginBase):
     # 插件图标
     plugin_icon = "Youtube-dl_B.png"
     # 插件版本
-    plugin_version = "2.1"
+    plugin_version = "2.2"
     # 插件作者
     plugin_author = "叮叮当"
     # 作者主页
@@ -61,6 +67,10 @@ class DownloadSiteTag(_PluginBase):
     _category_movie = None
     _category_tv = None
     _category_anime = None
+    # TMDB分类缓存 tmdbid -> {genre_ids, time}
+    _genre_cache: Dict[str, dict] = {}
+    # TMDB分类缓存有效期（天）
+    _genre_cache_days = 30
 
     def init_plugin(self, config: dict = None):
         self.downloader_qb = Qbittorrent()
@@ -180,6 +190,7 @@ class DownloadSiteTag(_PluginBase):
         补全下载历史的标签与分类
         """
         logger.info(f"{self.LOG_TAG}开始执行 ...")
+        self.__load_genre_cache()
         # 记录处理的种子, 供辅种(无下载历史)使用
         dispose_history = {}
         # 所有站点索引
@@ -206,12 +217,20 @@ class DownloadSiteTag(_PluginBase):
             logger.info(f"{self.LOG_TAG}按时间重新排序 {DOWNLOADER} 种子数：{len(torrents)}")
             # 按添加时间进行排序, 时间靠前的按大小和名称加入处理历史, 判定为原始种子, 其他为辅种
             torrents = self._torrents_sort(torrents=torrents, dl_type=DOWNLOADER)
+            # 一次查询所有种子的下载历史
+            historys = self.__get_historys_by_hashs(
+                [_hash for _hash in (self._get_hash(torrent=torrent, dl_type=DOWNLOADER) for torrent in torrents)
+                 if _hash], db=None) or {}
+            # 按标签、分类对种子分组，批量设置
+            tag_groups: Dict[Tuple[str, ...], List[str]] = defaultdict(list)
+            cat_groups: Dict[str, List[str]] = defaultdict(list)
             logger.info(f"{self.LOG_TAG}下载器 {DOWNLOADER} 分析种子信息中 ...")
             for torrent in torrents:
                 try:
                     if self._event.is_set():
                         logger.info(
                             f"{self.LOG_TAG}停止服务")
+                        self.__save_genre_cache()
                         return
                     # 获取已处理种子的key (size, name)
                     _key = self._torrent_key(torrent=torrent, dl_type=DOWNLOADER)
@@ -223,7 +242,7 @@ class DownloadSiteTag(_PluginBase):
                     torrent_tags = self._get_label(torrent=torrent, dl_type=DOWNLOADER)
                     torrent_cat = self._get_category(torrent=torrent, dl_type=DOWNLOADER)
                     # 提取种子hash对应的下载历史
-                    history: DownloadHistory = self.downloadhistory_oper.get_by_hash(_hash)
+                    history: DownloadHistory = historys.get(_hash)
                     if not history:
                         # 如果找到已处理种子的历史, 表明当前种子是辅种, 否则创建一个空DownloadHistory
                         if _key and _key in dispose_history:
@@ -273,10 +292,8 @@ class DownloadSiteTag(_PluginBase):
                         # 因允许tmdbid为空时运行到此, 因此需要判断tmdbid不为空
                         history_type = MediaType(history.type) if history.type else None
                         if history.tmdbid and history_type == MediaType.TV:
-                            # tmdb_id获取tmdb信息
-                            tmdb_info = self.chain.tmdb_info(mtype=history_type, tmdbid=history.tmdbid)
-                            if tmdb_info:
-                                genre_ids = tmdb_info.get("genre_ids")
+                            # tmdb_id获取tmdb分类
+                            genre_ids = self.__get_genre_ids(mtype=history_type, tmdbid=history.tmdbid)
                         _cat = self._genre_ids_get_cat(history.type, genre_ids)
 
                     # 去除种子已经存在的标签
@@ -288,15 +305,106 @@ class DownloadSiteTag(_PluginBase):
                     # 判断当前种子是否不需要修改
                     if not _cat and not _tags:
                         continue
-                    # 执行通用方法, 设置种子标签与分类
-                    self._set_torrent_info(DOWNLOADER=DOWNLOADER, _hash=_hash, _torrent=torrent, _tags=_tags, _cat=_cat,
-                                           _original_tags=torrent_tags)
+                    # 加入分组, 稍后批量设置种子标签与分类
+                    if _tags:
+                        if DOWNLOADER == "qbittorrent":
+                            tag_groups[tuple(sorted(_tags))].append(_hash)
+                        else:
+                            # tr设置标签会覆盖原始标签, 需要合并原始标签
+                            tag_groups[tuple(sorted(set(torrent_tags or []).union(_tags)))].append(_hash)
+                    if _cat:
+                        cat_groups[_cat].append(_hash)
                 except Exception as e:
                     logger.error(
                         f"{self.LOG_TAG}分析种子信息时发生了错误: {str(e)}")
+            # 批量设置种子标签与分类
+            self._set_torrents_info(DOWNLOADER=DOWNLOADER, tag_groups=tag_groups, cat_groups=cat_groups)
 
+        self.__save_genre_cache()
         logger.info(f"{self.LOG_TAG}执行完成")
 
+    def _set_torrents_info(self, DOWNLOADER: str, tag_groups: Dict[Tuple[str, ...], List[str]],
+                           cat_groups: Dict[str, List[str]]):
+        """
+        按分组批量设置种子标签与分类, 每组只调用一次下载器接口
+        """
+        downloader_obj = self._get_downloader(DOWNLOADER)
+        if not downloader_obj:
+            return
+        for _tags, _hashs in tag_groups.items():
+            try:
+                if DOWNLOADER == "qbittorrent":
+                    downloader_obj.set_torrents_tag(ids=_hashs, tags=list(_tags))
+                else:
+                    downloader_obj.set_torrent_tag(ids=_hashs, tags=list(_tags))
+                logger.warn(
+                    f"{self.LOG_TAG}下载器: {DOWNLOADER} 种子数: {len(_hashs)}  标签: {','.join(_tags)}")
+            except Exception as e:
+                logger.error(f"{self.LOG_TAG}下载器: {DOWNLOADER} 批量设置标签 {','.join(_tags)} 失败: {str(e)}")
+        # 设置分类 <tr暂不支持>
+        if DOWNLOADER != "qbittorrent":
+            return
+        for _cat, _hashs in cat_groups.items():
+            # 尝试设置种子分类, 如果失败, 则创建再设置一遍
+            try:
+                try:
+                    downloader_obj.qbc.torrents_set_category(category=_cat, torrent_hashes=_hashs)
+                except Exception as e:
+                    logger.warn(f"下载器 {DOWNLOADER} 设置分类 {_cat} 失败：{str(e)}, 尝试创建分类再设置 ...")
+                    downloader_obj.qbc.torrents_createCategory(name=_cat)
+                    downloader_obj.qbc.torrents_set_category(category=_cat, torrent_hashes=_hashs)
+                logger.warn(f"{self.LOG_TAG}下载器: {DOWNLOADER} 种子数: {len(_hashs)}  分类: {_cat}")
+            except Exception as e:
+                logger.error(f"{self.LOG_TAG}下载器: {DOWNLOADER} 批量设置分类 {_cat} 失败: {str(e)}")
+
+    @staticmethod
+    @db_query
+    def __get_historys_by_hashs(hashs: List[str], db: Session = None) -> Dict[str, DownloadHistory]:
+        """
+        批量查询种子hash对应的下载历史, 同一hash取最新的一条
+        """
+        historys = {}
+        for i in range(0, len(hashs), 500):
+            for history in db.query(DownloadHistory) \
+                    .filter(DownloadHistory.download_hash.in_(hashs[i:i + 500])) \
+                    .order_by(DownloadHistory.date.desc()).all():
+                if history.download_hash not in historys:
+                    historys[history.download_hash] = history
+        return historys
+
+    def __get_genre_ids(self, mtype: MediaType, tmdbid: int) -> Optional[list]:
+        """
+        获取TMDB分类, 按tmdbid缓存
+        """
+        cache = self._genre_cache.get(str(tmdbid))
+        if cache:
+            return cache.get("genre_ids")
+        tmdb_info = self.chain.tmdb_info(mtype=mtype, tmdbid=tmdbid)
+        if not tmdb_info:
+            return None
+        genre_ids = tmdb_info.get("genre_ids")
+        if genre_ids is None:
+            genre_ids = [genre.get("id") for genre in tmdb_info.get("genres") or []]
+        self._genre_cache[str(tmdbid)] = {
+            "genre_ids": genre_ids,
+            "time": time.time()
+        }
+        return genre_ids
+
+    def __load_genre_cache(self):
+        """
+        加载TMDB分类缓存, 清理过期数据
+        """
+        expire_time = time.time() - self._genre_cache_days * 24 * 3600
+        self._genre_cache = {k: v for k, v in (self.get_data("genre_cache") or {}).items()
+                             if v.get("time", 0) > expire_time}
+
+    def __save_genre_cache(self):
+        """
+        保存TMDB分类缓存
+        """
+        self.save_data("genre_cache", self._genre_cache)
+
     def _genre_ids_get_cat(self, mtype, genre_ids=None):
         """
         根据genre_ids判断是否<动漫>分类
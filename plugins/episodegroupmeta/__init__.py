@@ -1,9 +1,11 @@
 import base64
+import hashlib
 import json
 import threading
 import time
 import importlib.util
 import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from typing import Any, List, Dict, Tuple, Optional, Union
 from pydantic import BaseModel
@@ -34,6 +36,8 @@ class ExistMediaInfo(BaseModel):
     server: Optional[str] = None
     # 媒体ID
     itemid: Optional[Union[str, int]] = None
+    # 集在媒体服务器中的信息（来自剧集列表）
+    iteminfos: Optional[Dict[str, dict]] = {}
 
 
 class EpisodeGroupMeta(_PluginBase):
@@ -46,7 +50,7 @@ class EpisodeGroupMeta(_PluginBase):
     # 主题色
     plugin_color = "#098663"
     # 插件版本
-    plugin_version = "2.6"
+    plugin_version = "2.7"
     # 插件作者
     plugin_author = "叮叮当"
     # 作者主页
@@ -74,6 +78,10 @@ class EpisodeGroupMeta(_PluginBase):
     _ignorelock = False
     _delay = 0
     _allowlist = []
+    # 并发写入媒体服务器数
+    _max_workers = 4
+    # 图片缓存有效期（天）
+    _image_cache_days = 30
 
     def init_plugin(self, config: dict = None):
         self.tv = TV()
@@ -97,6 +105,8 @@ class EpisodeGroupMeta(_PluginBase):
                 config["autorun"] = True
                 self.update_config(config)
                 self.log_warn(f"新版本v{self.plugin_version} 配置修正 ...")
+        # 清理过期图片缓存
+        self.__clean_image_cache()
 
     def get_state(self) -> bool:
         return self._enabled
@@ -718,6 +728,8 @@ class EpisodeGroupMeta(_PluginBase):
                      'TagItems', 'Studios', 'PremiereDate', 'DateCreated', 'ProductionYear', 'Video3DFormat',
                      'OfficialRating', 'CustomRating', 'People', 'LockData', 'LockedFields', 'ProviderIds',
                      'PreferredMetadataLanguage', 'PreferredMetadataCountryCode', 'Taglines']
+        # 已设置的剧集图片 媒体服务器:itemid -> still_path
+        applied_images: Dict[str, str] = self.get_data("episode_images") or {}
         for episode_group in episode_groups:
             if not bool(existsinfo.groupep):
                 break
@@ -757,45 +769,41 @@ class EpisodeGroupMeta(_PluginBase):
                     if existsinfo.groupid.get(order) is None:
                         self.log_info(f"媒体库中不存在: {mediainfo.title_year}, 第 {order} 季")
                         continue
+                    # 根据剧集列表比对，仅更新有变化的集，信息与锁定状态一致时只补充图片
+                    tasks = []
                     for _index, _ids in enumerate(existsinfo.groupid.get(order)):
                         # 提取出媒体库中集id对应的集数index
                         ep_num = ep[_index]
+                        episode = episodes[ep_num - 1]
                         for _id in _ids:
-                            # 获取媒体服务器媒体项
-                            iteminfo = self.get_iteminfo(server_type=existsinfo.server_type, itemid=_id, mediaserver_instance=mediaserver_instance)
-                            if not iteminfo:
-                                self.log_info(f"未找到媒体项 - itemid: {_id},  第 {order} 季,  第 {ep_num} 集")
+                            iteminfo = existsinfo.iteminfos.get(str(_id))
+                            info_unchanged = self.__episode_unchanged(iteminfo, episode, order, ep_num)
+                            image_unchanged = self.__image_unchanged(iteminfo, episode,
+                                                                     applied_images.get(f"{existsinfo.server}:{_id}"))
+                            if info_unchanged and image_unchanged:
+                                self.log_info(f"剧集信息无变化 - itemid: {_id},  第 {order} 季,  第 {ep_num} 集")
                                 continue
-                            # 锁定的剧集是否也刮削?
-                            if not self._ignorelock:
-                                if iteminfo.get("LockData") or (
-                                        "Name" in iteminfo.get("LockedFields", [])
-                                        and "Overview" in iteminfo.get("LockedFields", [])):
-                                    self.log_warn(f"已锁定媒体项 - itemid: {_id},  第 {order} 季,  第 {ep_num} 集, 如果需要刮削请打开设置中的“锁定的剧集也刮削”选项")
-                                    continue
-                            # 替换项目数据
-                            episode = episodes[ep_num - 1]
-                            new_dict = {}
-                            new_dict.update({k: v for k, v in iteminfo.items() if k in copy_keys})
-                            new_dict["Name"] = episode["name"]
-                            new_dict["Overview"] = episode["overview"]
-                            new_dict["ParentIndexNumber"] = str(order)
-                            new_dict["IndexNumber"] = str(ep_num)
-                            new_dict["LockData"] = True
-                            if episode.get("vote_average"):
-                                new_dict["CommunityRating"] = episode.get("vote_average")
-                            if not new_dict["LockedFields"]:
-                                new_dict["LockedFields"] = []
-                            self.__append_to_list(new_dict["LockedFields"], "Name")
-                            self.__append_to_list(new_dict["LockedFields"], "Overview")
-                            # 更新数据
-                            self.set_iteminfo(server_type=existsinfo.server_type, itemid=_id, iteminfo=new_dict, mediaserver_instance=mediaserver_instance)
-                            # still_path 图片
-                            if episode.get("still_path"):
-                                self.set_item_image(server_type=existsinfo.server_type, itemid=_id,
-                                                    imageurl=f"https://{settings.TMDB_IMAGE_DOMAIN}/t/p/original{episode['still_path']}",
-                                                    mediaserver_instance=mediaserver_instance)
-                            self.log_info(f"已修改剧集 - itemid: {_id},  第 {order} 季,  第 {ep_num} 集")
+                            tasks.append((_id, ep_num, episode, not info_unchanged))
+                    # 并发写入媒体服务器
+                    with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+                        futures = [executor.submit(self.__update_episode,
+                                                   existsinfo=existsinfo,
+                                                   itemid=_id,
+                                                   order=order,
+                                                   ep_num=ep_num,
+                                                   episode=episode,
+                                                   copy_keys=copy_keys,
+                                                   update_info=update_info,
+                                                   applied_images=applied_images,
+                                                   mediaserver_instance=mediaserver_instance)
+                                   for _id, ep_num, episode, update_info in tasks]
+                        for future in as_completed(futures):
+                            try:
+                                future.result()
+                            except Exception as e:
+                                self.log_warn(f"错误忽略: {str(e)}")
+                    if tasks:
+                        self.save_data("episode_images", applied_images)
                     # 移除已经处理成功的季
                     existsinfo.groupep.pop(order, 0)
                     existsinfo.groupid.pop(order, 0)
@@ -807,6 +815,124 @@ class EpisodeGroupMeta(_PluginBase):
         self.log_info(f"{mediainfo.title_year} 已经运行完毕了..")
         return True
 
+    def __update_episode(self, existsinfo: ExistMediaInfo, itemid: str, order: int, ep_num: int,
+                         episode: dict, copy_keys: List[str], update_info: bool = True,
+                         applied_images: Dict[str, str] = None, mediaserver_instance: Any = None):
+        """
+        按剧集组信息更新单集
+        :param update_info: 是否更新剧集信息及锁定状态，为False时只更新图片
+        :param applied_images: 已设置的剧集图片，设置成功后原地更新
+        """
+        # 获取媒体服务器媒体项
+        iteminfo = self.get_iteminfo(server_type=existsinfo.server_type, itemid=itemid, mediaserver_instance=mediaserver_instance)
+        if not iteminfo:
+            self.log_info(f"未找到媒体项 - itemid: {itemid},  第 {order} 季,  第 {ep_num} 集")
+            return
+        # 锁定的剧集是否也刮削?
+        if not self._ignorelock:
+            if iteminfo.get("LockData") or (
+                    "Name" in iteminfo.get("LockedFields", [])
+                    and "Overview" in iteminfo.get("LockedFields", [])):
+                self.log_warn(f"已锁定媒体项 - itemid: {itemid},  第 {order} 季,  第 {ep_num} 集, 如果需要刮削请打开设置中的“锁定的剧集也刮削”选项")
+                return
+        if update_info:
+            # 替换项目数据
+            new_dict = {}
+            new_dict.update({k: v for k, v in iteminfo.items() if k in copy_keys})
+            new_dict["Name"] = episode["name"]
+            new_dict["Overview"] = episode["overview"]
+            new_dict["ParentIndexNumber"] = str(order)
+            new_dict["IndexNumber"] = str(ep_num)
+            new_dict["LockData"] = True
+            if episode.get("vote_average"):
+                new_dict["CommunityRating"] = episode.get("vote_average")
+            if not new_dict.get("LockedFields"):
+                new_dict["LockedFields"] = []
+            self.__append_to_list(new_dict["LockedFields"], "Name")
+            self.__append_to_list(new_dict["LockedFields"], "Overview")
+            # 更新数据
+            self.set_iteminfo(server_type=existsinfo.server_type, itemid=itemid, iteminfo=new_dict, mediaserver_instance=mediaserver_instance)
+        # still_path 图片
+        if episode.get("still_path"):
+            if self.set_item_image(server_type=existsinfo.server_type, itemid=itemid,
+                                   imageurl=f"https://{settings.TMDB_IMAGE_DOMAIN}/t/p/original{episode['still_path']}",
+                                   mediaserver_instance=mediaserver_instance) \
+                    and applied_images is not None:
+                applied_images[f"{existsinfo.server}:{itemid}"] = episode["still_path"]
+        self.log_info(f"已修改剧集 - itemid: {itemid},  第 {order} 季,  第 {ep_num} 集")
+
+    @staticmethod
+    def __episode_unchanged(iteminfo: Optional[dict], episode: dict, order: int, ep_num: int) -> bool:
+        """
+        剧集列表中的集信息及锁定状态是否已与剧集组一致
+        """
+        if not iteminfo:
+            return False
+        locked_fields = iteminfo.get("LockedFields") or []
+        return iteminfo.get("Name") == episode.get("name") \
+            and (iteminfo.get("Overview") or "") == (episode.get("overview") or "") \
+            and str(iteminfo.get("ParentIndexNumber")) == str(order) \
+            and str(iteminfo.get("IndexNumber")) == str(ep_num) \
+            and bool(iteminfo.get("LockData")) \
+            and "Name" in locked_fields and "Overview" in locked_fields
+
+    @staticmethod
+    def __image_unchanged(iteminfo: Optional[dict], episode: dict, applied_image: Optional[str]) -> bool:
+        """
+        剧集图片是否已设置为剧集组中的图片
+        """
+        if not episode.get("still_path"):
+            return True
+        if not iteminfo or applied_image != episode.get("still_path"):
+            return False
+        # 媒体服务器中图片被删除时重新设置
+        image_tags = iteminfo.get("ImageTags")
+        return image_tags is None or bool(image_tags.get("Primary"))
+
+    def __get_cached_image(self, imageurl: str) -> Optional[Path]:
+        """
+        下载图片到本地缓存，按地址摘要命名，多个媒体服务器及多次运行共用
+        """
+        cache_path = self.get_data_path() / "images"
+        image_file = cache_path / hashlib.sha256(imageurl.encode()).hexdigest()
+        if image_file.exists():
+            image_file.touch()
+            return image_file
+        try:
+            if "doubanio.com" in imageurl:
+                r = RequestUtils(headers={
+                    'Referer': "https://movie.douban.com/"
+                }, ua=settings.USER_AGENT).get_res(url=imageurl, raise_exception=True)
+            else:
+                r = RequestUtils().get_res(url=imageurl, raise_exception=True)
+            if r:
+                cache_path.mkdir(parents=True, exist_ok=True)
+                # 先写临时文件，避免并发读取到不完整的图片
+                tmp_file = image_file.with_suffix(f".{threading.get_ident()}.tmp")
+                tmp_file.write_bytes(r.content)
+                tmp_file.replace(image_file)
+                return image_file
+            else:
+                self.log_error(f"{imageurl} 图片下载失败，请检查网络连通性")
+        except Exception as err:
+            self.log_error(f"下载图片失败：{str(err)}")
+        return None
+
+    def __clean_image_cache(self):
+        """
+        清理过期的图片缓存
+        """
+        try:
+            cache_path = self.get_data_path() / "images"
+            if not cache_path.exists():
+                return
+            expire_time = time.time() - self._image_cache_days * 24 * 3600
+            for image_file in cache_path.iterdir():
+                if image_file.is_file() and image_file.stat().st_mtime < expire_time:
+                    image_file.unlink()
+        except Exception as err:
+            self.log_warn(f"清理图片缓存失败：{str(err)}")
+
     @staticmethod
     def __append_to_list(list, item):
         if item not in list:
@@ -822,11 +948,12 @@ class EpisodeGroupMeta(_PluginBase):
         def __emby_media_exists():
             # 获取系列id
             item_id = None
+            item_tmdbid = None
             try:
                 instance = mediaserver_instance or self.emby
                 res = instance.get_data(("[HOST]emby/Items?"
                                           "IncludeItemTypes=Series"
-                                          "&Fields=ProductionYear"
+                                          "&Fields=ProductionYear,ProviderIds"
                                           "&StartIndex=0"
                                           "&Recursive=true"
                                           "&SearchTerm=%s"
@@ -839,26 +966,28 @@ class EpisodeGroupMeta(_PluginBase):
                         if res_item.get('Name') == mediainfo.title and (
                                 not mediainfo.year or str(res_item.get('ProductionYear')) == str(mediainfo.year)):
                             item_id = res_item.get('Id')
+                            provider_ids = res_item.get('ProviderIds') or {}
+                            item_tmdbid = provider_ids.get('Tmdb') or provider_ids.get('tmdb')
             except Exception as e:
                 self.log_error(f"媒体服务器 ({server_type}){server} 发生了错误, 连接Items出错：" + str(e))
             if not item_id:
                 return None
-            # 验证tmdbid是否相同
-            item_info = instance.get_iteminfo(item_id)
-            if item_info:
-                if mediainfo.tmdb_id and item_info.tmdbid:
-                    if str(mediainfo.tmdb_id) != str(item_info.tmdbid):
-                        self.log_error(f"tmdbid不匹配或不存在")
-                        return None
+            # 验证tmdbid是否相同，搜索结果中已包含ProviderIds，无需再查询详情
+            if mediainfo.tmdb_id and item_tmdbid:
+                if str(mediainfo.tmdb_id) != str(item_tmdbid):
+                    self.log_error(f"tmdbid不匹配或不存在")
+                    return None
             try:
                 res_json = instance.get_data(
-                    "[HOST]emby/Shows/%s/Episodes?Season=&IsMissing=false&api_key=[APIKEY]" % item_id)
+                    "[HOST]emby/Shows/%s/Episodes?Season=&IsMissing=false&Fields=Overview,ProviderIds,LockedFields&api_key=[APIKEY]" % item_id)
                 if res_json:
                     tv_item = res_json.json()
                     res_items = tv_item.get("Items")
                     group_ep = {}
                     group_id = {}
+                    iteminfos = {}
                     for res_item in res_items:
+                        iteminfos[str(res_item.get("Id"))] = res_item
                         season_index = res_item.get("ParentIndexNumber")
                         if season_index is None:
                             continue
@@ -882,6 +1011,7 @@ class EpisodeGroupMeta(_PluginBase):
                         groupid=group_id,
                         server_type=server_type,
                         server=server,
+                        iteminfos=iteminfos,
                     )
             except Exception as e:
                 self.log_error(f"媒体服务器 ({server_type}){server} 发生了错误, 连接Shows/Id/Episodes出错：{str(e)}")
@@ -890,11 +1020,13 @@ class EpisodeGroupMeta(_PluginBase):
         def __jellyfin_media_exists():
             # 获取系列id
             item_id = None
+            item_tmdbid = None
             try:
                 instance = mediaserver_instance or self.jellyfin
                 res = instance.get_data(url=f"[HOST]Users/[USER]/Items?api_key=[APIKEY]"
                                                  f"&searchTerm={mediainfo.title}"
                                                  f"&IncludeItemTypes=Series"
+                                                 f"&Fields=ProductionYear,ProviderIds"
                                                  f"&Limit=10&Recursive=true")
                 res_items = res.json().get("Items")
                 if res_items:
@@ -902,26 +1034,28 @@ class EpisodeGroupMeta(_PluginBase):
                         if res_item.get('Name') == mediainfo.title and (
                                 not mediainfo.year or str(res_item.get('ProductionYear')) == str(mediainfo.year)):
                             item_id = res_item.get('Id')
+                            provider_ids = res_item.get('ProviderIds') or {}
+                            item_tmdbid = provider_ids.get('Tmdb') or provider_ids.get('tmdb')
             except Exception as e:
                 self.log_error(f"媒体服务器 ({server_type}){server} 发生了错误, 连接Items出错：" + str(e))
             if not item_id:
                 return None
-            # 验证tmdbid是否相同
-            item_info = instance.get_iteminfo(item_id)
-            if item_info:
-                if mediainfo.tmdb_id and item_info.tmdbid:
-                    if str(mediainfo.tmdb_id) != str(item_info.tmdbid):
-                        self.log_error(f"tmdbid不匹配或不存在")
-                        return None
+            # 验证tmdbid是否相同，搜索结果中已包含ProviderIds，无需再查询详情
+            if mediainfo.tmdb_id and item_tmdbid:
+                if str(mediainfo.tmdb_id) != str(item_tmdbid):
+                    self.log_error(f"tmdbid不匹配或不存在")
+                    return None
             try:
                 res_json = instance.get_data(
-                    "[HOST]Shows/%s/Episodes?Season=&IsMissing=false&api_key=[APIKEY]" % item_id)
+                    "[HOST]Shows/%s/Episodes?Season=&IsMissing=false&Fields=Overview,ProviderIds,LockedFields&api_key=[APIKEY]" % item_id)
                 if res_json:
                     tv_item = res_json.json()
                     res_items = tv_item.get("Items")
                     group_ep = {}
                     group_id = {}
+                    iteminfos = {}
                     for res_item in res_items:
+                        iteminfos[str(res_item.get("Id"))] = res_item
                         season_index = res_item.get("ParentIndexNumber")
                         if season_index is None:
                             continue
@@ -945,6 +1079,7 @@ class EpisodeGroupMeta(_PluginBase):
                         groupid=group_id,
                         server_type=server_type,
                         server=server,
+                        iteminfos=iteminfos,
                     )
             except Exception as e:
                 self.log_error(f"媒体服务器 ({server_type}){server} 发生了错误, 连接Shows/Id/Episodes出错：{str(e)}")
@@ -978,6 +1113,7 @@ class EpisodeGroupMeta(_PluginBase):
                 episodes = videos.episodes()
                 group_ep = {}
                 group_id = {}
+                iteminfos = {}
                 for episode in episodes:
                     season_index = episode.seasonNumber
                     if season_index is None:
@@ -998,6 +1134,18 @@ class EpisodeGroupMeta(_PluginBase):
                     _index = group_ep[season_index].index(episode_index)
                     if episode_id not in group_id[season_index][_index]:
                         group_id[season_index][_index].append(episode_id)
+                    # Plex没有整体锁定，以标题和简介的锁定状态为准
+                    locked_fields = [_field for _name, _field in [("title", "Name"), ("summary", "Overview")]
+                                     if any(f.name == _name and f.locked for f in episode.fields)]
+                    iteminfos[str(episode_id)] = {
+                        "Name": episode.title,
+                        "Overview": episode.summary,
+                        "ParentIndexNumber": season_index,
+                        "IndexNumber": episode_index,
+                        "LockData": True,
+                        "LockedFields": locked_fields,
+                        "ImageTags": {"Primary": episode.thumb} if episode.thumb else {}
+                    }
                 # 返回
                 return ExistMediaInfo(
                     itemid=videos.key,
@@ -1005,6 +1153,7 @@ class EpisodeGroupMeta(_PluginBase):
                     groupid=group_id,
                     server_type=server_type,
                     server=server,
+                    iteminfos=iteminfos,
                 )
             except Exception as e:
                 self.log_error(f"媒体服务器 ({server_type}){server} 发生了错误, 连接Shows/Id/Episodes出错：{str(e)}")
@@ -1218,19 +1367,9 @@ class EpisodeGroupMeta(_PluginBase):
             """
             下载图片
             """
-            try:
-                if "doubanio.com" in imageurl:
-                    r = RequestUtils(headers={
-                        'Referer': "https://movie.douban.com/"
-                    }, ua=settings.USER_AGENT).get_res(url=imageurl, raise_exception=True)
-                else:
-                    r = RequestUtils().get_res(url=imageurl, raise_exception=True)
-                if r:
-                    return base64.b64encode(r.content).decode()
-                else:
-                    self.log_error(f"{imageurl} 图片下载失败，请检查网络连通性")
-            except Exception as err:
-                self.log_error(f"下载图片失败：{str(err)}")
+            image_file = self.__get_cached_image(imageurl)
+            if image_file:
+                return base64.b64encode(image_file.read_bytes()).decode()
             return None
 
         def __set_emby_item_image(_base64: str):
@@ -1278,12 +1417,15 @@ class EpisodeGroupMeta(_PluginBase):
         def __set_plex_item_image():
             """
             更新Plex媒体项图片
-            # FIXME 改为预下载图片
             """
             try:
                 instance = mediaserver_instance or self.plex
                 plexitem = instance.get_plex().library.fetchItem(ekey=itemid)
-                plexitem.uploadPoster(url=imageurl)
+                image_file = self.__get_cached_image(imageurl)
+                if image_file:
+                    plexitem.uploadPoster(filepath=str(image_file))
+                else:
+                    plexitem.uploadPoster(url=imageurl)
                 return True
             except Exception as err:
                 self.log_error(f"更新Plex媒体项图片失败：{err}")
@@ -1,4 +1,6 @@
+import os
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from pathlib import Path
 from threading import Event as ThreadEvent
@@ -17,8 +19,6 @@ from app.schemas import TransferInfo
 from app.schemas.types import EventType
 from app.utils.system import SystemUtils
 
-ffmpeg_lock = threading.Lock()
-
 
 class FFmpegThumb(_PluginBase):
     # 插件名称
@@ -28,7 +28,7 @@ class FFmpegThumb(_PluginBase):
     # 插件图标
     plugin_icon = "ffmpeg.png"
     # 插件版本
-    plugin_version = "1.2"
+    plugin_version = "1.3"
     # 插件作者
     plugin_author = "jxxghp"
     # 作者主页
@@ -48,8 +48,14 @@ class FFmpegThumb(_PluginBase):
     _timeline = "00:03:01"
     _scan_paths = ""
     _exclude_paths = ""
+    _threads = None
     # 退出事件
     _event = ThreadEvent()
+    # 同时运行的ffmpeg进程数限制
+    _ffmpeg_semaphore = None
+    # 已生成缩略图的文件索引
+    _thumb_index = set()
+    _index_lock = threading.Lock()
 
     def init_plugin(self, config: dict = None):
         # 读取配置
@@ -60,6 +66,14 @@ class FFmpegThumb(_PluginBase):
             self._timeline = config.get("timeline")
             self._scan_paths = config.get("scan_paths") or ""
             self._exclude_paths = config.get("exclude_paths") or ""
+            try:
+                self._threads = int(config.get("threads")) if config.get("threads") else None
+            except ValueError:
+                self._threads = None
+        if not self._threads or self._threads < 1:
+            self._threads = os.cpu_count() or 1
+        self._ffmpeg_semaphore = threading.BoundedSemaphore(self._threads)
+        self._thumb_index = set(self.get_data("thumb_index") or [])
 
         # 停止现有任务
         self.stop_service()
@@ -89,7 +103,8 @@ class FFmpegThumb(_PluginBase):
                     "cron": self._cron,
                     "timeline": self._timeline,
                     "scan_paths": self._scan_paths,
-                    "exclude_paths": self._exclude_paths
+                    "exclude_paths": self._exclude_paths,
+                    "threads": self._threads
                 })
             if self._scheduler.get_jobs():
                 # 启动服务
@@ -155,7 +170,7 @@ class FFmpegThumb(_PluginBase):
                                 'component': 'VCol',
                                 'props': {
                                     'cols': 12,
-                                    'md': 6
+                                    'md': 4
                                 },
                                 'content': [
                                     {
@@ -172,7 +187,7 @@ class FFmpegThumb(_PluginBase):
                                 'component': 'VCol',
                                 'props': {
                                     'cols': 12,
-                                    'md': 6
+                                    'md': 4
                                 },
                                 'content': [
                                     {
@@ -184,6 +199,23 @@ class FFmpegThumb(_PluginBase):
                                         }
                                     }
                                 ]
+                            },
+                            {
+                                'component': 'VCol',
+                                'props': {
+                                    'cols': 12,
+                                    'md': 4
+                                },
+                                'content': [
+                                    {
+                                        'component': 'VTextField',
+                                        'props': {
+                                            'model': 'threads',
+                                            'label': '并发进程数',
+                                            'placeholder': '留空为CPU核数'
+                                        }
+                                    }
+                                ]
                             }
                         ]
                     },
@@ -259,6 +291,7 @@ class FFmpegThumb(_PluginBase):
             "cron": "",
             "timeline": "00:03:01",
             "scan_paths": "",
+            "threads": "",
             "err_hosts": ""
         }
 
@@ -287,6 +320,7 @@ class FFmpegThumb(_PluginBase):
                 logger.warn(f"{file_path} 不是支持的视频文件")
                 continue
             self.gen_file_thumb(file_path)
+        self.__save_index()
 
     def __libraryscan(self):
         """
@@ -295,55 +329,95 @@ class FFmpegThumb(_PluginBase):
         if not self._scan_paths:
             return
         # 排除目录
-        exclude_paths = self._exclude_paths.split("\n")
+        exclude_paths = [Path(path) for path in self._exclude_paths.split("\n") if path]
         # 已选择的目录
         paths = self._scan_paths.split("\n")
-        for path in paths:
-            if not path:
-                continue
-            scan_path = Path(path)
-            if not scan_path.exists():
-                logger.warning(f"FFmpeg缩略图扫描路径不存在：{path}")
-                continue
-            logger.info(f"开始FFmpeg缩略图扫描：{path} ...")
-            # 遍历目录下的所有文件
-            for file_path in SystemUtils.list_files(scan_path, extensions=settings.RMT_MEDIAEXT):
-                if self._event.is_set():
-                    logger.info(f"FFmpeg缩略图扫描服务停止")
-                    return
-                # 排除目录
-                exclude_flag = False
-                for exclude_path in exclude_paths:
-                    try:
-                        if file_path.is_relative_to(Path(exclude_path)):
-                            exclude_flag = True
-                            break
-                    except Exception as err:
-                        print(str(err))
-                if exclude_flag:
-                    logger.debug(f"{file_path} 在排除目录中，跳过 ...")
-                    continue
-                # 开始处理文件
-                self.gen_file_thumb(file_path)
-            logger.info(f"目录 {path} 扫描完成")
+        # 本次扫描到的文件，用于清理索引
+        scanned_files = set()
+        # 扫描是否完整
+        completed = True
+        try:
+            with ThreadPoolExecutor(max_workers=self._threads) as executor:
+                for path in paths:
+                    if not path:
+                        continue
+                    scan_path = Path(path)
+                    if not scan_path.exists():
+                        logger.warning(f"FFmpeg缩略图扫描路径不存在：{path}")
+                        completed = False
+                        continue
+                    logger.info(f"开始FFmpeg缩略图扫描：{path} ...")
+                    new_count = 0
+                    # 遍历目录下的所有文件
+                    for file_path in SystemUtils.list_files(scan_path, extensions=settings.RMT_MEDIAEXT):
+                        if self._event.is_set():
+                            logger.info(f"FFmpeg缩略图扫描服务停止")
+                            completed = False
+                            return
+                        # 排除目录
+                        exclude_flag = False
+                        for exclude_path in exclude_paths:
+                            try:
+                                if file_path.is_relative_to(exclude_path):
+                                    exclude_flag = True
+                                    break
+                            except Exception as err:
+                                print(str(err))
+                        if exclude_flag:
+                            logger.debug(f"{file_path} 在排除目录中，跳过 ...")
+                            continue
+                        scanned_files.add(str(file_path))
+                        # 已在索引中的文件不再处理
+                        if str(file_path) in self._thumb_index:
+                            continue
+                        # 开始处理文件
+                        new_count += 1
+                        executor.submit(self.gen_file_thumb, file_path)
+                    logger.info(f"目录 {path} 扫描完成，新增待处理文件 {new_count} 个")
+        finally:
+            # 完整扫描后清理已不存在的文件
+            if completed:
+                with self._index_lock:
+                    self._thumb_index &= scanned_files
+            self.__save_index()
 
     def gen_file_thumb(self, file_path: Path):
         """
         处理一个文件
         """
-        # 单线程处理
-        with ffmpeg_lock:
+        if self._event.is_set():
+            return
+        # 限制同时运行的ffmpeg进程数
+        with self._ffmpeg_semaphore:
             try:
                 thumb_path = file_path.with_name(file_path.stem + "-thumb.jpg")
                 if thumb_path.exists():
                     logger.info(f"缩略图已存在：{thumb_path}")
+                    self.__add_index(file_path)
                     return
                 if FfmpegHelper.get_thumb(video_path=str(file_path),
                                           image_path=str(thumb_path), frames=self._timeline):
                     logger.info(f"{file_path} 缩略图已生成：{thumb_path}")
+                    self.__add_index(file_path)
+                else:
+                    logger.warn(f"{file_path} 缩略图生成失败")
             except Exception as err:
                 logger.error(f"FFmpeg处理文件 {file_path} 时发生错误：{str(err)}")
 
+    def __add_index(self, file_path: Path):
+        """
+        记录已生成缩略图的文件
+        """
+        with self._index_lock:
+            self._thumb_index.add(str(file_path))
+
+    def __save_index(self):
+        """
+        保存缩略图索引
+        """
+        with self._index_lock:
+            self.save_data("thumb_index", list(self._thumb_index))
+
     def stop_service(self):
         """
         退出插件
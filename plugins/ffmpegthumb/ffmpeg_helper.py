@@ -1,25 +1,29 @@
 import json
 import subprocess
-
-from app.utils.system import SystemUtils
+from pathlib import Path
 
 
 class FfmpegHelper:
 
     @staticmethod
-    def get_thumb(video_path: str, image_path: str, frames: str = None):
+    def get_thumb(video_path: str, image_path: str, frames: str = None, timeout: int = 120):
         """
         使用ffmpeg从视频文件中截取缩略图
+        -ss 放在 -i 之前，按关键帧快速定位，无需解码前面的视频
         """
         if not frames:
             frames = "00:03:01"
         if not video_path or not image_path:
             return False
-        cmd = 'ffmpeg -i "{video_path}" -ss {frames} -vframes 1 -f image2 "{image_path}"'.format(video_path=video_path,
-                                                                                                 frames=frames,
-                                                                                                 image_path=image_path)
-        result = SystemUtils.execute(cmd)
-        if result:
+        command = ['ffmpeg', "-hide_banner", "-loglevel", "error", '-y',
+                   '-ss', frames, '-i', video_path,
+                   '-frames:v', '1', '-f', 'image2', image_path]
+        try:
+            ret = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                 timeout=timeout).returncode
+        except subprocess.TimeoutExpired:
+            return False
+        if ret == 0 and Path(image_path).exists():
             return True
         return False
 
@@ -6,13 +6,17 @@ import time
 from pathlib import Path
 from typing import List, Tuple, Dict, Any, Optional
 
+import requests
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
 
 from app import schemas
 from app.chain.transfer import TransferChain
 from app.core.config import settings
 from app.core.event import eventmanager, Event
+from app.db import db_query
 from app.db.models.transferhistory import TransferHistory
 from app.log import logger
 from app.modules.emby import Emby
@@ -29,7 +33,7 @@ class MediaSyncDel(_PluginBase):
     # 插件图标
     plugin_icon = "mediasyncdel.png"
     # 插件版本
-    plugin_version = "1.7.1"
+    plugin_version = "1.8.1"
     # 插件作者
     plugin_author = "thsrite"
     # 作者主页
@@ -785,9 +789,7 @@ class MediaSyncDel(_PluginBase):
 
         # 开始删除
         year = None
-        del_torrent_hashs = []
-        stop_torrent_hashs = []
-        error_cnt = 0
+        torrent_srcs: Dict[str, dict] = {}
         image = 'https://emby.media/notificationicon.png'
         for transferhis in transfer_history:
             title = transferhis.title
@@ -807,21 +809,13 @@ class MediaSyncDel(_PluginBase):
                 if transferhis.src and Path(transferhis.src).suffix in settings.RMT_MEDIAEXT:
                     self._transferchain.delete_files(Path(transferhis.src))
                     if transferhis.download_hash:
-                        try:
-                            # 2、判断种子是否被删除完
-                            delete_flag, success_flag, handle_torrent_hashs = self.handle_torrent(
-                                type=transferhis.type,
-                                src=transferhis.src,
-                                torrent_hash=transferhis.download_hash)
-                            if not success_flag:
-                                error_cnt += 1
-                            else:
-                                if delete_flag:
-                                    del_torrent_hashs += handle_torrent_hashs
-                                else:
-                                    stop_torrent_hashs += handle_torrent_hashs
-                        except Exception as e:
-                            logger.error("删除种子失败：%s" % str(e))
+                        torrent_srcs.setdefault(transferhis.download_hash, {
+                            "type": transferhis.type,
+                            "srcs": []
+                        })["srcs"].append(transferhis.src)
+
+        # 2、判断种子是否被删除完，每个种子只处理一次
+        torrent_results = self.__handle_torrents(torrent_srcs)
 
         logger.info(f"同步删除 {msg} 完成！")
 
@@ -837,19 +831,8 @@ class MediaSyncDel(_PluginBase):
                 episode=episode_num
             ) or image
 
-            torrent_cnt_msg = ""
-            if del_torrent_hashs:
-                torrent_cnt_msg += f"删除种子{len(set(del_torrent_hashs))}个\n"
-            if stop_torrent_hashs:
-                stop_cnt = 0
-                # 排除已删除
-                for stop_hash in set(stop_torrent_hashs):
-                    if stop_hash not in set(del_torrent_hashs):
-                        stop_cnt += 1
-                if stop_cnt > 0:
-                    torrent_cnt_msg += f"暂停种子{stop_cnt}个\n"
-            if error_cnt:
-                torrent_cnt_msg += f"删种失败{error_cnt}个\n"
+            torrent_cnt_msg = self.__torrent_cnt_msg(torrent_results=torrent_results,
+                                                     torrent_hashs=set(torrent_srcs.keys()))
             # 发送通知
             self.post_message(
                 mtype=NotificationType.MediaServer,
@@ -955,6 +938,8 @@ class MediaSyncDel(_PluginBase):
         # 读取历史记录
         history = self.get_data('history') or []
         last_time = self.get_data("last_time") or None
+        # 日志文件读取位置
+        log_offsets = self.get_data("log_offsets") or {}
         del_medias = []
 
         # 媒体服务器类型，多个以,分隔
@@ -963,107 +948,63 @@ class MediaSyncDel(_PluginBase):
         media_servers = settings.MEDIASERVER.split(',')
         for media_server in media_servers:
             if media_server == 'emby':
-                del_medias.extend(self.parse_emby_log(last_time))
+                emby_offsets = log_offsets.get("emby") or {}
+                del_medias.extend(self.parse_emby_log(last_time, emby_offsets))
+                log_offsets["emby"] = emby_offsets
             elif media_server == 'jellyfin':
-                del_medias.extend(self.parse_jellyfin_log(last_time))
+                jellyfin_offsets = log_offsets.get("jellyfin") or {}
+                del_medias.extend(self.parse_jellyfin_log(last_time, jellyfin_offsets))
+                log_offsets["jellyfin"] = jellyfin_offsets
             elif media_server == 'plex':
                 # TODO plex解析日志
                 return
 
         if not del_medias:
-            logger.error("未解析到已删除媒体信息")
+            logger.info("未解析到新的已删除媒体信息")
+            self.save_data("log_offsets", log_offsets)
             return
 
-        # 遍历删除
-        last_del_time = None
-        for del_media in del_medias:
-            # 删除时间
-            del_time = del_media.get("time")
-            last_del_time = del_time or datetime.datetime.now()
-            # 媒体类型 Movie|Series|Season|Episode
-            media_type = del_media.get("type")
-            # 媒体名称 蜀山战纪
-            media_name = del_media.get("name")
-            # 媒体年份 2015
-            media_year = del_media.get("year")
+        # 最新删除时间
+        last_del_time = max([str(del_media.get("time")) for del_media in del_medias if del_media.get("time")],
+                            default=None) or datetime.datetime.now()
+
+        # 排除路径、处理路径映射
+        medias = []
+        for del_media in self.sort_del_medias(del_medias):
             # 媒体路径 /data/series/国产剧/蜀山战纪 (2015)/Season 2/蜀山战纪 - S02E01 - 第1集.mp4
             media_path = del_media.get("path")
-            # 季数 S02
-            media_season = del_media.get("season")
-            # 集数 E02
-            media_episode = del_media.get("episode")
-
             # 排除路径不处理
             if self._exclude_path and media_path and any(
                     os.path.abspath(media_path).startswith(os.path.abspath(path)) for path in
                     self._exclude_path.split(",")):
                 logger.info(f"媒体路径 {media_path} 已被排除，暂不处理")
-                self.save_data("last_time", last_del_time)
-                return
+                continue
 
             # 处理路径映射 (处理同一媒体多分辨率的情况)
-            if self._library_path:
+            if self._library_path and media_path:
                 paths = self._library_path.split("\n")
                 for path in paths:
                     sub_paths = path.split(":")
                     if len(sub_paths) < 2:
                         continue
                     media_path = media_path.replace(sub_paths[0], sub_paths[1]).replace('\\', '/')
+            medias.append({**del_media, "path": media_path})
 
-            # 获取删除的记录
-            # 删除电影
-            if media_type == "Movie":
-                msg = f'电影 {media_name}'
-                transfer_history: List[TransferHistory] = self._transferhis.get_by(
-                    title=media_name,
-                    year=media_year,
-                    dest=media_path)
-            # 删除电视剧
-            elif media_type == "Series":
-                msg = f'剧集 {media_name}'
-                transfer_history: List[TransferHistory] = self._transferhis.get_by(
-                    title=media_name,
-                    year=media_year)
-            # 删除季 S02
-            elif media_type == "Season":
-                msg = f'剧集 {media_name} {media_season}'
-                transfer_history: List[TransferHistory] = self._transferhis.get_by(
-                    title=media_name,
-                    year=media_year,
-                    season=media_season)
-            # 删除剧集S02E02
-            elif media_type == "Episode":
-                msg = f'剧集 {media_name} {media_season}{media_episode}'
-                transfer_history: List[TransferHistory] = self._transferhis.get_by(
-                    title=media_name,
-                    year=media_year,
-                    season=media_season,
-                    episode=media_episode,
-                    dest=media_path)
-            else:
-                self.save_data("last_time", last_del_time)
-                continue
-
-            logger.info(f"正在同步删除 {msg}")
+        # 批量查询转移记录
+        media_historys = self.__resolve_transfer_his(medias)
 
-            if not transfer_history:
-                logger.info(f"未获取到 {msg} 转移记录，请检查路径映射是否配置错误，请检查tmdbid获取是否正确")
-                self.save_data("last_time", last_del_time)
-                continue
-
-            logger.info(f"获取到删除历史记录数量 {len(transfer_history)}")
-
-            # 开始删除
+        # 删除转移记录、源文件，按种子归并源文件
+        torrent_srcs: Dict[str, dict] = {}
+        media_results = []
+        for media, msg, transfer_history in media_historys:
+            logger.info(f"正在同步删除 {msg}，获取到删除历史记录数量 {len(transfer_history)}")
             image = 'https://emby.media/notificationicon.png'
-            del_torrent_hashs = []
-            stop_torrent_hashs = []
-            error_cnt = 0
+            media_hashs = set()
             for transferhis in transfer_history:
                 title = transferhis.title
-                if title not in media_name:
+                if title not in media.get("name"):
                     logger.warn(
-                        f"当前转移记录 {transferhis.id} {title} {transferhis.tmdbid} 与删除媒体{media_name}不符，防误删，暂不自动删除")
-                    self.save_data("last_time", last_del_time)
+                        f"当前转移记录 {transferhis.id} {title} {transferhis.tmdbid} 与删除媒体{media.get('name')}不符，防误删，暂不自动删除")
                     continue
                 image = transferhis.image or image
                 # 0、删除转移记录
@@ -1075,37 +1016,24 @@ class MediaSyncDel(_PluginBase):
                     if transferhis.src and Path(transferhis.src).suffix in settings.RMT_MEDIAEXT:
                         self._transferchain.delete_files(Path(transferhis.src))
                         if transferhis.download_hash:
-                            try:
-                                # 2、判断种子是否被删除完
-                                delete_flag, success_flag, handle_torrent_hashs = self.handle_torrent(
-                                    type=transferhis.type,
-                                    src=transferhis.src,
-                                    torrent_hash=transferhis.download_hash)
-                                if not success_flag:
-                                    error_cnt += 1
-                                else:
-                                    if delete_flag:
-                                        del_torrent_hashs += handle_torrent_hashs
-                                    else:
-                                        stop_torrent_hashs += handle_torrent_hashs
-                            except Exception as e:
-                                logger.error("删除种子失败：%s" % str(e))
+                            torrent_srcs.setdefault(transferhis.download_hash, {
+                                "type": transferhis.type,
+                                "srcs": []
+                            })["srcs"].append(transferhis.src)
+                            media_hashs.add(transferhis.download_hash)
+            media_results.append((media, msg, transfer_history, image, media_hashs))
+
+        # 2、判断种子是否被删除完，每个种子只处理一次
+        torrent_results = self.__handle_torrents(torrent_srcs)
 
+        for media, msg, transfer_history, image, media_hashs in media_results:
             logger.info(f"同步删除 {msg} 完成！")
+            media_type = media.get("type")
 
             # 发送消息
             if self._notify:
-                torrent_cnt_msg = ""
-                if del_torrent_hashs:
-                    torrent_cnt_msg += f"删除种子{len(set(del_torrent_hashs))}个\n"
-                if stop_torrent_hashs:
-                    stop_cnt = 0
-                    # 排除已删除
-                    for stop_hash in set(stop_torrent_hashs):
-                        if stop_hash not in set(del_torrent_hashs):
-                            stop_cnt += 1
-                    if stop_cnt > 0:
-                        torrent_cnt_msg += f"暂停种子{stop_cnt}个\n"
+                torrent_cnt_msg = self.__torrent_cnt_msg(torrent_results=torrent_results,
+                                                         torrent_hashs=media_hashs)
                 self.post_message(
                     mtype=NotificationType.MediaServer,
                     title="媒体库同步删除任务完成",
@@ -1117,11 +1045,11 @@ class MediaSyncDel(_PluginBase):
 
             history.append({
                 "type": "电影" if media_type == "Movie" else "电视剧",
-                "title": media_name,
-                "year": media_year,
-                "path": media_path,
-                "season": media_season,
-                "episode": media_episode,
+                "title": media.get("name"),
+                "year": media.get("year"),
+                "path": media.get("path"),
+                "season": media.get("season"),
+                "episode": media.get("episode"),
                 "image": image,
                 "del_time": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(time.time()))
             })
@@ -1130,12 +1058,196 @@ class MediaSyncDel(_PluginBase):
         self.save_data("history", history)
 
         self.save_data("last_time", last_del_time)
+        # 处理完成后再保存日志读取位置，中途出错时下次重新读取这部分日志
+        self.save_data("log_offsets", log_offsets)
+
+    def __resolve_transfer_his(self, medias: List[dict]) -> List[Tuple[dict, str, List[TransferHistory]]]:
+        """
+        批量查询删除媒体对应的转移记录
+        先按路径一次性查询（文件精确匹配、剧集/季目录前缀匹配），未命中的再按标题、年份等条件查询
+        同一转移记录只归属于最先匹配到的媒体（剧集、季优先），其下的季、集不再单独处理
+        :return: [(媒体信息, 描述, 转移记录)]
+        """
+        file_paths = []
+        dir_paths = []
+        for media in medias:
+            media_path = media.get("path")
+            if not media_path:
+                continue
+            if media.get("type") in ["Series", "Season"]:
+                dir_paths.append(media_path.rstrip("/"))
+            else:
+                file_paths.append(media_path)
+        path_historys = self.__list_transfer_his_by_paths(paths=file_paths, dirs=dir_paths, db=None) or []
+
+        results = []
+        handled_ids = set()
+        for media in medias:
+            # 媒体类型 Movie|Series|Season|Episode
+            media_type = media.get("type")
+            # 媒体名称 蜀山战纪
+            media_name = media.get("name")
+            # 媒体年份 2015
+            media_year = media.get("year")
+            media_path = media.get("path")
+            # 季数 S02
+            media_season = media.get("season")
+            # 集数 E02
+            media_episode = media.get("episode")
+
+            if media_type == "Movie":
+                msg = f'电影 {media_name}'
+            elif media_type == "Series":
+                msg = f'剧集 {media_name}'
+            elif media_type == "Season":
+                msg = f'剧集 {media_name} {media_season}'
+            elif media_type == "Episode":
+                msg = f'剧集 {media_name} {media_season}{media_episode}'
+            else:
+                continue
+
+            # 路径匹配
+            transfer_history = []
+            if media_path:
+                if media_type in ["Series", "Season"]:
+                    dir_prefix = f"{media_path.rstrip('/')}/"
+                    transfer_history = [his for his in path_historys
+                                        if his.dest and his.dest.startswith(dir_prefix)]
+                else:
+                    transfer_history = [his for his in path_historys if his.dest == media_path]
 
-    def handle_torrent(self, type: str, src: str, torrent_hash: str):
+            # 按条件查询
+            if not transfer_history:
+                if media_type == "Movie":
+                    transfer_history = self._transferhis.get_by(
+                        title=media_name,
+                        year=media_year,
+                        dest=media_path)
+                elif media_type == "Series":
+                    transfer_history = self._transferhis.get_by(
+                        title=media_name,
+                        year=media_year)
+                elif media_type == "Season":
+                    transfer_history = self._transferhis.get_by(
+                        title=media_name,
+                        year=media_year,
+                        season=media_season)
+                else:
+                    transfer_history = self._transferhis.get_by(
+                        title=media_name,
+                        year=media_year,
+                        season=media_season,
+                        episode=media_episode,
+                        dest=media_path)
+
+            if not transfer_history:
+                logger.info(f"未获取到 {msg} 转移记录，请检查路径映射是否配置错误，请检查tmdbid获取是否正确")
+                continue
+
+            # 排除已被剧集、季处理的记录
+            transfer_history = [his for his in transfer_history if his.id not in handled_ids]
+            if not transfer_history:
+                logger.debug(f"{msg} 转移记录已随剧集、季一并处理")
+                continue
+            handled_ids.update(his.id for his in transfer_history)
+            results.append((media, msg, transfer_history))
+
+        return results
+
+    @db_query
+    def __list_transfer_his_by_paths(self, paths: List[str], dirs: List[str],
+                                     db: Session = None) -> List[TransferHistory]:
+        """
+        按目的路径批量查询转移记录
+        :param paths: 文件路径，精确匹配
+        :param dirs: 目录路径，前缀匹配
+        """
+        historys = []
+        try:
+            # 分批查询，避免超出SQL参数数量限制
+            for i in range(0, len(paths), 500):
+                historys.extend(db.query(TransferHistory)
+                                .filter(TransferHistory.dest.in_(paths[i:i + 500]))
+                                .all())
+            for i in range(0, len(dirs), 50):
+                historys.extend(db.query(TransferHistory)
+                                .filter(or_(*[TransferHistory.dest.like(f"{dir_path}/%")
+                                              for dir_path in dirs[i:i + 50]]))
+                                .all())
+        except Exception as e:
+            logger.error(f"批量查询转移记录失败：{str(e)}")
+        return historys
+
+    def __handle_torrents(self, torrent_srcs: Dict[str, dict]) -> Dict[str, tuple]:
+        """
+        按种子处理已删除的源文件，每个种子只查询、删除或暂停一次
+        :param torrent_srcs: 种子hash -> {type: 媒体类型, srcs: 已删除源文件}
+        :return: 种子hash -> (是否删除, 是否成功, 已处理的种子hash)
+        """
+        torrent_results = {}
+        for torrent_hash, torrent_info in torrent_srcs.items():
+            try:
+                torrent_results[torrent_hash] = self.handle_torrent(
+                    type=torrent_info.get("type"),
+                    src=torrent_info.get("srcs")[0],
+                    torrent_hash=torrent_hash,
+                    srcs=torrent_info.get("srcs"))
+            except Exception as e:
+                logger.error("删除种子失败：%s" % str(e))
+        return torrent_results
+
+    @staticmethod
+    def __torrent_cnt_msg(torrent_results: Dict[str, tuple], torrent_hashs: set) -> str:
+        """
+        汇总种子处理结果
+        """
+        del_torrent_hashs = set()
+        stop_torrent_hashs = set()
+        error_cnt = 0
+        for torrent_hash in torrent_hashs:
+            if torrent_hash not in torrent_results:
+                continue
+            delete_flag, success_flag, handle_torrent_hashs = torrent_results[torrent_hash]
+            if not success_flag:
+                error_cnt += 1
+            elif delete_flag:
+                del_torrent_hashs.update(handle_torrent_hashs)
+            else:
+                stop_torrent_hashs.update(handle_torrent_hashs)
+        torrent_cnt_msg = ""
+        if del_torrent_hashs:
+            torrent_cnt_msg += f"删除种子{len(del_torrent_hashs)}个\n"
+        # 排除已删除
+        stop_cnt = len(stop_torrent_hashs - del_torrent_hashs)
+        if stop_cnt > 0:
+            torrent_cnt_msg += f"暂停种子{stop_cnt}个\n"
+        if error_cnt:
+            torrent_cnt_msg += f"删种失败{error_cnt}个\n"
+        return torrent_cnt_msg
+
+    @staticmethod
+    def sort_del_medias(del_medias: List[dict]) -> List[dict]:
+        """
+        去重并排序删除媒体，剧集、季优先处理，以便其下的集合并处理
+        """
+        type_order = {"Series": 0, "Season": 1, "Movie": 2, "Episode": 3}
+        medias = []
+        media_keys = set()
+        for del_media in del_medias:
+            media_key = (del_media.get("type"), del_media.get("name"), del_media.get("year"),
+                         del_media.get("season"), del_media.get("episode"), del_media.get("path"))
+            if media_key in media_keys:
+                continue
+            media_keys.add(media_key)
+            medias.append(del_media)
+        return sorted(medias, key=lambda m: type_order.get(m.get("type"), len(type_order)))
+
+    def handle_torrent(self, type: str, src: str, torrent_hash: str, srcs: List[str] = None):
         """
         判断种子是否局部删除
         局部删除则暂停种子
         全部删除则删除种子
+        :param srcs: 同一种子本次删除的全部源文件，为空时仅为src
         """
         download_id = torrent_hash
         download = settings.DEFAULT_DOWNLOADER
@@ -1148,7 +1260,8 @@ class MediaSyncDel(_PluginBase):
         handle_torrent_hashs = []
         try:
             # 删除本次种子记录
-            self._downloadhis.delete_file_by_fullpath(fullpath=src)
+            for del_src in srcs or [src]:
+                self._downloadhis.delete_file_by_fullpath(fullpath=del_src)
 
             # 根据种子hash查询所有下载器文件记录
             download_files = self._downloadhis.get_files_by_hash(download_hash=torrent_hash)
@@ -1339,210 +1452,242 @@ class MediaSyncDel(_PluginBase):
         return handle_torrent_hashs
 
     @staticmethod
-    def parse_emby_log(last_time):
+    def format_server_url(url: str, host: str, apikey: str) -> str:
         """
-        获取emby日志列表、解析emby日志
+        替换地址中的[HOST]、[APIKEY]，服务器地址格式与媒体服务器模块保持一致
         """
+        host = host or ""
+        if host:
+            if not host.endswith("/"):
+                host += "/"
+            if not host.startswith("http"):
+                host = "http://" + host
+        return url.replace("[HOST]", host).replace("[APIKEY]", apikey or "")
 
-        def __parse_log(file_name: str, del_list: list):
-            """
-            解析emby日志
-            """
-            log_url = f"[HOST]System/Logs/{file_name}?api_key=[APIKEY]"
-            log_res = Emby().get_data(log_url)
-            if not log_res or log_res.status_code != 200:
-                logger.error("获取emby日志失败，请检查服务器配置")
-                return del_list
-
-            # 正则解析删除的媒体信息
-            pattern = r'(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}.\d{3}) Info App: Removing item from database, Type: (\w+), Name: (.*), Path: (.*), Id: (\d+)'
-            matches = re.findall(pattern, log_res.text)
-
-            # 循环获取媒体信息
-            for match in matches:
-                mtime = match[0]
-                # 排除已处理的媒体信息
-                if last_time and mtime < last_time:
-                    continue
-
-                mtype = match[1]
-                name = match[2]
-                path = match[3]
-
-                year = None
-                year_pattern = r'\(\d+\)'
-                year_match = re.search(year_pattern, path)
-                if year_match:
-                    year = year_match.group()[1:-1]
+    @staticmethod
+    def tail_log(log_url: str, log_file: dict, log_offsets: dict,
+                 max_bytes: int = 10 * 1024 * 1024) -> List[str]:
+        """
+        增量读取媒体服务器日志
+        以文件名+创建时间识别日志文件，记录已读取的字节偏移，仅请求偏移之后的新增内容
+        :param log_url: 日志地址，已替换[HOST]、[APIKEY]
+        :param log_file: 日志文件信息 Name/DateCreated/Size
+        :param log_offsets: 各日志文件读取位置，读取完成后原地更新
+        :param max_bytes: 单次最多读取的字节数，剩余内容留待下次读取
+        :return: 新增的完整日志行
+        """
+        file_name = log_file.get("Name")
+        file_created = log_file.get("DateCreated")
+        file_size = log_file.get("Size")
+        offset = 0
+        state = log_offsets.get(file_name) or {}
+        if state.get("created") == file_created:
+            offset = state.get("offset") or 0
+        # 文件被截断，从头读取
+        if file_size is not None and file_size < offset:
+            offset = 0
+        # 无新增内容，无需请求
+        if file_size is not None and file_size == offset:
+            log_offsets[file_name] = {"created": file_created, "offset": offset}
+            return []
+
+        headers = {"Range": f"bytes={offset}-"} if offset else None
+        content = bytearray()
+        try:
+            with requests.get(log_url, headers=headers, stream=True, timeout=30) as log_res:
+                if log_res.status_code == 416:
+                    # 请求位置已在文件末尾
+                    log_offsets[file_name] = {"created": file_created, "offset": offset}
+                    return []
+                if log_res.status_code not in [200, 206]:
+                    logger.error(f"获取日志 {file_name} 失败，请检查服务器配置")
+                    return []
+                # 服务器不支持Range时返回全文，边读边跳过已读取部分
+                skip = offset if log_res.status_code == 200 else 0
+                for chunk in log_res.iter_content(chunk_size=64 * 1024):
+                    if skip:
+                        if len(chunk) <= skip:
+                            skip -= len(chunk)
+                            continue
+                        chunk = chunk[skip:]
+                        skip = 0
+                    content += chunk
+                    if len(content) >= max_bytes:
+                        break
+        except Exception as e:
+            logger.error(f"获取日志 {file_name} 失败：{str(e)}")
+            return []
+
+        content = bytes(content[:max_bytes])
+        # 末尾未写完的行留待下次读取
+        cut = content.rfind(b"\n") + 1
+        if not cut and len(content) >= max_bytes:
+            # 单行超过读取上限，直接跳过
+            cut = len(content)
+        log_offsets[file_name] = {"created": file_created, "offset": offset + cut}
+        return [line.decode("utf-8", errors="ignore") for line in content[:cut].split(b"\n") if line]
 
+    @staticmethod
+    def parse_del_media(mtime: str, mtype: str, name: str, path: str) -> dict:
+        """
+        根据日志中的删除记录组装媒体信息
+        """
+        year = None
+        year_pattern = r'\(\d+\)'
+        year_match = re.search(year_pattern, path)
+        if year_match:
+            year = year_match.group()[1:-1]
+
+        season = None
+        episode = None
+        if mtype == 'Episode' or mtype == 'Season':
+            name_pattern = r"\/([\u4e00-\u9fa5]+)(?= \()"
+            season_pattern = r"Season\s*(\d+)"
+            episode_pattern = r"S\d+E(\d+)"
+            name_match = re.search(name_pattern, path)
+            season_match = re.search(season_pattern, path)
+            episode_match = re.search(episode_pattern, path)
+
+            if name_match:
+                name = name_match.group(1)
+
+            if season_match:
+                season = season_match.group(1)
+                if int(season) < 10:
+                    season = f'S0{season}'
+                else:
+                    season = f'S{season}'
+            else:
                 season = None
+
+            if episode_match:
+                episode = episode_match.group(1)
+                episode = f'E{episode}'
+            else:
                 episode = None
-                if mtype == 'Episode' or mtype == 'Season':
-                    name_pattern = r"\/([\u4e00-\u9fa5]+)(?= \()"
-                    season_pattern = r"Season\s*(\d+)"
-                    episode_pattern = r"S\d+E(\d+)"
-                    name_match = re.search(name_pattern, path)
-                    season_match = re.search(season_pattern, path)
-                    episode_match = re.search(episode_pattern, path)
-
-                    if name_match:
-                        name = name_match.group(1)
-
-                    if season_match:
-                        season = season_match.group(1)
-                        if int(season) < 10:
-                            season = f'S0{season}'
-                        else:
-                            season = f'S{season}'
-                    else:
-                        season = None
 
-                    if episode_match:
-                        episode = episode_match.group(1)
-                        episode = f'E{episode}'
-                    else:
-                        episode = None
-
-                media = {
-                    "time": mtime,
-                    "type": mtype,
-                    "name": name,
-                    "year": year,
-                    "path": path,
-                    "season": season,
-                    "episode": episode,
-                }
-                logger.debug(f"解析到删除媒体：{json.dumps(media)}")
-                del_list.append(media)
+        media = {
+            "time": mtime,
+            "type": mtype,
+            "name": name,
+            "year": year,
+            "path": path,
+            "season": season,
+            "episode": episode,
+        }
+        logger.debug(f"解析到删除媒体：{json.dumps(media)}")
+        return media
 
-            return del_list
+    def parse_emby_log(self, last_time, log_offsets: dict = None):
+        """
+        获取emby日志列表、增量解析emby日志
+        """
+        if log_offsets is None:
+            log_offsets = {}
+        emby = Emby()
+        # 正则解析删除的媒体信息
+        pattern = re.compile(r'(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}.\d{3}) Info App: Removing item from database, '
+                             r'Type: (\w+), Name: (.*), Path: (.*), Id: (\d+)')
 
         log_files = []
         try:
             # 获取所有emby日志
             log_list_url = "[HOST]System/Logs/Query?Limit=3&api_key=[APIKEY]"
-            log_list_res = Emby().get_data(log_list_url)
+            log_list_res = emby.get_data(log_list_url)
 
             if log_list_res and log_list_res.status_code == 200:
                 log_files_dict = json.loads(log_list_res.text)
                 for item in log_files_dict.get("Items"):
                     if str(item.get('Name')).startswith("embyserver"):
-                        log_files.append(str(item.get('Name')))
+                        log_files.append(item)
         except Exception as e:
             print(str(e))
 
         if not log_files:
-            log_files.append("embyserver.txt")
+            log_files.append({"Name": "embyserver.txt"})
 
         del_medias = []
         log_files.reverse()
         for log_file in log_files:
-            del_medias = __parse_log(file_name=log_file,
-                                     del_list=del_medias)
-
-        return del_medias
-
-    @staticmethod
-    def parse_jellyfin_log(last_time: datetime):
-        """
-        获取jellyfin日志列表、解析jellyfin日志
-        """
-
-        def __parse_log(file_name: str, del_list: list):
-            """
-            解析jellyfin日志
-            """
-            log_url = f"[HOST]System/Logs/Log?name={file_name}&api_key=[APIKEY]"
-            log_res = Jellyfin().get_data(log_url)
-            if not log_res or log_res.status_code != 200:
-                logger.error("获取jellyfin日志失败，请检查服务器配置")
-                return del_list
-
-            # 正则解析删除的媒体信息
-            pattern = r'\[(.*?)\].*?Removing item, Type: "(.*?)", Name: "(.*?)", Path: "(.*?)"'
-            matches = re.findall(pattern, log_res.text)
-
-            # 循环获取媒体信息
-            for match in matches:
-                mtime = match[0]
+            log_url = self.format_server_url(f"[HOST]System/Logs/{log_file.get('Name')}?api_key=[APIKEY]",
+                                             host=settings.EMBY_HOST, apikey=settings.EMBY_API_KEY)
+            for line in self.tail_log(log_url=log_url,
+                                      log_file=log_file, log_offsets=log_offsets):
+                if "Removing item from database" not in line:
+                    continue
+                match = pattern.search(line)
+                if not match:
+                    continue
+                mtime = match.group(1)
                 # 排除已处理的媒体信息
                 if last_time and mtime < last_time:
                     continue
+                del_medias.append(self.parse_del_media(mtime=mtime,
+                                                       mtype=match.group(2),
+                                                       name=match.group(3),
+                                                       path=match.group(4)))
 
-                mtype = match[1]
-                name = match[2]
-                path = match[3]
-
-                year = None
-                year_pattern = r'\(\d+\)'
-                year_match = re.search(year_pattern, path)
-                if year_match:
-                    year = year_match.group()[1:-1]
-
-                season = None
-                episode = None
-                if mtype == 'Episode' or mtype == 'Season':
-                    name_pattern = r"\/([\u4e00-\u9fa5]+)(?= \()"
-                    season_pattern = r"Season\s*(\d+)"
-                    episode_pattern = r"S\d+E(\d+)"
-                    name_match = re.search(name_pattern, path)
-                    season_match = re.search(season_pattern, path)
-                    episode_match = re.search(episode_pattern, path)
-
-                    if name_match:
-                        name = name_match.group(1)
-
-                    if season_match:
-                        season = season_match.group(1)
-                        if int(season) < 10:
-                            season = f'S0{season}'
-                        else:
-                            season = f'S{season}'
-                    else:
-                        season = None
+        # 清理已不存在的日志文件读取记录
+        names = [log_file.get("Name") for log_file in log_files]
+        for name in list(log_offsets.keys()):
+            if name not in names:
+                log_offsets.pop(name)
 
-                    if episode_match:
-                        episode = episode_match.group(1)
-                        episode = f'E{episode}'
-                    else:
-                        episode = None
-
-                media = {
-                    "time": mtime,
-                    "type": mtype,
-                    "name": name,
-                    "year": year,
-                    "path": path,
-                    "season": season,
-                    "episode": episode,
-                }
-                logger.debug(f"解析到删除媒体：{json.dumps(media)}")
-                del_list.append(media)
+        return del_medias
 
-            return del_list
+    def parse_jellyfin_log(self, last_time: datetime, log_offsets: dict = None):
+        """
+        获取jellyfin日志列表、增量解析jellyfin日志
+        """
+        if log_offsets is None:
+            log_offsets = {}
+        jellyfin = Jellyfin()
+        # 正则解析删除的媒体信息
+        pattern = re.compile(r'\[(.*?)\].*?Removing item, Type: "(.*?)", Name: "(.*?)", Path: "(.*?)"')
 
         log_files = []
         try:
             # 获取所有jellyfin日志
             log_list_url = "[HOST]System/Logs?api_key=[APIKEY]"
-            log_list_res = Jellyfin().get_data(log_list_url)
+            log_list_res = jellyfin.get_data(log_list_url)
 
             if log_list_res and log_list_res.status_code == 200:
                 log_files_dict = json.loads(log_list_res.text)
                 for item in log_files_dict:
                     if str(item.get('Name')).startswith("log_"):
-                        log_files.append(str(item.get('Name')))
+                        log_files.append(item)
         except Exception as e:
             print(str(e))
 
         if not log_files:
-            log_files.append("log_%s.log" % datetime.date.today().strftime("%Y%m%d"))
+            log_files.append({"Name": "log_%s.log" % datetime.date.today().strftime("%Y%m%d")})
 
         del_medias = []
         log_files.reverse()
         for log_file in log_files:
-            del_medias = __parse_log(file_name=log_file,
-                                     del_list=del_medias)
+            log_url = self.format_server_url(f"[HOST]System/Logs/Log?name={log_file.get('Name')}&api_key=[APIKEY]",
+                                             host=settings.JELLYFIN_HOST, apikey=settings.JELLYFIN_API_KEY)
+            for line in self.tail_log(log_url=log_url,
+                                      log_file=log_file, log_offsets=log_offsets):
+                if "Removing item" not in line:
+                    continue
+                match = pattern.search(line)
+                if not match:
+                    continue
+                mtime = match.group(1)
+                # 排除已处理的媒体信息
+                if last_time and mtime < last_time:
+                    continue
+                del_medias.append(self.parse_del_media(mtime=mtime,
+                                                       mtype=match.group(2),
+                                                       name=match.group(3),
+                                                       path=match.group(4)))
+
+        # 清理已不存在的日志文件读取记录
+        names = [log_file.get("Name") for log_file in log_files]
+        for name in list(log_offsets.keys()):
+            if name not in names:
+                log_offsets.pop(name)
 
         return del_medias
 
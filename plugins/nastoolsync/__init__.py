@@ -1,14 +1,20 @@
 import json
 import os
 import sqlite3
-from datetime import datetime
+import time
+from typing import Any, List, Dict, Tuple, Callable, Optional
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
 
 from app.core.config import settings
+from app.db import db_update
 from app.db.downloadhistory_oper import DownloadHistoryOper
+from app.db.models.downloadhistory import DownloadHistory
+from app.db.models.transferhistory import TransferHistory
 from app.db.plugindata_oper import PluginDataOper
 from app.db.transferhistory_oper import TransferHistoryOper
 from app.plugins import _PluginBase
-from typing import Any, List, Dict, Tuple
 from app.log import logger
 
 
@@ -20,7 +26,7 @@ class NAStoolSync(_PluginBase):
     # 插件图标
     plugin_icon = "Nastools_A.png"
     # 插件版本
-    plugin_version = "1.0"
+    plugin_version = "1.1"
     # 插件作者
     plugin_author = "thsrite"
     # 作者主页
@@ -42,6 +48,11 @@ class NAStoolSync(_PluginBase):
     _site = None
     _downloader = None
     _transfer = False
+    # 每批读取及写入的记录数
+    _batch_size = 1000
+    # 预先解析的映射配置
+    _site_map: Dict[str, str] = {}
+    _path_map: List[Tuple[str, str]] = []
 
     def init_plugin(self, config: dict = None):
         self._transferhistory = TransferHistoryOper()
@@ -74,27 +85,28 @@ class NAStoolSync(_PluginBase):
                     logger.error(f"无法打开数据库文件 {self._nt_db_path}，请检查路径是否正确：{str(e)}")
                     return
 
+                # 预先解析站点、路径映射
+                self.__compile_mappings()
+                # 断点信息，数据库变化或清空记录时重新开始
+                checkpoint: dict = self.get_data("checkpoint") or {}
+                if self._clear or checkpoint.get("db") != self._nt_db_path:
+                    checkpoint = {"db": self._nt_db_path}
+
                 # 创建游标cursor来执行executeＳＱＬ语句
                 cursor = gradedb.cursor()
-
-                download_history = self.get_nt_download_history(cursor)
-                plugin_history = self.get_nt_plugin_history(cursor)
-                transfer_history = self.get_nt_transfer_history(cursor)
-
-                # 关闭游标
-                cursor.close()
-
-                # 导入下载记录
-                if download_history:
-                    self.sync_download_history(download_history)
-
-                # 导入插件记录
-                if plugin_history:
-                    self.sync_plugin_history(plugin_history)
-
-                # 导入历史记录
-                if transfer_history:
-                    self.sync_transfer_history(transfer_history)
+                try:
+                    # 导入下载记录
+                    self.sync_download_history(cursor, checkpoint)
+                    # 导入插件记录
+                    self.sync_plugin_history(cursor, checkpoint)
+                    # 导入历史记录
+                    self.sync_transfer_history(cursor, checkpoint)
+                except Exception as e:
+                    logger.error(f"同步NAStool记录出错，下次将从断点继续：{str(e)}")
+                finally:
+                    # 关闭游标
+                    cursor.close()
+                    gradedb.close()
 
                 self.update_config(
                     {
@@ -107,7 +119,75 @@ class NAStoolSync(_PluginBase):
                     }
                 )
 
-    def sync_plugin_history(self, plugin_history):
+    def __compile_mappings(self):
+        """
+        预先解析站点、路径映射，避免每条记录重复拆分配置
+        """
+        self._site_map = {}
+        if self._site:
+            for site in self._site.split("\n"):
+                sub_sites = site.split(":")
+                if len(sub_sites) < 2:
+                    continue
+                self._site_map[str(sub_sites[0])] = str(sub_sites[1])
+        self._path_map = []
+        if self._path:
+            for path in self._path.split("\n"):
+                sub_paths = path.split(":")
+                if len(sub_paths) < 2:
+                    continue
+                self._path_map.append((sub_paths[0], sub_paths[1]))
+
+    def __stream_import(self, cursor, checkpoint: dict, table: str, label: str, sql: str, count_sql: str,
+                        convert: Callable[[tuple], Optional[dict]], write: Callable[[List[dict]], Any]):
+        """
+        分批读取NAStool记录并批量写入，每批写入成功后记录断点
+        :param checkpoint: 断点信息 {"db": 数据库路径, 表: 已导入的最大ROWID}
+        :param table: 断点中的表标识
+        :param label: 日志中的记录名称
+        :param sql: 查询语句，第一列为ROWID，参数为上次断点
+        :param count_sql: 统计待导入记录数的语句
+        :param convert: 将一行记录（不含ROWID）转换为写入数据，返回None时跳过
+        :param write: 批量写入方法
+        """
+        last_rowid = checkpoint.get(table) or 0
+        cursor.execute(count_sql, (last_rowid,))
+        total = cursor.fetchone()[0]
+        if not total:
+            if last_rowid:
+                logger.info(f"NAStool{label}已全部同步，无需重复导入")
+            else:
+                logger.error(f"未获取到NAStool数据库文件中的{label}，请检查数据库路径是正确")
+            return
+        logger.info(f"开始同步NAStool{label}到MoviePilot，待同步 {total} 条"
+                    + (f"，从断点 {last_rowid} 继续" if last_rowid else ""))
+
+        # 开始计时
+        start_time = time.time()
+        cnt = 0
+        cursor.execute(sql, (last_rowid,))
+        while True:
+            rows = cursor.fetchmany(self._batch_size)
+            if not rows:
+                break
+            items = []
+            for row in rows:
+                item = convert(row[1:])
+                if item:
+                    items.append(item)
+            if items:
+                write(items)
+            # 本批写入成功后保存断点
+            checkpoint[table] = rows[-1][0]
+            self.save_data("checkpoint", checkpoint)
+            cnt += len(rows)
+            elapsed = time.time() - start_time
+            logger.info(f"{label}同步进度 {cnt} / {total}，"
+                        f"速度 {int(cnt / elapsed) if elapsed else cnt} 条/秒")
+
+        logger.info(f"{label}已同步完成。总耗时 {int(time.time() - start_time)} 秒")
+
+    def sync_plugin_history(self, cursor, checkpoint: dict):
         """
         导入插件记录
 
@@ -123,87 +203,96 @@ class NAStoolSync(_PluginBase):
             "value": "[{"downloader": "2", "torrents": ["bd64a8edc5afe6b4beb8813bdbf6faedfb1d4cc4"]}]"
         }
         """
-        # 开始计时
-        start_time = datetime.now()
-        logger.info("开始同步NAStool插件历史记录到MoviePilot")
         # 清空MoviePilot插件记录
         if self._clear:
             logger.info("MoviePilot插件记录已清空")
             self._plugindata.truncate()
 
-        cnt = 0
-        for history in plugin_history:
-            plugin_id = history[1]
-            plugin_key = history[2]
-            plugin_value = history[3]
-
-            # 替换转种记录
-            if str(plugin_id) == "TorrentTransfer":
-                keys = str(plugin_key).split("-")
-
-                # 1-2cd5d6fe32dca4e39a3e9f10961bfbdb00437e91
-                if len(keys) == 2 and keys[0].isdigit():
-                    mp_downloader = self.__get_target_downloader(int(keys[0]))
-                    # 替换key
-                    plugin_key = mp_downloader + "-" + keys[1]
-
-                    # 替换value
-                    """
-                    {
-                        "to_download":2,
-                        "to_download_id":"2cd5d6fe32dca4e39a3e9f10961bfbdb00437e91",
-                        "delete_source":true
-                    }
-                    """
-                    if isinstance(plugin_value, str):
-                        plugin_value: dict = json.loads(plugin_value)
-                    if isinstance(plugin_value, dict):
-                        if str(plugin_value.get("to_download")).isdigit():
-                            to_downloader = self.__get_target_downloader(int(plugin_value.get("to_download")))
-                            plugin_value["to_download"] = to_downloader
-
-            # 替换辅种记录
-            elif str(plugin_id) == "IYUUAutoSeed":
+        self.__stream_import(cursor=cursor,
+                             checkpoint=checkpoint,
+                             table="plugin",
+                             label="插件记录",
+                             sql=self.get_nt_plugin_history_sql(),
+                             count_sql="SELECT count(*) FROM PLUGIN_HISTORY WHERE ROWID > ?;",
+                             convert=self.__convert_plugin_history,
+                             write=self.__save_plugin_histories)
+
+    def __save_plugin_histories(self, histories: List[dict]):
+        """
+        保存插件记录，插件数据按键覆盖保存，只能逐条写入
+        """
+        for history in histories:
+            self._plugindata.save(**history)
+
+    def __convert_plugin_history(self, history: tuple) -> Optional[dict]:
+        """
+        转换NAStool插件记录，替换下载器id
+        """
+        plugin_id = history[1]
+        plugin_key = history[2]
+        plugin_value = history[3]
+
+        # 替换转种记录
+        if str(plugin_id) == "TorrentTransfer":
+            keys = str(plugin_key).split("-")
+
+            # 1-2cd5d6fe32dca4e39a3e9f10961bfbdb00437e91
+            if len(keys) == 2 and keys[0].isdigit():
+                mp_downloader = self.__get_target_downloader(int(keys[0]))
+                # 替换key
+                plugin_key = mp_downloader + "-" + keys[1]
+
+                # 替换value
                 """
-                [
-                    {
-                        "downloader":"2",
-                        "torrents":[
-                            "a18aa62abab42613edba15e7dbad0d729d8500da",
-                            "e494f372316bbfd8572da80138a6ef4c491d5991",
-                            "cc2bbc1e654d8fc0f83297f6cd36a38805aa2864",
-                            "68aec0db3aa7fe28a887e5e41a0d0d5bc284910f",
-                            "f02962474287e11441e34e40b8326ddf28d034f6"
-                        ]
-                    },
-                    {
-                        "downloader":"2",
-                        "torrents":[
-                            "4f042003ce90519e1aadd02b76f51c0c0711adb3"
-                        ]
-                    }
-                ]
+                {
+                    "to_download":2,
+                    "to_download_id":"2cd5d6fe32dca4e39a3e9f10961bfbdb00437e91",
+                    "delete_source":true
+                }
                 """
                 if isinstance(plugin_value, str):
-                    plugin_value: list = json.loads(plugin_value)
-                if not isinstance(plugin_value, list):
-                    plugin_value = [plugin_value]
-                for value in plugin_value:
-                    if str(value.get("downloader")).isdigit():
-                        downloader = self.__get_target_downloader(int(value.get("downloader")))
-                        value["downloader"] = downloader
-
-            self._plugindata.save(plugin_id=plugin_id,
-                                  key=plugin_key,
-                                  value=plugin_value)
-            cnt += 1
-            if cnt % 100 == 0:
-                logger.info(f"插件记录同步进度 {cnt} / {len(plugin_history)}")
-
-        # 计算耗时
-        end_time = datetime.now()
-
-        logger.info(f"插件记录已同步完成。总耗时 {(end_time - start_time).seconds} 秒")
+                    plugin_value: dict = json.loads(plugin_value)
+                if isinstance(plugin_value, dict):
+                    if str(plugin_value.get("to_download")).isdigit():
+                        to_downloader = self.__get_target_downloader(int(plugin_value.get("to_download")))
+                        plugin_value["to_download"] = to_downloader
+
+        # 替换辅种记录
+        elif str(plugin_id) == "IYUUAutoSeed":
+            """
+            [
+                {
+                    "downloader":"2",
+                    "torrents":[
+                        "a18aa62abab42613edba15e7dbad0d729d8500da",
+                        "e494f372316bbfd8572da80138a6ef4c491d5991",
+                        "cc2bbc1e654d8fc0f83297f6cd36a38805aa2864",
+                        "68aec0db3aa7fe28a887e5e41a0d0d5bc284910f",
+                        "f02962474287e11441e34e40b8326ddf28d034f6"
+                    ]
+                },
+                {
+                    "downloader":"2",
+                    "torrents":[
+                        "4f042003ce90519e1aadd02b76f51c0c0711adb3"
+                    ]
+                }
+            ]
+            """
+            if isinstance(plugin_value, str):
+                plugin_value: list = json.loads(plugin_value)
+            if not isinstance(plugin_value, list):
+                plugin_value = [plugin_value]
+            for value in plugin_value:
+                if str(value.get("downloader")).isdigit():
+                    downloader = self.__get_target_downloader(int(value.get("downloader")))
+                    value["downloader"] = downloader
+
+        return {
+            "plugin_id": plugin_id,
+            "key": plugin_key,
+            "value": plugin_value
+        }
 
     def __get_target_downloader(self, download_id: int):
         """
@@ -223,161 +312,136 @@ class NAStoolSync(_PluginBase):
                     return str(sub_downloaders[1])
         return download_id
 
-    def sync_download_history(self, download_history):
+    def sync_download_history(self, cursor, checkpoint: dict):
         """
         导入下载记录
         """
-        # 开始计时
-        start_time = datetime.now()
-        logger.info("开始同步NAStool下载历史记录到MoviePilot")
         # 清空MoviePilot下载记录
         if self._clear:
             logger.info("MoviePilot下载记录已清空")
             self._downloadhistory.truncate()
 
-        cnt = 0
-        for history in download_history:
-            mpath = history[0]
-            mtype = history[1]
-            mtitle = history[2]
-            myear = history[3]
-            mtmdbid = history[4]
-            mseasons = history[5]
-            mepisodes = history[6]
-            mimages = history[7]
-            mdownload_hash = history[8]
-            mtorrent = history[9]
-            mdesc = history[10]
-            msite = history[11]
-            mdate = history[12]
-
-            # 处理站点映射
-            if self._site:
-                sites = self._site.split("\n")
-                for site in sites:
-                    sub_sites = site.split(":")
-                    if str(msite) == str(sub_sites[0]):
-                        msite = str(sub_sites[1])
-
-            self._downloadhistory.add(
-                path=os.path.basename(mpath),
-                type=mtype,
-                title=mtitle,
-                year=myear,
-                tmdbid=mtmdbid,
-                seasons=mseasons,
-                episodes=mepisodes,
-                image=mimages,
-                download_hash=mdownload_hash,
-                torrent_name=mtorrent,
-                torrent_description=mdesc,
-                torrent_site=msite,
-                userid=settings.SUPERUSER,
-                date=mdate
-            )
-            cnt += 1
-            if cnt % 100 == 0:
-                logger.info(f"下载记录同步进度 {cnt} / {len(download_history)}")
-
-        # 计算耗时
-        end_time = datetime.now()
-
-        logger.info(f"下载记录已同步完成。总耗时 {(end_time - start_time).seconds} 秒")
-
-    def sync_transfer_history(self, transfer_history):
+        self.__stream_import(cursor=cursor,
+                             checkpoint=checkpoint,
+                             table="download",
+                             label="下载记录",
+                             sql=self.get_nt_download_history_sql(),
+                             count_sql="SELECT count(*) FROM DOWNLOAD_HISTORY "
+                                       "WHERE SAVE_PATH IS NOT NULL AND ROWID > ?;",
+                             convert=self.__convert_download_history,
+                             write=lambda histories: self.__insert_download_histories(histories, db=None))
+
+    def __convert_download_history(self, history: tuple) -> Optional[dict]:
         """
-        导入nt转移记录
+        转换NAStool下载记录
         """
-        # 开始计时
-        start_time = datetime.now()
-        logger.info("开始同步NAStool转移历史记录到MoviePilot")
+        mpath = history[0]
+        msite = history[11]
+        # 处理站点映射
+        if self._site_map:
+            msite = self._site_map.get(str(msite), msite)
+
+        return {
+            "path": os.path.basename(mpath),
+            "type": history[1],
+            "title": history[2],
+            "year": history[3],
+            "tmdbid": history[4],
+            "seasons": history[5],
+            "episodes": history[6],
+            "image": history[7],
+            "download_hash": history[8],
+            "torrent_name": history[9],
+            "torrent_description": history[10],
+            "torrent_site": msite,
+            "userid": settings.SUPERUSER,
+            "date": history[12]
+        }
 
+    def sync_transfer_history(self, cursor, checkpoint: dict):
+        """
+        导入nt转移记录
+        """
         # 清空MoviePilot转移记录
         if self._clear:
             logger.info("MoviePilot转移记录已清空")
             self._transferhistory.truncate()
 
-        # 处理数据，存入mp数据库
-        cnt = 0
-        for history in transfer_history:
-            msrc_path = history[0]
-            msrc_filename = history[1]
-            mdest_path = history[2]
-            mdest_filename = history[3]
-            mmode = history[4]
-            mtype = history[5]
-            mcategory = history[6]
-            mtitle = history[7]
-            myear = history[8]
-            mtmdbid = history[9]
-            mseasons = history[10]
-            mepisodes = history[11]
-            mimage = history[12]
-            mdate = history[13]
-
-            if not msrc_path or not mdest_path:
-                continue
-
-            msrc = msrc_path + "/" + msrc_filename
-            mdest = mdest_path + "/" + mdest_filename
-
-            # 处理路径映射
-            if self._path:
-                paths = self._path.split("\n")
-                for path in paths:
-                    sub_paths = path.split(":")
-                    msrc = msrc.replace(sub_paths[0], sub_paths[1]).replace('\\', '/')
-                    mdest = mdest.replace(sub_paths[0], sub_paths[1]).replace('\\', '/')
-
-            # 存库
-            self._transferhistory.add(
-                src=msrc,
-                dest=mdest,
-                mode=mmode,
-                type=mtype,
-                category=mcategory,
-                title=mtitle,
-                year=myear,
-                tmdbid=mtmdbid,
-                seasons=mseasons,
-                episodes=mepisodes,
-                image=mimage,
-                date=mdate
-            )
-            logger.debug(f"{mtitle} {myear} {mtmdbid} {mseasons} {mepisodes} 已同步")
-
-            cnt += 1
-            if cnt % 100 == 0:
-                logger.info(f"转移记录同步进度 {cnt} / {len(transfer_history)}")
-
-        # 计算耗时
-        end_time = datetime.now()
-
-        logger.info(f"转移记录已同步完成。总耗时 {(end_time - start_time).seconds} 秒")
+        self.__stream_import(cursor=cursor,
+                             checkpoint=checkpoint,
+                             table="transfer",
+                             label="转移记录",
+                             sql=self.get_nt_transfer_history_sql(),
+                             count_sql="SELECT count(*) FROM TRANSFER_HISTORY WHERE ROWID > ?;",
+                             convert=self.__convert_transfer_history,
+                             write=lambda histories: self.__insert_transfer_histories(histories, db=None))
+
+    def __convert_transfer_history(self, history: tuple) -> Optional[dict]:
+        """
+        转换NAStool转移记录
+        """
+        msrc_path = history[0]
+        msrc_filename = history[1]
+        mdest_path = history[2]
+        mdest_filename = history[3]
+
+        if not msrc_path or not mdest_path:
+            return None
+
+        msrc = msrc_path + "/" + msrc_filename
+        mdest = mdest_path + "/" + mdest_filename
+
+        # 处理路径映射
+        for src, dst in self._path_map:
+            msrc = msrc.replace(src, dst).replace('\\', '/')
+            mdest = mdest.replace(src, dst).replace('\\', '/')
+
+        return {
+            "src": msrc,
+            "dest": mdest,
+            "mode": history[4],
+            "type": history[5],
+            "category": history[6],
+            "title": history[7],
+            "year": history[8],
+            "tmdbid": history[9],
+            "seasons": history[10],
+            "episodes": history[11],
+            "image": history[12],
+            "date": history[13]
+        }
 
     @staticmethod
-    def get_nt_plugin_history(cursor):
+    @db_update
+    def __insert_download_histories(histories: List[dict], db: Session = None):
         """
-        获取插件历史记录
+        批量写入下载记录，一批一个事务
         """
-        sql = 'select * from PLUGIN_HISTORY;'
-        cursor.execute(sql)
-        plugin_history = cursor.fetchall()
+        db.execute(insert(DownloadHistory), histories)
 
-        if not plugin_history:
-            logger.error("未获取到NAStool数据库文件中的插件历史，请检查数据库路径是正确")
-            return
+    @staticmethod
+    @db_update
+    def __insert_transfer_histories(histories: List[dict], db: Session = None):
+        """
+        批量写入转移记录，一批一个事务
+        """
+        db.execute(insert(TransferHistory), histories)
 
-        logger.info(f"获取到NAStool插件记录 {len(plugin_history)} 条")
-        return plugin_history
+    @staticmethod
+    def get_nt_plugin_history_sql() -> str:
+        """
+        获取插件历史记录的查询语句
+        """
+        return 'SELECT ROWID, * FROM PLUGIN_HISTORY WHERE ROWID > ? ORDER BY ROWID;'
 
     @staticmethod
-    def get_nt_download_history(cursor):
+    def get_nt_download_history_sql() -> str:
         """
-        获取下载历史记录
+        获取下载历史记录的查询语句
         """
-        sql = '''
+        return '''
         SELECT
+            ROWID,
             SAVE_PATH,
             TYPE,
             TITLE,
@@ -402,25 +466,20 @@ class NAStoolSync(_PluginBase):
         FROM
             DOWNLOAD_HISTORY 
         WHERE
-            SAVE_PATH IS NOT NULL;
+            SAVE_PATH IS NOT NULL
+            AND ROWID > ?
+        ORDER BY
+            ROWID;
             '''
-        cursor.execute(sql)
-        download_history = cursor.fetchall()
-
-        if not download_history:
-            logger.error("未获取到NAStool数据库文件中的下载历史，请检查数据库路径是正确")
-            return
-
-        logger.info(f"获取到NAStool下载记录 {len(download_history)} 条")
-        return download_history
 
     @staticmethod
-    def get_nt_transfer_history(cursor):
+    def get_nt_transfer_history_sql() -> str:
         """
-        获取nt转移记录
+        获取nt转移记录的查询语句
         """
-        sql = '''
+        return '''
         SELECT
+            t.ROWID,
             t.SOURCE_PATH AS src_path,
             t.SOURCE_FILENAME AS src_filename,
             t.DEST_PATH AS dest_path,
@@ -458,17 +517,12 @@ class NAStoolSync(_PluginBase):
         FROM
             TRANSFER_HISTORY t
             LEFT JOIN ( SELECT * FROM DOWNLOAD_HISTORY GROUP BY TMDBID ) d ON t.TMDBID = d.TMDBID
-            AND t.TYPE = d.TYPE;
+            AND t.TYPE = d.TYPE
+        WHERE
+            t.ROWID > ?
+        ORDER BY
+            t.ROWID;
             '''
-        cursor.execute(sql)
-        nt_historys = cursor.fetchall()
-
-        if not nt_historys:
-            logger.error("未获取到NAStool数据库文件中的转移历史，请检查数据库路径是正确")
-            return
-
-        logger.info(f"获取到NAStool转移记录 {len(nt_historys)} 条")
-        return nt_historys
 
     def get_state(self) -> bool:
         return False
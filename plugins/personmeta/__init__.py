@@ -5,6 +5,7 @@ import json
 import re
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from typing import Any, List, Dict, Tuple, Optional
 
@@ -40,7 +41,7 @@ class PersonMeta(_PluginBase):
     # 插件图标
     plugin_icon = "actor.png"
     # 插件版本
-    plugin_version = "1.4"
+    plugin_version = "1.6"
     # 插件作者
     plugin_author = "jxxghp"
     # 作者主页
@@ -65,6 +66,29 @@ class PersonMeta(_PluginBase):
     _delay = 0
     _type = "all"
     _remove_nozh = False
+    # 定时扫描方式 full 全量/incremental 增量
+    _scan_mode = "full"
+    # 增量扫描已处理条目记录上限
+    _max_digests = 50000
+    # 并发处理条目数
+    _max_workers = 4
+    # 豆瓣请求最小间隔（秒）
+    _douban_interval = 3
+    # 人物缓存有效期（天）
+    _cache_days = 30
+    # 媒体服务器人物缓存 服务器:人物ID -> {name, tmdbid, time}
+    _person_cache: Dict[str, dict] = {}
+    # TMDB人物缓存 TMDB人物ID -> {name, biography, profile_path}
+    _tmdb_person_cache: Dict[str, dict] = {}
+    # 豆瓣演员缓存 TMDBID:季 -> {actors, time}，扫描开始时清空，实时刮削按有效期及数量淘汰
+    _douban_actors_cache: Dict[str, dict] = {}
+    # 豆瓣演员缓存有效期（秒）
+    _douban_actors_ttl = 3600
+    # 豆瓣演员缓存最大条目数
+    _douban_actors_max = 200
+    _cache_lock = threading.Lock()
+    _douban_lock = threading.Lock()
+    _douban_last_time = 0
 
     def init_plugin(self, config: dict = None):
         self.tmdbchain = TmdbChain()
@@ -76,14 +100,18 @@ class PersonMeta(_PluginBase):
             self._type = config.get("type") or "all"
             self._delay = config.get("delay") or 0
             self._remove_nozh = config.get("remove_nozh") or False
+            self._scan_mode = config.get("scan_mode") or "full"
 
         # 停止现有任务
         self.stop_service()
 
+        # 加载人物缓存
+        self.__load_cache()
+
         # 启动服务
         if self._onlyonce:
             self._scheduler = BackgroundScheduler(timezone=settings.TZ)
-            self._scheduler.add_job(func=self.scrap_library, trigger='date',
+            self._scheduler.add_job(func=self.__scrap, trigger='date',
                                     run_date=datetime.datetime.now(
                                         tz=pytz.timezone(settings.TZ)) + datetime.timedelta(seconds=3)
                                     )
@@ -107,7 +135,8 @@ class PersonMeta(_PluginBase):
             "cron": self._cron,
             "type": self._type,
             "delay": self._delay,
-            "remove_nozh": self._remove_nozh
+            "remove_nozh": self._remove_nozh,
+            "scan_mode": self._scan_mode
         })
 
     def get_state(self) -> bool:
@@ -136,7 +165,7 @@ class PersonMeta(_PluginBase):
                 "id": "PersonMeta",
                 "name": "演职人员刮削服务",
                 "trigger": CronTrigger.from_crontab(self._cron),
-                "func": self.scrap_library,
+                "func": self.__scrap,
                 "kwargs": {}
             }]
 
@@ -263,6 +292,26 @@ class PersonMeta(_PluginBase):
                                         }
                                     }
                                 ]
+                            },
+                            {
+                                'component': 'VCol',
+                                'props': {
+                                    'cols': 12,
+                                    'md': 6
+                                },
+                                'content': [
+                                    {
+                                        'component': 'VSelect',
+                                        'props': {
+                                            'model': 'scan_mode',
+                                            'label': '扫描方式',
+                                            'items': [
+                                                {'title': '全量扫描', 'value': 'full'},
+                                                {'title': '增量扫描（仅新入库）', 'value': 'incremental'},
+                                            ]
+                                        }
+                                    }
+                                ]
                             }
                         ]
                     }
@@ -274,7 +323,8 @@ class PersonMeta(_PluginBase):
             "cron": "",
             "type": "all",
             "delay": 30,
-            "remove_nozh": False
+            "remove_nozh": False,
+            "scan_mode": "full"
         }
 
     def get_page(self) -> List[dict]:
@@ -308,6 +358,8 @@ class PersonMeta(_PluginBase):
         # 刮削演职人员信息
         self.__update_item(server=existsinfo.server, item=iteminfo,
                            mediainfo=mediainfo, season=meta.begin_season)
+        # 保存人物缓存
+        self.__save_cache()
 
     def scrap_library(self):
         """
@@ -316,11 +368,14 @@ class PersonMeta(_PluginBase):
         # 所有媒体服务器
         if not settings.MEDIASERVER:
             return
+        # 豆瓣演员仅在本次扫描中复用
+        self._douban_actors_cache = {}
         for server in settings.MEDIASERVER.split(","):
             # 扫描所有媒体库
             logger.info(f"开始刮削服务器 {server} 的演员信息 ...")
             for library in self.mschain.librarys(server):
                 logger.info(f"开始刮削媒体库 {library.name} 的演员信息 ...")
+                items = []
                 for item in self.mschain.items(server, library.id):
                     if not item:
                         continue
@@ -329,18 +384,268 @@ class PersonMeta(_PluginBase):
                     if "Series" not in item.item_type \
                             and "Movie" not in item.item_type:
                         continue
-                    if self._event.is_set():
-                        logger.info(f"演职人员刮削服务停止")
-                        return
-                    # 处理条目
-                    logger.info(f"开始刮削 {item.title} 的演员信息 ...")
-                    self.__update_item(server=server, item=item)
-                    logger.info(f"{item.title} 的演员信息刮削完成")
+                    items.append(item)
+                # 并发处理条目
+                with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+                    futures = [executor.submit(self.__scrap_item, server, item) for item in items]
+                    for future in as_completed(futures):
+                        try:
+                            future.result()
+                        except Exception as err:
+                            logger.error(f"刮削演员信息失败：{str(err)}")
+                # 保存人物缓存
+                self.__save_cache()
+                if self._event.is_set():
+                    logger.info(f"演职人员刮削服务停止")
+                    return
                 logger.info(f"媒体库 {library.name} 的演员信息刮削完成")
             logger.info(f"服务器 {server} 的演员信息刮削完成")
 
-    def __update_peoples(self, server: str, itemid: str, iteminfo: dict, douban_actors):
-        # 处理媒体项中的人物信息
+    def __scrap_item(self, server: str, item: MediaServerItem) -> bool:
+        """
+        处理单个条目
+        :return: 是否处理成功
+        """
+        if self._event.is_set():
+            return False
+        logger.info(f"开始刮削 {item.title} 的演员信息 ...")
+        success = self.__update_item(server=server, item=item)
+        if success:
+            logger.info(f"{item.title} 的演员信息刮削完成")
+        else:
+            logger.warn(f"{item.title} 的演员信息刮削未完成")
+        return success
+
+    def __scrap(self):
+        """
+        按配置的扫描方式刮削
+        """
+        if self._scan_mode == "incremental":
+            self.scrap_incremental()
+        else:
+            self.scrap_library()
+
+    def scrap_incremental(self):
+        """
+        增量扫描：按入库时间倒序读取各媒体库条目，只处理上次扫描之后入库的电影、剧集和集
+        """
+        if not settings.MEDIASERVER:
+            return
+        # 各媒体库已处理到的入库时间
+        watermarks: Dict[str, str] = self.get_data("watermarks") or {}
+        # 已处理条目 条目ID -> 入库时间
+        digests: Dict[str, str] = self.get_data("item_digests") or {}
+        # 豆瓣演员仅在本次扫描中复用
+        self._douban_actors_cache = {}
+        for server in settings.MEDIASERVER.split(","):
+            logger.info(f"开始增量刮削服务器 {server} 的演员信息 ...")
+            for library in self.mschain.librarys(server):
+                watermark_key = f"{server}:{library.id}"
+                watermark = watermarks.get(watermark_key)
+                new_items = self.__get_new_items(server=server, library=library, watermark=watermark)
+                # 过滤已处理的条目
+                new_items = [item for item in new_items
+                             if digests.get(f"{server}:{item.get('Id')}") != item.get("DateCreated")]
+                if not new_items:
+                    logger.info(f"媒体库 {library.name} 没有新入库的条目")
+                    continue
+                logger.info(f"媒体库 {library.name} 新入库条目数：{len(new_items)}")
+                # 新入库剧集会处理其下所有集，不再单独处理
+                series_ids = {item.get("Id") for item in new_items if item.get("Type") == "Series"}
+                series_infos: Dict[str, Optional[MediaInfo]] = {}
+                failed = False
+                with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+                    futures = {}
+                    for item in new_items:
+                        if item.get("Type") == "Episode":
+                            if item.get("SeriesId") in series_ids:
+                                continue
+                            future = executor.submit(self.__update_episode, server, item, series_infos)
+                        else:
+                            future = executor.submit(self.__scrap_item, server,
+                                                     self.__to_mediaserver_item(server, library, item))
+                        futures[future] = item
+                    for future in as_completed(futures):
+                        item = futures[future]
+                        try:
+                            success = future.result()
+                        except Exception as err:
+                            success = False
+                            logger.error(f"刮削 {item.get('Name')} 演员信息失败：{str(err)}")
+                        if success:
+                            digests[f"{server}:{item.get('Id')}"] = item.get("DateCreated")
+                        else:
+                            failed = True
+                if self._event.is_set():
+                    logger.info(f"演职人员刮削服务停止")
+                    break
+                # 全部处理成功才推进水位，失败的条目下次重试
+                if not failed:
+                    watermarks[watermark_key] = max(str(item.get("DateCreated")) for item in new_items)
+                    self.save_data("watermarks", watermarks)
+                # 只保留最近的已处理记录
+                if len(digests) > self._max_digests:
+                    digests = dict(list(digests.items())[-self._max_digests:])
+                self.save_data("item_digests", digests)
+                self.__save_cache()
+                logger.info(f"媒体库 {library.name} 的演员信息增量刮削完成")
+            if self._event.is_set():
+                return
+            logger.info(f"服务器 {server} 的演员信息增量刮削完成")
+
+    def __get_new_items(self, server: str, library: Any, watermark: str = None) -> List[dict]:
+        """
+        按入库时间倒序分页读取媒体库条目，读到水位（含）之前的条目即停止
+        :return: 条目列表 Id/Type/Name/DateCreated/SeriesId/ParentIndexNumber/ProviderIds
+        """
+        items = []
+        if server == "plex":
+            try:
+                section = Plex().get_plex().library.sectionByID(int(library.id))
+                # 已有剧集新入库的集
+                if section.TYPE == "show":
+                    for episode in section.search(libtype="episode", sort="addedAt:desc"):
+                        added_at = episode.addedAt.strftime("%Y-%m-%dT%H:%M:%S") if episode.addedAt else ""
+                        if watermark and added_at < watermark:
+                            break
+                        items.append({
+                            "Id": episode.key,
+                            "Type": "Episode",
+                            "Name": f"{episode.grandparentTitle} {episode.seasonEpisode}",
+                            "DateCreated": added_at,
+                            "SeriesId": episode.grandparentKey,
+                            "ParentIndexNumber": episode.parentIndex
+                        })
+                for plexitem in section.search(sort="addedAt:desc"):
+                    added_at = plexitem.addedAt.strftime("%Y-%m-%dT%H:%M:%S") if plexitem.addedAt else ""
+                    if watermark and added_at < watermark:
+                        break
+                    provider_ids = {}
+                    for guid in plexitem.guids:
+                        idlist = str(guid.id).split(sep='://')
+                        if len(idlist) >= 2:
+                            provider_ids[idlist[0]] = idlist[1]
+                    items.append({
+                        "Id": plexitem.key,
+                        "Type": "Series" if plexitem.TYPE == "show" else "Movie",
+                        "Name": plexitem.title,
+                        "DateCreated": added_at,
+                        "ProductionYear": plexitem.year,
+                        "ProviderIds": provider_ids
+                    })
+            except Exception as err:
+                logger.error(f"获取Plex媒体库 {library.name} 新入库条目失败：{str(err)}")
+            return items
+
+        if server == "emby":
+            base_url = '[HOST]emby/Users/[USER]/Items'
+            mediaserver = Emby()
+        else:
+            base_url = '[HOST]Users/[USER]/Items'
+            mediaserver = Jellyfin()
+        start_index = 0
+        limit = 100
+        while True:
+            url = f'{base_url}?ParentId={library.id}&Recursive=true' \
+                  f'&IncludeItemTypes=Movie,Series,Episode&SortBy=DateCreated&SortOrder=Descending' \
+                  f'&Fields=DateCreated,ProviderIds,ProductionYear' \
+                  f'&StartIndex={start_index}&Limit={limit}&api_key=[APIKEY]'
+            try:
+                res = mediaserver.get_data(url=url)
+                page = res.json().get("Items") if res else []
+            except Exception as err:
+                logger.error(f"获取媒体库 {library.name} 新入库条目失败：{str(err)}")
+                break
+            if not page:
+                break
+            for item in page:
+                # 与水位相同的条目可能未处理完，由已处理记录去重
+                if watermark and str(item.get("DateCreated")) < watermark:
+                    return items
+                items.append(item)
+            if len(page) < limit:
+                break
+            start_index += limit
+        return items
+
+    @staticmethod
+    def __to_mediaserver_item(server: str, library: Any, item: dict) -> MediaServerItem:
+        """
+        媒体库条目转换为MediaServerItem
+        """
+        provider_ids = item.get("ProviderIds") or {}
+        return MediaServerItem(
+            server=server,
+            library=library.id,
+            item_id=item.get("Id"),
+            item_type=item.get("Type"),
+            title=item.get("Name"),
+            year=item.get("ProductionYear"),
+            tmdbid=provider_ids.get("Tmdb") or provider_ids.get("tmdb"),
+            imdbid=provider_ids.get("Imdb") or provider_ids.get("imdb")
+        )
+
+    def __update_episode(self, server: str, episode: dict, series_infos: Dict[str, Optional[MediaInfo]]) -> bool:
+        """
+        更新已有剧集中新入库的集
+        :return: 是否处理成功
+        """
+        if self._event.is_set():
+            return False
+        episodeinfo = self.get_iteminfo(server=server, itemid=episode.get("Id"))
+        if not episodeinfo:
+            logger.warn(f"未找到集媒体项：{episode.get('Id')}")
+            return False
+        if not self.__need_trans_actor(episodeinfo):
+            logger.info(f"集 {episode.get('Id')} 的人物信息已是中文，无需更新")
+            return True
+        # 识别所属剧集
+        series_id = episode.get("SeriesId")
+        with self._cache_lock:
+            known = series_id in series_infos
+            mediainfo = series_infos.get(series_id)
+        if not known:
+            seriesinfo = self.get_iteminfo(server=server, itemid=series_id) or {}
+            provider_ids = seriesinfo.get("ProviderIds") or {}
+            tmdbid = provider_ids.get("Tmdb") or provider_ids.get("tmdb")
+            mediainfo = self.chain.recognize_media(mtype=MediaType.TV, tmdbid=int(tmdbid)) if tmdbid else None
+            with self._cache_lock:
+                series_infos[series_id] = mediainfo
+        douban_actors = self.__get_douban_actors(mediainfo=mediainfo,
+                                                 season=episode.get("ParentIndexNumber")) if mediainfo else []
+        if not self.__update_peoples(server=server, itemid=episode.get("Id"), iteminfo=episodeinfo,
+                                     douban_actors=douban_actors):
+            return False
+        logger.info(f"集 {episode.get('Id')} 的人物信息更新完成")
+        return True
+
+    def __load_cache(self):
+        """
+        加载持久化的人物缓存，清理过期数据
+        """
+        expire_time = time.time() - self._cache_days * 24 * 3600
+        with self._cache_lock:
+            self._person_cache = {
+                key: value for key, value in (self.get_data("person_cache") or {}).items()
+                if (value.get("time") or 0) > expire_time
+            }
+            self._tmdb_person_cache = {
+                key: value for key, value in (self.get_data("tmdb_person_cache") or {}).items()
+                if (value.get("time") or 0) > expire_time
+            }
+
+    def __save_cache(self):
+        """
+        持久化人物缓存
+        """
+        with self._cache_lock:
+            person_cache = dict(self._person_cache)
+            tmdb_person_cache = dict(self._tmdb_person_cache)
+        self.save_data("person_cache", person_cache)
+        self.save_data("tmdb_person_cache", tmdb_person_cache)
+
+    def __update_peoples(self, server: str, itemid: str, iteminfo: dict, douban_actors) -> bool:
+        # 处理媒体项中的人物信息，返回是否处理成功
         """
         "People": [
             {
@@ -357,7 +662,7 @@ class PersonMeta(_PluginBase):
         for people in iteminfo["People"] or []:
             if self._event.is_set():
                 logger.info(f"演职人员刮削服务停止")
-                return
+                return False
             if not people.get("Name"):
                 continue
             if StringUtils.is_chinese(people.get("Name")) \
@@ -373,56 +678,60 @@ class PersonMeta(_PluginBase):
         # 保存媒体项信息
         if peoples:
             iteminfo["People"] = peoples
-            self.set_iteminfo(server=server, itemid=itemid, iteminfo=iteminfo)
+            return bool(self.set_iteminfo(server=server, itemid=itemid, iteminfo=iteminfo))
+        return True
+
+    def __need_trans_actor(self, _item: dict) -> bool:
+        """
+        是否需要处理人物信息
+        """
+        if self._type == "name":
+            # 是否需要处理人物名称
+            _peoples = [x for x in _item.get("People", []) if
+                        (x.get("Name") and not StringUtils.is_chinese(x.get("Name")))]
+        elif self._type == "role":
+            # 是否需要处理人物角色
+            _peoples = [x for x in _item.get("People", []) if
+                        (x.get("Role") and not StringUtils.is_chinese(x.get("Role")))]
+        else:
+            _peoples = [x for x in _item.get("People", []) if
+                        (x.get("Name") and not StringUtils.is_chinese(x.get("Name")))
+                        or (x.get("Role") and not StringUtils.is_chinese(x.get("Role")))]
+        if _peoples:
+            return True
+        return False
 
     def __update_item(self, server: str, item: MediaServerItem,
-                      mediainfo: MediaInfo = None, season: int = None):
+                      mediainfo: MediaInfo = None, season: int = None) -> bool:
         """
         更新媒体服务器中的条目
+        :return: 是否处理成功，无法识别的条目（没有tmdbid）视为已处理
         """
 
-        def __need_trans_actor(_item):
-            """
-            是否需要处理人物信息
-            """
-            if self._type == "name":
-                # 是否需要处理人物名称
-                _peoples = [x for x in _item.get("People", []) if
-                            (x.get("Name") and not StringUtils.is_chinese(x.get("Name")))]
-            elif self._type == "role":
-                # 是否需要处理人物角色
-                _peoples = [x for x in _item.get("People", []) if
-                            (x.get("Role") and not StringUtils.is_chinese(x.get("Role")))]
-            else:
-                _peoples = [x for x in _item.get("People", []) if
-                            (x.get("Name") and not StringUtils.is_chinese(x.get("Name")))
-                            or (x.get("Role") and not StringUtils.is_chinese(x.get("Role")))]
-            if _peoples:
-                return True
-            return False
-
         # 识别媒体信息
         if not mediainfo:
             if not item.tmdbid:
                 logger.warn(f"{item.title} 未找到tmdbid，无法识别媒体信息")
-                return
+                return True
             mtype = MediaType.TV if item.item_type in ['Series', 'show'] else MediaType.MOVIE
             mediainfo = self.chain.recognize_media(mtype=mtype, tmdbid=item.tmdbid)
             if not mediainfo:
                 logger.warn(f"{item.title} 未识别到媒体信息")
-                return
+                return False
 
         # 获取媒体项
         iteminfo = self.get_iteminfo(server=server, itemid=item.item_id)
         if not iteminfo:
             logger.warn(f"{item.title} 未找到媒体项")
-            return
+            return False
 
-        if __need_trans_actor(iteminfo):
+        success = True
+        if self.__need_trans_actor(iteminfo):
             # 获取豆瓣演员信息
             logger.info(f"开始获取 {item.title} 的豆瓣演员信息 ...")
             douban_actors = self.__get_douban_actors(mediainfo=mediainfo, season=season)
-            self.__update_peoples(server=server, itemid=item.item_id, iteminfo=iteminfo, douban_actors=douban_actors)
+            success = self.__update_peoples(server=server, itemid=item.item_id, iteminfo=iteminfo,
+                                            douban_actors=douban_actors)
         else:
             logger.info(f"{item.title} 的人物信息已是中文，无需更新")
 
@@ -432,7 +741,7 @@ class PersonMeta(_PluginBase):
             seasons = self.get_items(server=server, parentid=item.item_id, mtype="Season")
             if not seasons:
                 logger.warn(f"{item.title} 未找到季媒体项")
-                return
+                return False
             for season in seasons["Items"]:
                 # 获取豆瓣演员信息
                 season_actors = self.__get_douban_actors(mediainfo=mediainfo, season=season.get("IndexNumber"))
@@ -441,12 +750,14 @@ class PersonMeta(_PluginBase):
                     seasoninfo = self.get_iteminfo(server=server, itemid=season.get("Id"))
                     if not seasoninfo:
                         logger.warn(f"{item.title} 未找到季媒体项：{season.get('Id')}")
+                        success = False
                         continue
 
-                    if __need_trans_actor(seasoninfo):
+                    if self.__need_trans_actor(seasoninfo):
                         # 更新季媒体项人物
-                        self.__update_peoples(server=server, itemid=season.get("Id"), iteminfo=seasoninfo,
-                                              douban_actors=season_actors)
+                        if not self.__update_peoples(server=server, itemid=season.get("Id"), iteminfo=seasoninfo,
+                                                     douban_actors=season_actors):
+                            success = False
                         logger.info(f"季 {seasoninfo.get('Id')} 的人物信息更新完成")
                     else:
                         logger.info(f"季 {seasoninfo.get('Id')} 的人物信息已是中文，无需更新")
@@ -454,6 +765,7 @@ class PersonMeta(_PluginBase):
                 episodes = self.get_items(server=server, parentid=season.get("Id"), mtype="Episode")
                 if not episodes:
                     logger.warn(f"{item.title} 未找到集媒体项")
+                    success = False
                     continue
                 # 更新集媒体项人物
                 for episode in episodes["Items"]:
@@ -461,14 +773,17 @@ class PersonMeta(_PluginBase):
                     episodeinfo = self.get_iteminfo(server=server, itemid=episode.get("Id"))
                     if not episodeinfo:
                         logger.warn(f"{item.title} 未找到集媒体项：{episode.get('Id')}")
+                        success = False
                         continue
-                    if __need_trans_actor(episodeinfo):
+                    if self.__need_trans_actor(episodeinfo):
                         # 更新集媒体项人物
-                        self.__update_peoples(server=server, itemid=episode.get("Id"), iteminfo=episodeinfo,
-                                              douban_actors=season_actors)
+                        if not self.__update_peoples(server=server, itemid=episode.get("Id"), iteminfo=episodeinfo,
+                                                     douban_actors=season_actors):
+                            success = False
                         logger.info(f"集 {episodeinfo.get('Id')} 的人物信息更新完成")
                     else:
                         logger.info(f"集 {episodeinfo.get('Id')} 的人物信息已是中文，无需更新")
+        return success
 
     def __update_people(self, server: str, people: dict, douban_actors: list = None) -> Optional[dict]:
         """
@@ -495,6 +810,22 @@ class PersonMeta(_PluginBase):
         # 返回的人物信息
         ret_people = copy.deepcopy(people)
 
+        # 已处理过的人物，直接使用缓存的中文名，仅从豆瓣补充本条目中的饰演角色
+        cache_key = f"{server}:{people.get('Id')}"
+        with self._cache_lock:
+            cached = self._person_cache.get(cache_key)
+        douban_actor = self.__match_douban_actor(people=people, douban_actors=douban_actors)
+        if cached:
+            if cached.get("name"):
+                ret_people["Name"] = cached.get("name")
+                character = self.__get_douban_character(douban_actor)
+                if character:
+                    ret_people["Role"] = character
+                return ret_people
+            if not douban_actor:
+                logger.debug(f"人物 {people.get('Name')} 已处理过且未找到中文数据")
+                return None
+
         try:
             # 查询媒体库人物详情
             personinfo = self.get_iteminfo(server=server, itemid=people.get("Id"))
@@ -511,11 +842,11 @@ class PersonMeta(_PluginBase):
             # 从TMDB信息中更新人物信息
             person_tmdbid, person_imdbid = __get_peopleid(personinfo)
             if person_tmdbid:
-                person_detail = self.tmdbchain.person_detail(int(person_tmdbid))
+                person_detail = self.__get_tmdb_person(person_tmdbid)
                 if person_detail:
-                    cn_name = self.__get_chinese_name(person_detail)
+                    cn_name = person_detail.get("name")
                     # 图片优先从TMDB获取
-                    profile_path = person_detail.profile_path
+                    profile_path = person_detail.get("profile_path")
                     if profile_path:
                         logger.debug(f"{people.get('Name')} 从TMDB获取到图片：{profile_path}")
                         profile_path = f"https://{settings.TMDB_IMAGE_DOMAIN}/t/p/original{profile_path}"
@@ -526,7 +857,7 @@ class PersonMeta(_PluginBase):
                         ret_people["Name"] = cn_name
                         updated_name = True
                         # 更新中文描述
-                        biography = person_detail.biography
+                        biography = person_detail.get("biography")
                         if biography and StringUtils.is_chinese(biography):
                             logger.debug(f"{people.get('Name')} 从TMDB获取到中文描述")
                             personinfo["Overview"] = biography
@@ -556,44 +887,35 @@ class PersonMeta(_PluginBase):
               "latin_name": "Daniel Craig"
             }
             """
-            if douban_actors and (not updated_name
-                                  or not updated_overview
-                                  or not update_character):
-                # 从豆瓣演员中匹配中文名称、角色和简介
-                for douban_actor in douban_actors:
-                    if douban_actor.get("latin_name") == people.get("Name") \
-                            or douban_actor.get("name") == people.get("Name"):
-                        # 名称
-                        if not updated_name:
-                            logger.debug(f"{people.get('Name')} 从豆瓣中获取到中文名：{douban_actor.get('name')}")
-                            personinfo["Name"] = douban_actor.get("name")
-                            ret_people["Name"] = douban_actor.get("name")
-                            updated_name = True
-                        # 描述
-                        if not updated_overview:
-                            if douban_actor.get("title"):
-                                logger.debug(f"{people.get('Name')} 从豆瓣中获取到中文描述：{douban_actor.get('title')}")
-                                personinfo["Overview"] = douban_actor.get("title")
-                                updated_overview = True
-                        # 饰演角色
-                        if not update_character:
-                            if douban_actor.get("character"):
-                                # "饰 詹姆斯·邦德 James Bond 007"
-                                character = re.sub(r"饰\s+", "",
-                                                   douban_actor.get("character"))
-                                character = re.sub("演员", "",
-                                                   character)
-                                if character:
-                                    logger.debug(f"{people.get('Name')} 从豆瓣中获取到饰演角色：{character}")
-                                    ret_people["Role"] = character
-                                    update_character = True
-                        # 图片
-                        if not profile_path:
-                            avatar = douban_actor.get("avatar") or {}
-                            if avatar.get("large"):
-                                logger.debug(f"{people.get('Name')} 从豆瓣中获取到图片：{avatar.get('large')}")
-                                profile_path = avatar.get("large")
-                        break
+            if douban_actor and (not updated_name
+                                 or not updated_overview
+                                 or not update_character):
+                # 使用匹配到的豆瓣演员补充中文名称、角色和简介
+                # 名称
+                if not updated_name:
+                    logger.debug(f"{people.get('Name')} 从豆瓣中获取到中文名：{douban_actor.get('name')}")
+                    personinfo["Name"] = douban_actor.get("name")
+                    ret_people["Name"] = douban_actor.get("name")
+                    updated_name = True
+                # 描述
+                if not updated_overview:
+                    if douban_actor.get("title"):
+                        logger.debug(f"{people.get('Name')} 从豆瓣中获取到中文描述：{douban_actor.get('title')}")
+                        personinfo["Overview"] = douban_actor.get("title")
+                        updated_overview = True
+                # 饰演角色
+                if not update_character:
+                    character = self.__get_douban_character(douban_actor)
+                    if character:
+                        logger.debug(f"{people.get('Name')} 从豆瓣中获取到饰演角色：{character}")
+                        ret_people["Role"] = character
+                        update_character = True
+                # 图片
+                if not profile_path:
+                    avatar = douban_actor.get("avatar") or {}
+                    if avatar.get("large"):
+                        logger.debug(f"{people.get('Name')} 从豆瓣中获取到图片：{avatar.get('large')}")
+                        profile_path = avatar.get("large")
 
             # 更新人物图片
             if profile_path:
@@ -613,34 +935,121 @@ class PersonMeta(_PluginBase):
                 logger.debug(f"更新人物 {people.get('Name')} 的信息：{personinfo}")
                 ret = self.set_iteminfo(server=server, itemid=people.get("Id"), iteminfo=personinfo)
                 if ret:
+                    self.__set_person_cache(cache_key=cache_key,
+                                            name=personinfo.get("Name") if updated_name else None,
+                                            tmdbid=person_tmdbid)
                     return ret_people
             else:
                 logger.debug(f"人物 {people.get('Name')} 未找到中文数据")
+                self.__set_person_cache(cache_key=cache_key, name=None, tmdbid=person_tmdbid)
         except Exception as err:
             logger.error(f"更新人物信息失败：{str(err)}")
         return None
 
+    def __set_person_cache(self, cache_key: str, name: Optional[str], tmdbid: Optional[str]):
+        """
+        记录已处理的人物
+        """
+        with self._cache_lock:
+            self._person_cache[cache_key] = {
+                "name": name,
+                "tmdbid": tmdbid,
+                "time": time.time()
+            }
+
+    def __get_tmdb_person(self, tmdbid: str) -> Optional[dict]:
+        """
+        查询TMDB人物详情，同一人物只查询一次
+        """
+        with self._cache_lock:
+            cached = self._tmdb_person_cache.get(str(tmdbid))
+        if cached:
+            return cached
+        person_detail = self.tmdbchain.person_detail(int(tmdbid))
+        if not person_detail:
+            return None
+        person = {
+            "name": self.__get_chinese_name(person_detail),
+            "biography": person_detail.biography,
+            "profile_path": person_detail.profile_path,
+            "time": time.time()
+        }
+        with self._cache_lock:
+            self._tmdb_person_cache[str(tmdbid)] = person
+        return person
+
+    @staticmethod
+    def __match_douban_actor(people: dict, douban_actors: List[dict] = None) -> Optional[dict]:
+        """
+        从豆瓣演员中匹配人物
+        """
+        for douban_actor in douban_actors or []:
+            if douban_actor.get("latin_name") == people.get("Name") \
+                    or douban_actor.get("name") == people.get("Name"):
+                return douban_actor
+        return None
+
+    @staticmethod
+    def __get_douban_character(douban_actor: Optional[dict]) -> Optional[str]:
+        """
+        获取豆瓣演员的饰演角色
+        """
+        if not douban_actor or not douban_actor.get("character"):
+            return None
+        # "饰 詹姆斯·邦德 James Bond 007"
+        character = re.sub(r"饰\s+", "",
+                           douban_actor.get("character"))
+        character = re.sub("演员", "",
+                           character)
+        return character or None
+
+    def __wait_douban(self):
+        """
+        豆瓣请求限速，所有线程共享最小请求间隔
+        """
+        with self._douban_lock:
+            wait_time = self._douban_last_time + self._douban_interval - time.time()
+            if wait_time > 0:
+                time.sleep(wait_time)
+            self._douban_last_time = time.time()
+
     def __get_douban_actors(self, mediainfo: MediaInfo, season: int = None) -> List[dict]:
         """
         获取豆瓣演员信息
         """
-        # 随机休眠 3-10 秒
-        sleep_time = 3 + int(time.time()) % 7
-        logger.debug(f"随机休眠 {sleep_time}秒 ...")
-        time.sleep(sleep_time)
+        cache_key = f"{mediainfo.tmdb_id}:{season}"
+        with self._cache_lock:
+            cached = self._douban_actors_cache.get(cache_key)
+            if cached and cached.get("time", 0) > time.time() - self._douban_actors_ttl:
+                return cached.get("actors")
         # 匹配豆瓣信息
+        self.__wait_douban()
         doubaninfo = self.chain.match_doubaninfo(name=mediainfo.title,
                                                  imdbid=mediainfo.imdb_id,
                                                  mtype=mediainfo.type,
                                                  year=mediainfo.year,
                                                  season=season)
         # 豆瓣演员
+        actors = []
         if doubaninfo:
+            self.__wait_douban()
             doubanitem = self.chain.douban_info(doubaninfo.get("id")) or {}
-            return (doubanitem.get("actors") or []) + (doubanitem.get("directors") or [])
+            actors = (doubanitem.get("actors") or []) + (doubanitem.get("directors") or [])
         else:
             logger.debug(f"未找到豆瓣信息：{mediainfo.title_year}")
-        return []
+        with self._cache_lock:
+            now = time.time()
+            self._douban_actors_cache.pop(cache_key, None)
+            # 清理过期条目，超出数量时淘汰最早的条目
+            if len(self._douban_actors_cache) >= self._douban_actors_max:
+                self._douban_actors_cache = {
+                    key: value for key, value in self._douban_actors_cache.items()
+                    if value.get("time", 0) > now - self._douban_actors_ttl
+                }
+                while len(self._douban_actors_cache) >= self._douban_actors_max:
+                    self._douban_actors_cache.pop(next(iter(self._douban_actors_cache)))
+            self._douban_actors_cache[cache_key] = {"actors": actors, "time": now}
+        return actors
 
     @staticmethod
     def get_iteminfo(server: str, itemid: str) -> dict:
@@ -3,7 +3,7 @@ import threading
 import time
 import traceback
 from pathlib import Path
-from typing import List, Tuple, Dict, Any
+from typing import List, Tuple, Dict, Any, Set, Optional
 
 from watchdog.events import FileSystemEventHandler
 from watchdog.observers import Observer
@@ -42,13 +42,17 @@ class FileMonitorHandler(FileSystemEventHandler):
         # 新增文件记录
         with state_lock:
             try:
-                self.sync.state_set[str(file_path)] = file_path.stat().st_ino
+                stat = file_path.stat()
+                self.sync.add_state(str(file_path), (stat.st_dev, stat.st_ino))
             except Exception as e:
                 logger.error(f"新增文件记录失败：{str(e)}")
 
     def on_moved(self, event):
         if event.is_directory:
             return
+        # 移除旧路径记录
+        with state_lock:
+            self.sync.remove_state(event.src_path)
         file_path = Path(event.dest_path)
         if file_path.suffix in [".!qB", ".part", ".mp"]:
             return
@@ -60,7 +64,11 @@ class FileMonitorHandler(FileSystemEventHandler):
                     return
         # 新增文件记录
         with state_lock:
-            self.sync.state_set[str(file_path)] = file_path.stat().st_ino
+            try:
+                stat = file_path.stat()
+                self.sync.add_state(str(file_path), (stat.st_dev, stat.st_ino))
+            except Exception as e:
+                logger.error(f"新增文件记录失败：{str(e)}")
 
     def on_deleted(self, event):
         file_path = Path(event.src_path)
@@ -86,28 +94,86 @@ class FileMonitorHandler(FileSystemEventHandler):
         self.sync.handle_deleted(file_path)
 
 
-def updateState(monitor_dirs: List[str]):
+def dir_key(path: str) -> str:
     """
-    更新监控目录的文件列表
+    统一目录路径格式（去掉末尾分隔符），与文件路径的dirname一致
+    """
+    return os.path.dirname(os.path.join(path, ""))
+
+
+def scan_dir(path: str, state_set: Dict[str, Tuple[int, int]], dir_index: Dict[str, list],
+             old_files: Dict[str, Dict[str, Tuple[int, int]]], old_index: Dict[str, list]):
+    """
+    递归扫描目录，文件以(设备号, inode)标识
+    目录修改时间与上次扫描一致时（目录内没有新增、删除、重命名），直接沿用上次的文件及子目录，不再读取目录内容
+    """
+    path = dir_key(path)
+    try:
+        stat = os.stat(path)
+    except OSError as e:
+        logger.error(f"扫描目录 {path} 失败：{str(e)}")
+        return
+    old = old_index.get(path)
+    if old and old[0] == stat.st_mtime:
+        dir_index[path] = old
+        state_set.update(old_files.get(path) or {})
+        subdirs = old[1]
+    else:
+        subdirs = []
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            # 同一目录下的文件与目录位于同一设备，直接复用DirEntry中的inode
+                            state_set[entry.path] = (stat.st_dev, entry.inode())
+                    except OSError as e:
+                        logger.debug(f"读取 {entry.path} 失败：{str(e)}")
+        except OSError as e:
+            logger.error(f"扫描目录 {path} 失败：{str(e)}")
+            return
+        dir_index[path] = [stat.st_mtime, subdirs]
+    for subdir in subdirs:
+        scan_dir(subdir, state_set, dir_index, old_files, old_index)
+
+
+def updateState(monitor_dirs: List[str], old_state: Dict[str, Tuple[int, int]] = None,
+                old_index: Dict[str, list] = None) -> Tuple[Dict[str, Tuple[int, int]], Dict[str, list]]:
+    """
+    更新监控目录的文件列表，只读取修改时间发生变化的目录
+    :return: 文件列表，目录索引 {目录: [修改时间, 子目录列表]}
     """
     # 记录开始时间
     start_time = time.time()
     state_set = {}
+    dir_index = {}
+    # 上次的文件列表按所在目录分组
+    old_files: Dict[str, Dict[str, Tuple[int, int]]] = {}
+    if old_state and old_index:
+        for path, file_id in old_state.items():
+            old_files.setdefault(os.path.dirname(path), {})[path] = file_id
+    else:
+        old_index = {}
     for mon_path in monitor_dirs:
-        for root, dirs, files in os.walk(mon_path):
-            for file in files:
-                file = Path(root) / file
-                if not file.exists():
-                    continue
-                # 记录文件inode
-                state_set[str(file)] = file.stat().st_ino
+        if not mon_path:
+            continue
+        scan_dir(mon_path, state_set, dir_index, old_files, old_index)
     # 记录结束时间
     end_time = time.time()
     # 计算耗时
     elapsed_time = end_time - start_time
-    logger.info(f"更新文件列表完成，共计{len(state_set)}个文件，耗时：{elapsed_time}秒")
+    rescanned = len([path for path, value in dir_index.items() if old_index.get(path) is not value])
+    if old_state is not None:
+        added = len(state_set.keys() - old_state.keys())
+        removed = len(old_state.keys() - state_set.keys())
+        logger.info(f"更新文件列表完成，共计{len(state_set)}个文件，新增{added}个，移除{removed}个，"
+                    f"重新读取{rescanned}/{len(dir_index)}个目录，耗时：{elapsed_time}秒")
+    else:
+        logger.info(f"更新文件列表完成，共计{len(state_set)}个文件，耗时：{elapsed_time}秒")
 
-    return state_set
+    return state_set, dir_index
 
 
 class RemoveLink(_PluginBase):
@@ -118,7 +184,7 @@ class RemoveLink(_PluginBase):
     # 插件图标
     plugin_icon = "Ombi_A.png"
     # 插件版本
-    plugin_version = "2.2"
+    plugin_version = "2.3"
     # 插件作者
     plugin_author = "DzAvril"
     # 作者主页
@@ -142,7 +208,14 @@ class RemoveLink(_PluginBase):
     _transferhistory = None
     _observer = []
     # 监控目录的文件列表
-    state_set: Dict[str, int] = {}
+    # 监控目录的文件列表 路径 -> (设备号, inode)
+    state_set: Dict[str, Tuple[int, int]] = {}
+    # (设备号, inode)反向索引
+    inode_map: Dict[Tuple[int, int], Set[str]] = {}
+    # 目录索引 目录 -> [修改时间, 子目录列表]，用于增量扫描
+    dir_index: Dict[str, list] = {}
+    # 后台扫描期间收到的文件变化，扫描完成后合并，None表示当前未在扫描
+    _scan_changes: Optional[Dict[str, Optional[Tuple[int, int]]]] = None
 
     def init_plugin(self, config: dict = None):
         logger.info(f"Hello, RemoveLink! config {config}")
@@ -166,6 +239,12 @@ class RemoveLink(_PluginBase):
             logger.info(f"监控目录：{monitor_dirs}")
             if not monitor_dirs:
                 return
+            # 先加载持久化的文件列表，再在后台增量刷新
+            with state_lock:
+                # 旧版本只记录了inode，没有设备号，不再使用
+                self.set_state({path: tuple(file_id) for path, file_id in (self.get_data("state_set") or {}).items()
+                                if isinstance(file_id, list) and len(file_id) == 2})
+                self.dir_index = self.get_data("dir_index") or {} if self.state_set else {}
             for mon_path in monitor_dirs:
                 # 格式源目录:目的目录
                 if not mon_path:
@@ -183,9 +262,82 @@ class RemoveLink(_PluginBase):
                     err_msg = str(e)
                     logger.error(f"{mon_path} 启动目录监控失败：{err_msg}")
                     self.systemmessage.put(f"{mon_path} 启动目录监控失败：{err_msg}", title="清理硬链接")
-            # 更新监控集合
+            # 后台增量刷新文件列表
+            threading.Thread(target=self.refresh_state, args=(monitor_dirs,), daemon=True).start()
+
+    def set_state(self, state_set: Dict[str, Tuple[int, int]]):
+        """
+        替换文件列表并重建反向索引，调用方需持有state_lock
+        """
+        self.state_set = {}
+        self.inode_map = {}
+        for path, file_id in state_set.items():
+            self.add_state(path, file_id)
+
+    def add_state(self, path: str, file_id: Tuple[int, int]):
+        """
+        新增文件记录，调用方需持有state_lock
+        :param file_id: (设备号, inode)
+        """
+        file_id = tuple(file_id)
+        self.remove_state(path)
+        self.state_set[path] = file_id
+        self.inode_map.setdefault(file_id, set()).add(path)
+        if self._scan_changes is not None:
+            self._scan_changes[path] = file_id
+
+    def remove_state(self, path: str) -> Optional[Tuple[int, int]]:
+        """
+        移除文件记录，返回其(设备号, inode)，调用方需持有state_lock
+        """
+        if self._scan_changes is not None:
+            self._scan_changes[path] = None
+        file_id = self.state_set.pop(path, None)
+        if file_id is None:
+            return None
+        paths = self.inode_map.get(file_id)
+        if paths:
+            paths.discard(path)
+            if not paths:
+                self.inode_map.pop(file_id, None)
+        return file_id
+
+    def refresh_state(self, monitor_dirs: List[str]):
+        """
+        扫描监控目录刷新文件列表并持久化
+        """
+        with state_lock:
+            old_state = dict(self.state_set)
+            old_index = self.dir_index
+            self._scan_changes = {}
+        try:
+            state_set, dir_index = updateState(monitor_dirs, old_state, old_index)
+        except Exception:
             with state_lock:
-                self.state_set = updateState(monitor_dirs)
+                self._scan_changes = None
+            raise
+        with state_lock:
+            # 扫描期间的新增、移动、删除以监控事件为准，合并到扫描结果中
+            changes = self._scan_changes
+            self._scan_changes = None
+            self.set_state(state_set)
+            self.dir_index = dir_index
+            for path, file_id in changes.items():
+                if file_id is None:
+                    self.remove_state(path)
+                else:
+                    self.add_state(path, file_id)
+        self.save_state()
+
+    def save_state(self):
+        """
+        持久化文件列表
+        """
+        with state_lock:
+            state_set = {path: list(file_id) for path, file_id in self.state_set.items()}
+            dir_index = dict(self.dir_index)
+        self.save_data("state_set", state_set)
+        self.save_data("dir_index", dir_index)
 
     def __update_config(self):
         """
@@ -429,6 +581,7 @@ class RemoveLink(_PluginBase):
                 except Exception as e:
                     print(str(e))
                     logger.error(f"停止目录监控失败：{str(e)}")
+            self.save_state()
         self._observer = []
 
     def __is_excluded(self, file_path: Path) -> bool:
@@ -556,40 +709,49 @@ class RemoveLink(_PluginBase):
                 )
             # 删除历史记录
             self.delete_history(str(file_path))
-            # 删除的文件inode
-            deleted_inode = self.state_set.get(str(file_path))
-            if not deleted_inode:
+            # 删除的文件(设备号, inode)
+            deleted_id = self.remove_state(str(file_path))
+            if deleted_id is None:
                 logger.info(f"文件 {file_path} 未在监控列表中，不处理")
                 return
-            else:
-                self.state_set.pop(str(file_path))
             try:
-                # 在current_set中查找与deleted_inode有相同inode的文件并删除
-                for path, inode in self.state_set.copy().items():
-                    if inode == deleted_inode:
-                        file = Path(path)
-                        if self.__is_excluded(file):
-                            logger.info(f"文件 {file} 在不删除目录中，不处理")
-                            continue
-                        # 删除硬链接文件
-                        logger.info(f"删除硬链接文件：{path}， inode: {inode}")
-                        file.unlink()
-                        # 清理刮削文件
-                        self.delete_scrap_infos(file_path)
-                        if self._delete_torrents:
-                            # 发送事件
-                            eventmanager.send_event(
-                                EventType.DownloadFileDeleted, {"src": str(file_path)}
-                            )
-                        # 删除历史记录
-                        self.delete_history(str(file_path))
-                        if self._notify:
-                            self.post_message(
-                                mtype=NotificationType.SiteMessage,
-                                title=f"【清理硬链接】",
-                                text=f"监控到删除源文件：[{file_path}]\n"
-                                     f"同步删除硬链接文件：[{path}]",
-                            )
+                # 通过反向索引查找同一设备上相同inode的文件并删除
+                for path in list(self.inode_map.get(deleted_id) or []):
+                    file = Path(path)
+                    if self.__is_excluded(file):
+                        logger.info(f"文件 {file} 在不删除目录中，不处理")
+                        continue
+                    # 文件列表可能来自重启前的持久化数据，inode可能已被复用，删除前重新校验
+                    try:
+                        stat = os.stat(path, follow_symlinks=False)
+                    except OSError:
+                        self.remove_state(path)
+                        continue
+                    if (stat.st_dev, stat.st_ino) != deleted_id:
+                        logger.warn(f"文件 {path} 的inode已变化，不是 {file_path} 的硬链接，不处理")
+                        # 按实际的(设备号, inode)重新记录
+                        self.add_state(path, (stat.st_dev, stat.st_ino))
+                        continue
+                    self.remove_state(path)
+                    # 删除硬链接文件
+                    logger.info(f"删除硬链接文件：{path}， inode: {deleted_id[1]}")
+                    file.unlink()
+                    # 清理刮削文件
+                    self.delete_scrap_infos(file_path)
+                    if self._delete_torrents:
+                        # 发送事件
+                        eventmanager.send_event(
+                            EventType.DownloadFileDeleted, {"src": str(file_path)}
+                        )
+                    # 删除历史记录
+                    self.delete_history(str(file_path))
+                    if self._notify:
+                        self.post_message(
+                            mtype=NotificationType.SiteMessage,
+                            title=f"【清理硬链接】",
+                            text=f"监控到删除源文件：[{file_path}]\n"
+                                 f"同步删除硬链接文件：[{path}]",
+                        )
             except Exception as e:
                 logger.error(
                     "删除硬链接文件发生错误：%s - %s" % (str(e), traceback.format_exc())
@@ -1,5 +1,8 @@
 import ipaddress
-from typing import List, Tuple, Dict, Any
+import threading
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple, Dict, Any, Optional
 
 from app.core.config import settings
 from app.core.event import eventmanager, Event
@@ -23,7 +26,7 @@ class SpeedLimiter(_PluginBase):
     # 插件图标
     plugin_icon = "Librespeed_A.png"
     # 插件版本
-    plugin_version = "1.3"
+    plugin_version = "1.5"
     # 插件作者
     plugin_author = "Shurelol"
     # 作者主页
@@ -54,9 +57,34 @@ class SpeedLimiter(_PluginBase):
     _limit_enabled: bool = False
     # 不限速地址
     _unlimited_ips = {}
-    # 当前限速状态
-    _current_state = ""
+    # 预编译的不限速地址区间 {ip版本: ([起始地址], [结束地址])}
+    _unlimited_ranges: Dict[int, Tuple[List[int], List[int]]] = {}
+    # 当前限速类型
+    _limit_type = ""
+    # 当前各下载器限速 {下载器: (上传, 下载)}
+    _applied_limits: Dict[str, Tuple[float, float]] = {}
+    # 智能限速控制器当前总上传限速 KB/s
+    _total_limit: Optional[float] = None
+    # 控制器调节周期（秒）
+    _control_interval = 10
+    # 播放带宽余量比例
+    _playback_margin = 0.1
+    # 上调限速时的平滑系数，下调立即生效
+    _smooth_factor = 0.3
+    # 滞回：限速变化小于该比例或最小步长时不下发
+    _hysteresis = 0.1
+    _min_step = 100
+    # 各下载器按比例保底分配的份额，其余按实际需求分配
+    _base_share = 0.2
     _exclude_path = ""
+    # 播放会话表 {媒体服务器: {会话ID: 会话信息}}
+    _sessions: Dict[str, Dict[str, dict]] = {}
+    _sessions_lock = threading.Lock()
+    _limit_lock = threading.Lock()
+    # 开始播放事件
+    _start_events = ["playback.start", "playback.unpause", "PlaybackStart", "media.play", "media.resume"]
+    # 停止播放事件
+    _stop_events = ["playback.stop", "playback.pause", "PlaybackStop", "media.stop", "media.pause"]
 
     def init_plugin(self, config: dict = None):
         # 读取配置
@@ -67,7 +95,8 @@ class SpeedLimiter(_PluginBase):
             self._play_down_speed = float(config.get("play_down_speed")) if config.get("play_down_speed") else 0
             self._noplay_up_speed = float(config.get("noplay_up_speed")) if config.get("noplay_up_speed") else 0
             self._noplay_down_speed = float(config.get("noplay_down_speed")) if config.get("noplay_down_speed") else 0
-            self._current_state = f"U:{self._noplay_up_speed},D:{self._noplay_down_speed}"
+            self._limit_type = "未播放"
+            self._total_limit = None
             self._exclude_path = config.get("exclude_path")
 
             try:
@@ -94,8 +123,15 @@ class SpeedLimiter(_PluginBase):
             # 不限速地址
             self._unlimited_ips["ipv4"] = config.get("ipv4") or ""
             self._unlimited_ips["ipv6"] = config.get("ipv6") or ""
+            self._unlimited_ranges = {
+                4: self.__compile_ranges(self._unlimited_ips["ipv4"], 4),
+                6: self.__compile_ranges(self._unlimited_ips["ipv6"], 6)
+            }
+            self._sessions = {}
 
             self._downloader = config.get("downloader") or []
+            self._applied_limits = {download: (self._noplay_up_speed, self._noplay_down_speed)
+                                    for download in self._downloader}
             if self._downloader:
                 if 'qbittorrent' in self._downloader:
                     self._qb = Qbittorrent()
@@ -124,7 +160,7 @@ class SpeedLimiter(_PluginBase):
         }]
         """
         if self._enabled and self._limit_enabled and self._interval:
-            return [
+            services = [
                 {
                     "id": "SpeedLimiter",
                     "name": "播放限速检查服务",
@@ -133,6 +169,15 @@ class SpeedLimiter(_PluginBase):
                     "kwargs": {"seconds": self._interval}
                 }
             ]
+            if self._auto_limit:
+                services.append({
+                    "id": "SpeedLimiterControl",
+                    "name": "播放智能限速调节服务",
+                    "trigger": "interval",
+                    "func": self.__control_tick,
+                    "kwargs": {"seconds": self._control_interval}
+                })
+            return services
         return []
 
     def get_form(self) -> Tuple[List[dict], Dict[str, Any]]:
@@ -424,132 +469,249 @@ class SpeedLimiter(_PluginBase):
     def check_playing_sessions(self, event: Event = None):
         """
         检查播放会话
+        播放事件只更新会话表中对应的媒体服务器，定时任务并发查询所有媒体服务器进行校准
         """
         if not self._qb and not self._tr:
             return
         if not self._enabled:
             return
-        if event:
-            event_data: WebhookEventInfo = event.event_data
-            if event_data.event not in [
-                "playback.start",
-                "PlaybackStart",
-                "media.play",
-                "media.stop",
-                "PlaybackStop",
-                "playback.stop"
-            ]:
-                return
-        # 当前播放的总比特率
-        total_bit_rate = 0
         # 媒体服务器类型，多个以,分隔
         if not settings.MEDIASERVER:
             return
         media_servers = settings.MEDIASERVER.split(',')
-        # 查询所有媒体服务器状态
-        for media_server in media_servers:
-            # 查询播放中会话
-            playing_sessions = []
-            if media_server == "emby":
-                req_url = "[HOST]emby/Sessions?api_key=[APIKEY]"
-                try:
-                    res = Emby().get_data(req_url)
-                    if res and res.status_code == 200:
-                        sessions = res.json()
-                        for session in sessions:
-                            if session.get("NowPlayingItem") and not session.get("PlayState", {}).get("IsPaused"):
-                                if not self.__path_execluded(session.get("NowPlayingItem").get("Path")):
-                                    playing_sessions.append(session)
+        if event:
+            event_data: WebhookEventInfo = event.event_data
+            if event_data.event not in self._start_events + self._stop_events:
+                return
+            if event_data.channel not in media_servers:
+                return
+            if event_data.event in self._start_events \
+                    or not self.__remove_sessions(event_data):
+                # 开始播放或未匹配到会话时，只查询该媒体服务器
+                self.__refresh_sessions([event_data.channel])
+        else:
+            self.__refresh_sessions(media_servers)
+        self.__apply_limit()
 
-                except Exception as e:
-                    logger.error(f"获取Emby播放会话失败：{str(e)}")
-                    continue
-                # 计算有效比特率
-                for session in playing_sessions:
-                    # 设置了不限速范围则判断session ip是否在不限速范围内
-                    if self._unlimited_ips["ipv4"] or self._unlimited_ips["ipv6"]:
-                        if not self.__allow_access(self._unlimited_ips, session.get("RemoteEndPoint")) \
-                                and session.get("NowPlayingItem", {}).get("MediaType") == "Video":
-                            total_bit_rate += int(session.get("NowPlayingItem", {}).get("Bitrate") or 0)
-                    # 未设置不限速范围，则默认不限速内网ip
-                    elif not IpUtils.is_private_ip(session.get("RemoteEndPoint")) \
-                            and session.get("NowPlayingItem", {}).get("MediaType") == "Video":
-                        logger.debug(f"当前播放内容：{session.get('NowPlayingItem').get('FileName')}，"
-                                     f"比特率：{int(session.get('NowPlayingItem', {}).get('Bitrate') or 0)}")
-                        total_bit_rate += int(session.get("NowPlayingItem", {}).get("Bitrate") or 0)
-            elif media_server == "jellyfin":
-                req_url = "[HOST]Sessions?api_key=[APIKEY]"
-                try:
-                    res = Jellyfin().get_data(req_url)
-                    if res and res.status_code == 200:
-                        sessions = res.json()
-                        for session in sessions:
-                            if session.get("NowPlayingItem") and not session.get("PlayState", {}).get("IsPaused"):
-                                if not self.__path_execluded(session.get("NowPlayingItem").get("Path")):
-                                    playing_sessions.append(session)
-                except Exception as e:
-                    logger.error(f"获取Jellyfin播放会话失败：{str(e)}")
-                    continue
-                # 计算有效比特率
-                for session in playing_sessions:
-                    # 设置了不限速范围则判断session ip是否在不限速范围内
-                    if self._unlimited_ips["ipv4"] or self._unlimited_ips["ipv6"]:
-                        if not self.__allow_access(self._unlimited_ips, session.get("RemoteEndPoint")) \
-                                and session.get("NowPlayingItem", {}).get("MediaType") == "Video":
-                            media_streams = session.get("NowPlayingItem", {}).get("MediaStreams") or []
-                            for media_stream in media_streams:
-                                total_bit_rate += int(media_stream.get("BitRate") or 0)
-                    # 未设置不限速范围，则默认不限速内网ip
-                    elif not IpUtils.is_private_ip(session.get("RemoteEndPoint")) \
-                            and session.get("NowPlayingItem", {}).get("MediaType") == "Video":
-                        media_streams = session.get("NowPlayingItem", {}).get("MediaStreams") or []
-                        for media_stream in media_streams:
-                            total_bit_rate += int(media_stream.get("BitRate") or 0)
-            elif media_server == "plex":
+    def __refresh_sessions(self, media_servers: List[str]):
+        """
+        并发查询媒体服务器播放会话，更新会话表，查询失败的媒体服务器保留原有会话
+        """
+        with ThreadPoolExecutor(max_workers=len(media_servers) or 1) as executor:
+            results = list(zip(media_servers, executor.map(self.__get_sessions, media_servers)))
+        with self._sessions_lock:
+            for media_server, sessions in results:
+                if sessions is not None:
+                    self._sessions[media_server] = sessions
+
+    def __remove_sessions(self, event_data: WebhookEventInfo) -> bool:
+        """
+        根据停止/暂停事件从会话表中移除会话
+        :return: 是否匹配到会话
+        """
+        with self._sessions_lock:
+            sessions = self._sessions.get(event_data.channel) or {}
+            removed = [session_id for session_id, session in sessions.items()
+                       if event_data.item_id and str(session.get("item_id")) == str(event_data.item_id)
+                       and (not event_data.ip or not session.get("ip") or session.get("ip") == event_data.ip)]
+            for session_id in removed:
+                sessions.pop(session_id, None)
+        return bool(removed)
+
+    def __get_sessions(self, media_server: str) -> Optional[Dict[str, dict]]:
+        """
+        查询媒体服务器中需要限速的播放会话
+        :return: {会话ID: {item_id, ip, bitrate}}，查询失败返回None
+        """
+        playing_sessions = {}
+        if media_server == "emby":
+            req_url = "[HOST]emby/Sessions?api_key=[APIKEY]"
+            try:
+                res = Emby().get_data(req_url)
+                if not res or res.status_code != 200:
+                    return None
+                for session in res.json():
+                    item = session.get("NowPlayingItem")
+                    if not item or session.get("PlayState", {}).get("IsPaused"):
+                        continue
+                    if self.__path_execluded(item.get("Path")):
+                        continue
+                    if item.get("MediaType") != "Video" or not self.__need_limit(session.get("RemoteEndPoint")):
+                        continue
+                    # 转码时按实际输出码率计算
+                    bitrate = int((session.get("TranscodingInfo") or {}).get("Bitrate")
+                                  or item.get("Bitrate") or 0)
+                    logger.debug(f"当前播放内容：{item.get('FileName')}，比特率：{bitrate}")
+                    playing_sessions[session.get("Id")] = {
+                        "item_id": item.get("Id"),
+                        "ip": session.get("RemoteEndPoint"),
+                        "bitrate": bitrate
+                    }
+            except Exception as e:
+                logger.error(f"获取Emby播放会话失败：{str(e)}")
+                return None
+        elif media_server == "jellyfin":
+            req_url = "[HOST]Sessions?api_key=[APIKEY]"
+            try:
+                res = Jellyfin().get_data(req_url)
+                if not res or res.status_code != 200:
+                    return None
+                for session in res.json():
+                    item = session.get("NowPlayingItem")
+                    if not item or session.get("PlayState", {}).get("IsPaused"):
+                        continue
+                    if self.__path_execluded(item.get("Path")):
+                        continue
+                    if item.get("MediaType") != "Video" or not self.__need_limit(session.get("RemoteEndPoint")):
+                        continue
+                    playing_sessions[session.get("Id")] = {
+                        "item_id": item.get("Id"),
+                        "ip": session.get("RemoteEndPoint"),
+                        # 转码时按实际输出码率计算
+                        "bitrate": int((session.get("TranscodingInfo") or {}).get("Bitrate") or 0)
+                        or sum(int(media_stream.get("BitRate") or 0)
+                               for media_stream in item.get("MediaStreams") or [])
+                    }
+            except Exception as e:
+                logger.error(f"获取Jellyfin播放会话失败：{str(e)}")
+                return None
+        elif media_server == "plex":
+            try:
                 _plex = Plex().get_plex()
-                if _plex:
-                    sessions = _plex.sessions()
-                    for session in sessions:
-                        bitrate = sum([m.bitrate or 0 for m in session.media])
-                        playing_sessions.append({
-                            "type": session.TAG,
-                            "bitrate": bitrate,
-                            "address": session.player.address
-                        })
-                    # 计算有效比特率
-                    for session in playing_sessions:
-                        # 设置了不限速范围则判断session ip是否在不限速范围内
-                        if self._unlimited_ips["ipv4"] or self._unlimited_ips["ipv6"]:
-                            if not self.__allow_access(self._unlimited_ips, session.get("address")) \
-                                    and session.get("type") == "Video":
-                                total_bit_rate += int(session.get("bitrate") or 0)
-                        # 未设置不限速范围，则默认不限速内网ip
-                        elif not IpUtils.is_private_ip(session.get("address")) \
-                                and session.get("type") == "Video":
-                            total_bit_rate += int(session.get("bitrate") or 0)
+                if not _plex:
+                    return None
+                for session in _plex.sessions():
+                    if session.TAG != "Video" or not self.__need_limit(session.player.address):
+                        continue
+                    playing_sessions[str(session.sessionKey)] = {
+                        "item_id": session.ratingKey,
+                        "ip": session.player.address,
+                        "bitrate": sum([m.bitrate or 0 for m in session.media])
+                    }
+            except Exception as e:
+                logger.error(f"获取Plex播放会话失败：{str(e)}")
+                return None
+        return playing_sessions
 
-        if total_bit_rate:
-            logger.debug(f"比特率总计：{total_bit_rate}")
-            # 开启智能限速计算上传限速
-            if self._auto_limit:
-                play_up_speed = self.__calc_limit(total_bit_rate)
+    def __need_limit(self, ip: str) -> bool:
+        """
+        判断播放地址是否需要限速
+        """
+        # 设置了不限速范围则判断session ip是否在不限速范围内
+        if self._unlimited_ips.get("ipv4") or self._unlimited_ips.get("ipv6"):
+            return not self.__allow_access(ip)
+        # 未设置不限速范围，则默认不限速内网ip
+        return not IpUtils.is_private_ip(ip)
+
+    def __apply_limit(self):
+        """
+        根据会话表计算并设置限速
+        """
+        with self._sessions_lock:
+            # 当前播放的总比特率
+            total_bit_rate = sum(session.get("bitrate") or 0
+                                 for sessions in self._sessions.values()
+                                 for session in sessions.values())
+        with self._limit_lock:
+            if total_bit_rate:
+                logger.debug(f"比特率总计：{total_bit_rate}")
+                # 开启智能限速计算上传限速
+                if self._auto_limit:
+                    upload_limits = self.__control_limits(total_bit_rate)
+                else:
+                    upload_limits = {download: self._play_up_speed for download in self._downloader}
+
+                # 当前正在播放，开始限速
+                logger.debug(f"上传限速：{upload_limits} KB/s")
+                self.__set_limiter(limit_type="播放", upload_limits=upload_limits,
+                                   download_limit=self._play_down_speed)
             else:
-                play_up_speed = self._play_up_speed
+                # 当前没有播放，取消限速
+                self._total_limit = None
+                self.__set_limiter(limit_type="未播放",
+                                   upload_limits={download: self._noplay_up_speed for download in self._downloader},
+                                   download_limit=self._noplay_down_speed)
+
+    def __control_tick(self):
+        """
+        播放期间定时根据下载器实际上传速度调节限速
+        """
+        if not self._enabled or not self._auto_limit:
+            return
+        with self._sessions_lock:
+            playing = any(self._sessions.values())
+        if playing:
+            self.__apply_limit()
 
-            # 当前正在播放，开始限速
-            logger.debug(f"上传限速：{play_up_speed} KB/s")
-            self.__set_limiter(limit_type="播放", upload_limit=play_up_speed,
-                               download_limit=self._play_down_speed)
+    def __control_limits(self, total_bit_rate: float) -> Dict[str, int]:
+        """
+        智能限速控制器：计算总上传限速并按下载器实际需求分配
+        """
+        # 为播放预留余量
+        target = self.__calc_limit(total_bit_rate * (1 + self._playback_margin))
+        # 下调立即生效，避免影响播放；上调平滑进行
+        if self._total_limit is None or target < self._total_limit:
+            total_limit = target
         else:
-            # 当前没有播放，取消限速
-            self.__set_limiter(limit_type="未播放", upload_limit=self._noplay_up_speed,
-                               download_limit=self._noplay_down_speed)
+            total_limit = self._total_limit + (target - self._total_limit) * self._smooth_factor
+        self._total_limit = total_limit
+        if len(self._downloader) == 1:
+            # 只有一个下载器
+            return {self._downloader[0]: int(total_limit)}
+        # 保底份额按配置比例分配，未配置则平均
+        ratios = [1] * len(self._downloader)
+        if self._allocation_ratio:
+            try:
+                ratios = [int(i) for i in self._allocation_ratio.split(":")]
+                if len(ratios) != len(self._downloader) or not sum(ratios):
+                    raise ValueError(self._allocation_ratio)
+            except ValueError:
+                logger.warn(f"分配比例 {self._allocation_ratio} 与下载器数量不匹配，按平均分配")
+                ratios = [1] * len(self._downloader)
+        # 剩余份额按实际上传速度分配，接近限速的下载器需求放大
+        upload_speeds = self.__get_upload_speeds()
+        demands = {}
+        for download in self._downloader:
+            speed = upload_speeds.get(download) or 0
+            applied = (self._applied_limits.get(download) or (0, 0))[0]
+            if applied and speed >= applied * 0.9:
+                speed *= 1.5
+            demands[download] = max(speed, 1)
+        base_limit = total_limit * self._base_share
+        demand_limit = total_limit - base_limit
+        total_demand = sum(demands.values())
+        upload_limits = {}
+        for cnt, download in enumerate(self._downloader):
+            upload_limits[download] = max(int(base_limit * ratios[cnt] / sum(ratios)
+                                              + demand_limit * demands[download] / total_demand), 10)
+            logger.debug(f"下载器：{download} 当前上传：{round(upload_speeds.get(download) or 0, 2)} KB/s "
+                         f"分配上传限速：{upload_limits[download]} KB/s")
+        return upload_limits
+
+    def __get_upload_speeds(self) -> Dict[str, float]:
+        """
+        获取各下载器当前上传速度 KB/s
+        """
+        upload_speeds = {}
+        for download in self._downloader:
+            try:
+                if str(download) == 'qbittorrent':
+                    info = self._qb.transfer_info() if self._qb else None
+                    if info:
+                        upload_speeds[download] = (info.get("up_info_speed") or 0) / 1024
+                else:
+                    info = self._tr.transfer_info() if self._tr else None
+                    if info:
+                        upload_speeds[download] = (info.upload_speed or 0) / 1024
+            except Exception as e:
+                logger.debug(f"获取下载器 {download} 上传速度失败：{str(e)}")
+        return upload_speeds
 
     def __path_execluded(self, path: str) -> bool:
         """
         判断是否在不限速路径内
         """
-        if self._exclude_path:
+        if self._exclude_path and path:
             exclude_paths = self._exclude_path.split("\n")
             for exclude_path in exclude_paths:
                 if exclude_path in path:
@@ -566,43 +728,33 @@ class SpeedLimiter(_PluginBase):
             return 10
         return round((self._bandwidth - total_bit_rate) / 8 / 1024, 2)
 
-    def __set_limiter(self, limit_type: str, upload_limit: float, download_limit: float):
+    def __set_limiter(self, limit_type: str, upload_limits: Dict[str, float], download_limit: float):
         """
-        设置限速
+        设置限速，限速类型不变且变化幅度较小时不下发
         """
         if not self._qb and not self._tr:
             return
-        state = f"U:{upload_limit},D:{download_limit}"
-        if self._current_state == state:
+        type_changed = self._limit_type != limit_type
+        changed = {}
+        for download in self._downloader:
+            upload_limit = upload_limits.get(download) or 0
+            old_upload, old_download = self._applied_limits.get(download) or (None, None)
+            if not type_changed and old_download == download_limit and old_upload is not None:
+                if bool(old_upload) == bool(upload_limit) \
+                        and abs(upload_limit - old_upload) < max(old_upload * self._hysteresis, self._min_step):
+                    continue
+            changed[download] = upload_limit
+        if not changed:
             # 限速状态没有改变
             return
-        else:
-            self._current_state = state
-            
+        self._limit_type = limit_type
+
         try:
-            cnt = 0
             text = ""
-            for download in self._downloader:
+            for cnt, (download, upload_limit_final) in enumerate(changed.items()):
                 if cnt != 0:
                     text = f"{text}\n===================="
                 text = f"{text}\n下载器：{download}"
-                upload_limit_final = upload_limit
-                if self._auto_limit and limit_type == "播放":
-                    # 开启了播放智能限速
-                    if len(self._downloader) == 1:
-                        # 只有一个下载器
-                        upload_limit_final = int(upload_limit)
-                    else:
-                        # 多个下载器
-                        if not self._allocation_ratio:
-                            # 平均
-                            upload_limit_final = int(upload_limit / len(self._downloader))
-                        else:
-                            # 按比例
-                            allocation_count = sum([int(i) for i in self._allocation_ratio.split(":")])
-                            upload_limit_final = int(upload_limit * int(self._allocation_ratio.split(":")[cnt]) / allocation_count)
-                            logger.debug(f"下载器：{download} 分配比例：{self._allocation_ratio.split(':')[cnt]}/{allocation_count} 分配上传限速：{upload_limit_final} KB/s")
-                            cnt += 1
                 if upload_limit_final:
                     text = f"{text}\n上传：{upload_limit_final} KB/s"
                 else:
@@ -617,8 +769,12 @@ class SpeedLimiter(_PluginBase):
                 else:
                     if self._tr:
                         self._tr.set_speed_limit(download_limit=download_limit, upload_limit=upload_limit_final)
-            # 发送通知
-            self._notify_message(text, bool(upload_limit or download_limit), limit_type)
+                self._applied_limits[download] = (upload_limit_final, download_limit)
+            if type_changed:
+                # 发送通知
+                self._notify_message(text, bool(any(upload_limits.values()) or download_limit), limit_type)
+            else:
+                logger.info(f"播放智能限速调整：{text}")
         except Exception as e:
             logger.error(f"设置限速失败：{str(e)}")
 
@@ -643,41 +799,55 @@ class SpeedLimiter(_PluginBase):
                 )
 
     @staticmethod
-    def __allow_access(allow_ips: dict, ip: str) -> bool:
+    def __compile_ranges(ips: str, version: int) -> Tuple[List[int], List[int]]:
+        """
+        将不限速地址预编译为合并后的有序区间
+        :param ips: 以,分隔的IP或网段
+        :param version: IP版本
+        :return: ([起始地址], [结束地址])
+        """
+        ranges = []
+        for ip in (ips or "").split(","):
+            ip = ip.strip()
+            if not ip:
+                continue
+            try:
+                network = ipaddress.ip_network(ip, strict=False)
+            except ValueError as err:
+                logger.warn(f"不限速地址 {ip} 格式错误：{str(err)}")
+                continue
+            if network.version != version:
+                continue
+            ranges.append((int(network.network_address), int(network.broadcast_address)))
+        ranges.sort()
+        merged = []
+        for start, end in ranges:
+            if merged and start <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        return [r[0] for r in merged], [r[1] for r in merged]
+
+    def __allow_access(self, ip: str) -> bool:
         """
-        判断IP是否合法
-        :param allow_ips: 充许的IP范围 {"ipv4":, "ipv6":}
+        判断IP是否在不限速范围内
         :param ip: 需要检查的ip
         """
-        if not allow_ips:
+        if not self._unlimited_ranges:
             return True
         try:
             ipaddr = ipaddress.ip_address(ip)
-            if ipaddr.version == 4:
-                if not allow_ips.get('ipv4'):
-                    return True
-                allow_ipv4s = allow_ips.get('ipv4').split(",")
-                for allow_ipv4 in allow_ipv4s:
-                    if ipaddr in ipaddress.ip_network(allow_ipv4, strict=False):
-                        return True
-            elif ipaddr.ipv4_mapped:
-                if not allow_ips.get('ipv4'):
-                    return True
-                allow_ipv4s = allow_ips.get('ipv4').split(",")
-                for allow_ipv4 in allow_ipv4s:
-                    if ipaddr.ipv4_mapped in ipaddress.ip_network(allow_ipv4, strict=False):
-                        return True
-            else:
-                if not allow_ips.get('ipv6'):
-                    return True
-                allow_ipv6s = allow_ips.get('ipv6').split(",")
-                for allow_ipv6 in allow_ipv6s:
-                    if ipaddr in ipaddress.ip_network(allow_ipv6, strict=False):
-                        return True
+            if ipaddr.version == 6 and ipaddr.ipv4_mapped:
+                ipaddr = ipaddr.ipv4_mapped
+            starts, ends = self._unlimited_ranges.get(ipaddr.version) or ([], [])
+            if not starts:
+                return True
+            value = int(ipaddr)
+            index = bisect_right(starts, value) - 1
+            return index >= 0 and value <= ends[index]
         except Exception as err:
             print(str(err))
             return False
-        return False
 
     def stop_service(self):
         pass
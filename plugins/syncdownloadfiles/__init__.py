@@ -3,10 +3,15 @@ from datetime import datetime
 from pathlib import Path
 from typing import Any, List, Dict, Tuple, Optional
 
+from concurrent.futures import ThreadPoolExecutor
+
 from apscheduler.schedulers.background import BackgroundScheduler
+from sqlalchemy.orm import Session
 
 from app.core.config import settings
+from app.db import db_query, db_update
 from app.db.downloadhistory_oper import DownloadHistoryOper
+from app.db.models.downloadhistory import DownloadHistory, DownloadFiles
 from app.db.transferhistory_oper import TransferHistoryOper
 from app.log import logger
 from app.modules.qbittorrent import Qbittorrent
@@ -22,7 +27,7 @@ class SyncDownloadFiles(_PluginBase):
     # 插件图标
     plugin_icon = "Youtube-dl_A.png"
     # 插件版本
-    plugin_version = "1.1.1"
+    plugin_version = "1.2"
     # 插件作者
     plugin_author = "thsrite"
     # 作者主页
@@ -45,6 +50,11 @@ class SyncDownloadFiles(_PluginBase):
     _clear = False
     _downloaders = []
     _dirs = None
+    _dir_mappings = []
+    # 并发获取种子文件数
+    _threads = 5
+    # 每批写入种子数
+    _batch_size = 100
     downloadhis = None
     transferhis = None
 
@@ -68,6 +78,14 @@ class SyncDownloadFiles(_PluginBase):
             self._onlyonce = config.get("onlyonce")
             self._downloaders = config.get('downloaders') or []
             self._dirs = config.get("dirs") or ""
+            try:
+                self._threads = max(int(config.get("threads") or 5), 1)
+            except ValueError:
+                self._threads = 5
+
+        # 预先解析目录映射
+        self._dir_mappings = [path.split(":") for path in (self._dirs or "").split("\n")
+                              if len(path.split(":")) >= 2]
 
         if self._clear:
             # 清理下载器文件记录
@@ -76,6 +94,8 @@ class SyncDownloadFiles(_PluginBase):
             for downloader in self._downloaders:
                 # 获取最后同步时间
                 self.del_data(f"last_sync_time_{downloader}")
+                # 清理未完成的同步进度
+                self.del_data(f"sync_checkpoint_{downloader}")
             # 关闭clear
             self._clear = False
             self.__update_config()
@@ -103,6 +123,13 @@ class SyncDownloadFiles(_PluginBase):
         for downloader in self._downloaders:
             # 获取最后同步时间
             last_sync_time = self.get_data(f"last_sync_time_{downloader}")
+            # 上次中断的同步进度
+            checkpoint = self.get_data(f"sync_checkpoint_{downloader}") or {}
+            sync_time = checkpoint.get("sync_time") \
+                or time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time()))
+            synced_hashs = set(checkpoint.get("hashs") or [])
+            if synced_hashs:
+                logger.info(f"下载器 {downloader} 存在未完成的同步任务，已同步种子数：{len(synced_hashs)}，继续同步")
 
             logger.info(f"开始扫描下载器 {downloader} ...")
             downloader_obj = self.__get_downloader(downloader)
@@ -118,96 +145,160 @@ class SyncDownloadFiles(_PluginBase):
             torrents = self.__get_origin_torrents(torrents, downloader)
             logger.info(f"下载器 {downloader} 去除辅种，获取到源种子数：{len(torrents)}")
 
+            # 待同步种子
+            sync_torrents = []
             for torrent in torrents:
                 # 返回false，标识后续种子已被同步
-                sync_flag = self.__compare_time(torrent, downloader, last_sync_time)
-
-                if not sync_flag:
-                    logger.info(f"最后同步时间{last_sync_time}, 之前种子已被同步，结束当前下载器 {downloader} 任务")
+                if not self.__compare_time(torrent, downloader, last_sync_time):
+                    logger.info(f"最后同步时间{last_sync_time}, 之前种子已被同步")
                     break
+                if self.__get_hash(torrent, downloader) in synced_hashs:
+                    continue
+                sync_torrents.append(torrent)
+
+            # 判断是否是mp下载，download_hash在downloadhistory表中且已有文件记录则不处理
+            mp_hashs = self.__get_mp_hashs([self.__get_hash(torrent, downloader) for torrent in sync_torrents], db=None)
+            logger.info(f"下载器 {downloader} 待同步种子数：{len(sync_torrents)}，"
+                        f"其中MoviePilot下载种子数：{len(mp_hashs)}")
+            sync_torrents = [torrent for torrent in sync_torrents
+                             if self.__get_hash(torrent, downloader) not in mp_hashs]
+
+            # 并发获取种子文件，批量写入
+            download_files = []
+            batch_hashs = []
+            synced_cnt = 0
+            with ThreadPoolExecutor(max_workers=self._threads) as executor:
+                futures = [executor.submit(self.__get_torrent_files, torrent, downloader, downloader_obj)
+                           for torrent in sync_torrents]
+                for torrent, future in zip(sync_torrents, futures):
+                    hash_str = self.__get_hash(torrent, downloader)
+                    download_files.extend(self.__build_download_files(torrent=torrent,
+                                                                      downloader=downloader,
+                                                                      hash_str=hash_str,
+                                                                      torrent_files=future.result()))
+                    batch_hashs.append(hash_str)
+                    if len(batch_hashs) >= self._batch_size:
+                        synced_cnt += self.__save_batch(downloader=downloader,
+                                                        sync_time=sync_time,
+                                                        download_files=download_files,
+                                                        batch_hashs=batch_hashs,
+                                                        synced_hashs=synced_hashs)
+                        download_files = []
+                        batch_hashs = []
+                        logger.info(f"下载器 {downloader} 同步进度：{synced_cnt}/{len(sync_torrents)}")
+                if batch_hashs:
+                    synced_cnt += self.__save_batch(downloader=downloader,
+                                                    sync_time=sync_time,
+                                                    download_files=download_files,
+                                                    batch_hashs=batch_hashs,
+                                                    synced_hashs=synced_hashs)
+
+            logger.info(f"下载器 {downloader} 种子文件同步完成，共同步种子 {synced_cnt} 个")
+            self.save_data(f"last_sync_time_{downloader}", sync_time)
+            self.del_data(f"sync_checkpoint_{downloader}")
+
+        # 计算耗时
+        end_time = datetime.now()
+
+        logger.info(f"下载器任务文件记录已同步完成。总耗时 {(end_time - start_time).seconds} 秒")
+
+    def __build_download_files(self, torrent: Any, downloader: str, hash_str: str, torrent_files: Any) -> List[dict]:
+        """
+        组装种子文件记录
+        """
+        # 获取种子download_dir
+        download_dir = self.__get_download_dir(torrent, downloader)
+
+        # 处理路径映射
+        for sub_paths in self._dir_mappings:
+            download_dir = download_dir.replace(sub_paths[0], sub_paths[1]).replace('\\', '/')
+
+        # 获取种子name
+        torrent_name = self.__get_torrent_name(torrent, downloader)
+        # 种子保存目录
+        save_path = Path(download_dir).joinpath(torrent_name)
+        logger.debug(f"开始同步种子 {hash_str}, 文件数 {len(torrent_files or [])}")
+
+        download_files = []
+        for file in torrent_files or []:
+            # 过滤掉没下载的文件
+            if not self.__is_download(file, downloader):
+                continue
+            # 种子文件路径
+            file_path_str = self.__get_file_path(file, downloader)
+            file_path = Path(file_path_str)
+            # 只处理视频格式
+            if not file_path.suffix \
+                    or file_path.suffix not in settings.RMT_MEDIAEXT:
+                continue
+            # 种子文件根路程
+            root_path = file_path.parts[0]
+            # 不含种子名称的种子文件相对路径
+            if root_path == torrent_name:
+                rel_path = str(file_path.relative_to(root_path))
+            else:
+                rel_path = str(file_path)
+            # 完整路径
+            full_path = save_path.joinpath(rel_path)
+            if self._history:
+                transferhis = self.transferhis.get_by_src(str(full_path))
+                if transferhis and not transferhis.download_hash:
+                    logger.info(f"开始补充转移记录：{transferhis.id} download_hash {hash_str}")
+                    self.transferhis.update_download_hash(historyid=transferhis.id,
+                                                          download_hash=hash_str)
+
+            # 种子文件记录
+            download_files.append(
+                {
+                    "download_hash": hash_str,
+                    "downloader": downloader,
+                    "fullpath": str(full_path),
+                    "savepath": str(save_path),
+                    "filepath": rel_path,
+                    "torrentname": torrent_name,
+                }
+            )
+        return download_files
+
+    def __save_batch(self, downloader: str, sync_time: str, download_files: List[dict],
+                     batch_hashs: List[str], synced_hashs: set) -> int:
+        """
+        批量登记下载文件，并记录同步进度
+        """
+        if download_files:
+            self.__add_files(download_files, db=None)
+        synced_hashs.update(batch_hashs)
+        self.save_data(f"sync_checkpoint_{downloader}", {
+            "sync_time": sync_time,
+            "hashs": list(synced_hashs)
+        })
+        return len(batch_hashs)
 
-                # 获取种子hash
-                hash_str = self.__get_hash(torrent, downloader)
-
-                # 判断是否是mp下载，判断download_hash是否在downloadhistory表中，是则不处理
-                downloadhis = self.downloadhis.get_by_hash(hash_str)
-                if downloadhis:
-                    downlod_files = self.downloadhis.get_files_by_hash(hash_str)
-                    if downlod_files:
-                        logger.info(f"种子 {hash_str} 通过MoviePilot下载，跳过处理")
-                        continue
-
-                # 获取种子download_dir
-                download_dir = self.__get_download_dir(torrent, downloader)
-
-                # 处理路径映射
-                if self._dirs:
-                    paths = self._dirs.split("\n")
-                    for path in paths:
-                        sub_paths = path.split(":")
-                        download_dir = download_dir.replace(sub_paths[0], sub_paths[1]).replace('\\', '/')
-
-                # 获取种子name
-                torrent_name = self.__get_torrent_name(torrent, downloader)
-                # 种子保存目录
-                save_path = Path(download_dir).joinpath(torrent_name)
-                # 获取种子文件
-                torrent_files = self.__get_torrent_files(torrent, downloader, downloader_obj)
-                logger.info(f"开始同步种子 {hash_str}, 文件数 {len(torrent_files)}")
-
-                download_files = []
-                for file in torrent_files:
-                    # 过滤掉没下载的文件
-                    if not self.__is_download(file, downloader):
-                        continue
-                    # 种子文件路径
-                    file_path_str = self.__get_file_path(file, downloader)
-                    file_path = Path(file_path_str)
-                    # 只处理视频格式
-                    if not file_path.suffix \
-                            or file_path.suffix not in settings.RMT_MEDIAEXT:
-                        continue
-                    # 种子文件根路程
-                    root_path = file_path.parts[0]
-                    # 不含种子名称的种子文件相对路径
-                    if root_path == torrent_name:
-                        rel_path = str(file_path.relative_to(root_path))
-                    else:
-                        rel_path = str(file_path)
-                    # 完整路径
-                    full_path = save_path.joinpath(rel_path)
-                    if self._history:
-                        transferhis = self.transferhis.get_by_src(str(full_path))
-                        if transferhis and not transferhis.download_hash:
-                            logger.info(f"开始补充转移记录：{transferhis.id} download_hash {hash_str}")
-                            self.transferhis.update_download_hash(historyid=transferhis.id,
-                                                                  download_hash=hash_str)
-
-                    # 种子文件记录
-                    download_files.append(
-                        {
-                            "download_hash": hash_str,
-                            "downloader": downloader,
-                            "fullpath": str(full_path),
-                            "savepath": str(save_path),
-                            "filepath": rel_path,
-                            "torrentname": torrent_name,
-                        }
-                    )
-
-                if download_files:
-                    # 登记下载文件
-                    self.downloadhis.add_files(download_files)
-                logger.info(f"种子 {hash_str} 同步完成")
-
-            logger.info(f"下载器种子文件同步完成！")
-            self.save_data(f"last_sync_time_{downloader}",
-                           time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time())))
-
-            # 计算耗时
-            end_time = datetime.now()
-
-            logger.info(f"下载器任务文件记录已同步完成。总耗时 {(end_time - start_time).seconds} 秒")
+    @staticmethod
+    @db_update
+    def __add_files(download_files: List[dict], db: Session = None):
+        """
+        在一个事务中批量新增下载文件记录
+        """
+        db.bulk_insert_mappings(DownloadFiles, download_files)
+
+    @staticmethod
+    @db_query
+    def __get_mp_hashs(hashs: List[str], db: Session = None) -> set:
+        """
+        批量查询MoviePilot下载且已有文件记录的种子hash
+        """
+        mp_hashs = set()
+        for i in range(0, len(hashs), 500):
+            batch = hashs[i:i + 500]
+            history_hashs = {row[0] for row in db.query(DownloadHistory.download_hash)
+                             .filter(DownloadHistory.download_hash.in_(batch)).all()}
+            if not history_hashs:
+                continue
+            mp_hashs.update(row[0] for row in db.query(DownloadFiles.download_hash)
+                            .filter(DownloadFiles.download_hash.in_(list(history_hashs)))
+                            .distinct().all())
+        return mp_hashs
 
     def __update_config(self):
         self.update_config({
@@ -217,7 +308,8 @@ class SyncDownloadFiles(_PluginBase):
             "clear": self._clear,
             "onlyonce": self._onlyonce,
             "downloaders": self._downloaders,
-            "dirs": self._dirs
+            "dirs": self._dirs,
+            "threads": self._threads
         })
 
     @staticmethod
@@ -471,7 +563,7 @@ class SyncDownloadFiles(_PluginBase):
                                 'component': 'VCol',
                                 'props': {
                                     'cols': 12,
-                                    'md': 6
+                                    'md': 4
                                 },
                                 'content': [
                                     {
@@ -487,7 +579,24 @@ class SyncDownloadFiles(_PluginBase):
                                 'component': 'VCol',
                                 'props': {
                                     'cols': 12,
-                                    'md': 6
+                                    'md': 4
+                                },
+                                'content': [
+                                    {
+                                        'component': 'VTextField',
+                                        'props': {
+                                            'model': 'threads',
+                                            'label': '并发数',
+                                            'placeholder': '同时获取种子文件的连接数'
+                                        }
+                                    }
+                                ]
+                            },
+                            {
+                                'component': 'VCol',
+                                'props': {
+                                    'cols': 12,
+                                    'md': 4
                                 },
                                 'content': [
                                     {
@@ -543,7 +652,7 @@ class SyncDownloadFiles(_PluginBase):
                                         'props': {
                                             'type': 'info',
                                             'variant': 'tonal',
-                                            'text': '适用于非MoviePilot下载的任务；下载器种子数据较多时，同步时间将会较长，请耐心等候，可查看实时日志了解同步进度；时间间隔建议最少每6小时执行一次，防止上次任务没处理完。'
+                                            'text': '适用于非MoviePilot下载的任务；下载器种子数据较多时，同步时间将会较长，请耐心等候，可查看实时日志了解同步进度，同步中断后下次运行将从中断处继续；时间间隔建议最少每6小时执行一次，防止上次任务没处理完。'
                                         }
                                     }
                                 ]
@@ -558,6 +667,7 @@ class SyncDownloadFiles(_PluginBase):
             "history": False,
             "clear": False,
             "time": 6,
+            "threads": 5,
             "dirs": "",
             "downloaders": []
         }
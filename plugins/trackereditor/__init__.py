@@ -1,12 +1,11 @@
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Tuple, Dict, Any, Union, Optional
 
 from apscheduler.triggers.cron import CronTrigger
 
 from app.log import logger
 from app.modules.qbittorrent import Qbittorrent
-from qbittorrentapi.torrents import TorrentInfoList
 from app.modules.transmission import Transmission
-from transmission_rpc.torrent import Torrent
 from app.plugins import _PluginBase
 from app.schemas import NotificationType
 
@@ -19,7 +18,7 @@ class TrackerEditor(_PluginBase):
     # 插件图标
     plugin_icon = "trackereditor_A.png"
     # 插件版本
-    plugin_version = "1.5"
+    plugin_version = "1.6"
     # 插件作者
     plugin_author = "honue"
     # 作者主页
@@ -41,6 +40,10 @@ class TrackerEditor(_PluginBase):
 
     _onlyonce: bool = False
     _downloader: Union[Qbittorrent, Transmission] = None
+    # 当前下载器实例对应的连接配置，配置变化后重新连接
+    _downloader_sign: Optional[tuple] = None
+    # 同时修改的种子数
+    _max_workers: int = 4
 
     _run_con_enable: bool = False
     _run_con: Optional[str] = None
@@ -67,62 +70,140 @@ class TrackerEditor(_PluginBase):
             # 更新onlyonce属性
             self.__update_config()
 
-    def task(self):
-        logger.info(f"{'*' * 30}TrackerEditor: 开始执行Tracker替换{'*' * 30}")
-        torrent_total_cnt: int = 0
-        torrent_update_cnt: int = 0
+    def __get_downloader(self) -> Union[Qbittorrent, Transmission, None]:
+        """
+        复用下载器连接，连接配置变化或连接断开时重新创建
+        """
+        sign = (self._downloader_type, self._host, self._port, self._username, self._password)
+        if self._downloader and self._downloader_sign == sign:
+            client = self._downloader.qbc if self._downloader_type == "qbittorrent" else self._downloader.trc
+            if client:
+                return self._downloader
         if self._downloader_type == "qbittorrent":
             self._downloader = Qbittorrent(self._host, self._port, self._username, self._password)
-            torrent_info_list: TorrentInfoList
-            torrent_info_list, error = self._downloader.get_torrents()
-            torrent_total_cnt = len(torrent_info_list)
-            if error:
-                return
-            for torrent in torrent_info_list:
-                for tracker in torrent.trackers:
-                    if self._target_domain in tracker.url:
-                        original_url = tracker.url
-                        new_url = tracker.url.replace(self._target_domain, self._replace_domain)
-                        logger.info(f"{original_url} 替换为\n {new_url}")
-                        torrent.edit_tracker(orig_url=original_url, new_url=new_url)
-                        torrent_update_cnt += 1
-
         elif self._downloader_type == "transmission":
             self._downloader = Transmission(self._host, self._port, self._username, self._password)
-            tr_version = self._downloader.get_session().get('version')
-            # "4.0.3 (6b0e49bbb2)"  "3.00 (bb6b5a062e)"
-            torrent_list: List[Torrent]
-            torrent_list, error = self._downloader.get_torrents()
-            torrent_total_cnt = len(torrent_list)
+        else:
+            self._downloader = None
+        self._downloader_sign = sign
+        return self._downloader
+
+    def __replace_url(self, url: str) -> str:
+        return url.replace(self._target_domain, self._replace_domain)
+
+    def __qb_plan(self, downloader: Qbittorrent) -> Tuple[int, List[tuple]]:
+        """
+        通过sync/maindata的tracker与种子对应关系，一次请求找出需要修改的种子
+        :return: 种子总数, [(hash, 种子名称, 原tracker, 新tracker)]
+        """
+        maindata = downloader.qbc.sync_maindata(rid=0)
+        torrents = maindata.get("torrents") or {}
+        trackers = maindata.get("trackers")
+        jobs = []
+        if trackers is None:
+            # 旧版本qBittorrent不返回tracker映射，逐个种子查询
+            logger.warn("当前qBittorrent版本不支持tracker映射，逐个种子查询tracker")
+            torrent_list, error = downloader.get_torrents()
             if error:
-                return
+                raise Exception("获取种子列表失败")
             for torrent in torrent_list:
-                new_tracker_list = []
-                for tracker in torrent.tracker_list:
-                    if self._target_domain in tracker:
-                        new_url = tracker.replace(self._target_domain, self._replace_domain)
-                        new_tracker_list.append(new_url)
-                        logger.info(f"{tracker} 替换为\n {new_url}")
-                        torrent_update_cnt += 1
+                for tracker in torrent.trackers:
+                    if self._target_domain in tracker.url:
+                        jobs.append((torrent.hash, torrent.name, tracker.url, self.__replace_url(tracker.url)))
+            return len(torrent_list), jobs
+        for url, hashes in trackers.items():
+            if self._target_domain not in url:
+                continue
+            for torrent_hash in hashes:
+                name = (torrents.get(torrent_hash) or {}).get("name") or torrent_hash
+                jobs.append((torrent_hash, name, url, self.__replace_url(url)))
+        return len(torrents), jobs
+
+    def __tr_plan(self, downloader: Transmission) -> Tuple[int, List[tuple]]:
+        """
+        一次torrent-get获取全部种子的tracker，找出需要修改的种子
+        :return: 种子总数, [(hash, 种子名称, 原tracker列表, 新tracker列表)]
+        """
+        tr_version = downloader.get_session().get('version')
+        # "4.0.3 (6b0e49bbb2)"  "3.00 (bb6b5a062e)"
+        torrents = downloader.trc.get_torrents(arguments=["id", "hashString", "name", "trackers", "trackerList"])
+        jobs = []
+        for torrent in torrents:
+            tracker_list = torrent.tracker_list
+            if not any(self._target_domain in tracker for tracker in tracker_list):
+                continue
+            new_tracker_list = [self.__replace_url(tracker) for tracker in tracker_list]
+            if int(tr_version[0]) >= 4:
+                # 版本大于等于4.x，保留原有的tracker分层
+                tiers = [[tracker for tracker in tier.splitlines() if tracker.strip()]
+                         for tier in (torrent.fields.get("trackerList") or "").split("\n\n")]
+                tiers = [[self.__replace_url(tracker) for tracker in tier] for tier in tiers if tier]
+                new_trackers = tiers or [new_tracker_list]
+            else:
+                new_trackers = new_tracker_list
+            jobs.append((torrent.hashString, torrent.name, tracker_list, new_trackers))
+        return len(torrents), jobs
+
+    def __apply_job(self, job: tuple) -> Tuple[tuple, bool, str]:
+        """
+        修改单个种子的tracker
+        """
+        torrent_hash, name, original, new = job
+        try:
+            if self._downloader_type == "qbittorrent":
+                self._downloader.qbc.torrents_edit_tracker(torrent_hash=torrent_hash,
+                                                           original_url=original,
+                                                           new_url=new)
+            else:
+                if not self._downloader.update_tracker(hash_string=torrent_hash, tracker_list=new):
+                    return job, False, "下载器返回失败"
+            return job, True, ""
+        except Exception as e:
+            return job, False, str(e)
+
+    def task(self):
+        logger.info(f"{'*' * 30}TrackerEditor: 开始执行Tracker替换{'*' * 30}")
+        if not self._target_domain or self._replace_domain is None:
+            logger.warn("未配置待替换的tracker域名")
+            return
+        downloader = self.__get_downloader()
+        if not downloader:
+            logger.error(f"不支持的下载器类型：{self._downloader_type}")
+            return
+        try:
+            if self._downloader_type == "qbittorrent":
+                torrent_total_cnt, jobs = self.__qb_plan(downloader)
+            else:
+                torrent_total_cnt, jobs = self.__tr_plan(downloader)
+        except Exception as e:
+            logger.error(f"获取种子tracker信息失败：{str(e)}")
+            self._downloader = None
+            return
+
+        success_hashes = set()
+        failed = []
+        if jobs:
+            with ThreadPoolExecutor(max_workers=min(self._max_workers, len(jobs))) as executor:
+                for job, ok, err in executor.map(self.__apply_job, jobs):
+                    torrent_hash, name, original, new = job
+                    if ok:
+                        success_hashes.add(torrent_hash)
+                        logger.info(f"{name}：{original} 替换为\n {new}")
                     else:
-                        new_tracker_list.append(tracker)
-                if int(tr_version[0]) >= 4:
-                    # 版本大于等于4.x
-                    __tracker_list = [new_tracker_list]
-                else:
-                    __tracker_list = new_tracker_list
-                if torrent_update_cnt > 0:
-                    update_result = self._downloader.update_tracker(hash_string=torrent.hashString, tracker_list=__tracker_list)
-                    if not update_result:
-                        logger.error(f"执行tracker修改出错，中止本次执行")
-                        torrent_update_cnt = 0
-                        break
-            if torrent_update_cnt == 0:
-                logger.info(f"tracker修改条数为0")
+                        if name not in failed:
+                            failed.append(name)
+                        logger.error(f"{name}：tracker修改失败：{err}")
+        torrent_update_cnt = len(success_hashes)
+        if not jobs:
+            logger.info(f"tracker修改条数为0")
         logger.info(f"{'*' * 30}TrackerEditor: Tracker替换完成{'*' * 30}")
         if (self._run_con_enable and self._notify) or (self._onlyonce and self._notify):
             title = '【Tracker替换】'
             msg = f'''扫描下载器{self._downloader_type}\n总的种子数: {torrent_total_cnt}\n已修改种子数: {torrent_update_cnt}'''
+            if failed:
+                msg += f"\n修改失败种子数: {len(failed)}\n" + "\n".join(failed[:10])
+                if len(failed) > 10:
+                    msg += f"\n等{len(failed)}个种子"
             self.send_site_message(title, msg)
 
     def __update_config(self):
@@ -1,4 +1,5 @@
 import datetime
+import itertools
 import re
 import shutil
 import threading
@@ -25,7 +26,7 @@ from app.db.transferhistory_oper import TransferHistoryOper
 from app.log import logger
 from app.modules.qbittorrent import Qbittorrent
 from app.plugins import _PluginBase
-from app.plugins.vcbanimemonitor.remeta import ReMeta
+from app.plugins.vcbanimemonitor.remeta import ReMeta, series_cache
 from app.schemas import Notification, NotificationType, TransferInfo
 from app.schemas.types import EventType, MediaType, SystemConfigKey
 from app.utils.string import StringUtils
@@ -76,7 +77,7 @@ class VCBAnimeMonitor(_PluginBase):
     # 插件图标
     plugin_icon = "vcbmonitor.png"
     # 插件版本
-    plugin_version = "1.8.2.2"
+    plugin_version = "1.8.3"
     # 插件作者
     plugin_author = "pixel@qingwa"
     # 作者主页
@@ -312,9 +313,13 @@ class VCBAnimeMonitor(_PluginBase):
 
         # 遍历所有监控目录
         for mon_path in self._dirconf.keys():
-            # 遍历目录下所有文件
-            for file_path in SystemUtils.list_files(Path(mon_path), settings.RMT_MEDIAEXT):
-                self.__handle_file(event_path=str(file_path), mon_path=mon_path)
+            # 按所在目录分组，同一季的文件连续处理，整个目录只识别一次
+            files = sorted(SystemUtils.list_files(Path(mon_path), settings.RMT_MEDIAEXT),
+                           key=lambda f: (str(f.parent), f.name))
+            for _, folder_files in itertools.groupby(files, key=lambda f: f.parent):
+                batch = {}
+                for file_path in folder_files:
+                    self.__handle_file(event_path=str(file_path), mon_path=mon_path, batch=batch)
 
         logger.info("全量同步监控目录完成！")
 
@@ -331,12 +336,15 @@ class VCBAnimeMonitor(_PluginBase):
             logger.debug("文件%s：%s" % (text, event_path))
             self.__handle_file(event_path=event_path, mon_path=mon_path)
 
-    def __handle_file(self, event_path: str, mon_path: str):
+    def __handle_file(self, event_path: str, mon_path: str, batch: dict = None):
         """
         同步一个文件
         :param event_path: 事件文件路径
         :param mon_path: 监控目录
+        :param batch: 同一目录批量处理时共用的识别结果 {("media", 标题, 类型): 媒体信息, ("episodes", tmdbid, 季): 集信息}
         """
+        if batch is None:
+            batch = {}
         file_path = Path(event_path)
         try:
             if not file_path.exists():
@@ -454,12 +462,17 @@ class VCBAnimeMonitor(_PluginBase):
                         download_history = self.downloadhis.get_by_hash(download_file.download_hash)
 
                 # 识别媒体信息
+                media_key = None
                 if download_history and download_history.tmdbid:
                     mediainfo: MediaInfo = self.mediaChain.recognize_media(mtype=MediaType(download_history.type),
                                                                            tmdbid=download_history.tmdbid,
                                                                            doubanid=download_history.doubanid)
                 else:
-                    mediainfo: MediaInfo = self.mediaChain.recognize_by_meta(file_meta)
+                    # 同一目录下同系列只识别一次
+                    media_key = ("media", remeta.vcb_meta.title, remeta.vcb_meta.type)
+                    mediainfo: MediaInfo = batch.get(media_key)
+                    if not mediainfo:
+                        mediainfo = self.mediaChain.recognize_by_meta(file_meta)
 
                 if not mediainfo:
                     logger.warn(f'未识别到媒体信息，标题：{file_meta.name}')
@@ -478,21 +491,32 @@ class VCBAnimeMonitor(_PluginBase):
                         ))
                     return
 
-                # 如果未开启新增已入库媒体是否跟随TMDB信息变化则根据tmdbid查询之前的title
-                if not settings.SCRAP_FOLLOW_TMDB:
-                    transfer_history = self.transferhis.get_by_type_tmdbid(tmdbid=mediainfo.tmdb_id,
-                                                                           mtype=mediainfo.type.value)
-                    if transfer_history:
-                        mediainfo.title = transfer_history.title
+                if not media_key or media_key not in batch:
+                    # 如果未开启新增已入库媒体是否跟随TMDB信息变化则根据tmdbid查询之前的title
+                    if not settings.SCRAP_FOLLOW_TMDB:
+                        transfer_history = self.transferhis.get_by_type_tmdbid(tmdbid=mediainfo.tmdb_id,
+                                                                               mtype=mediainfo.type.value)
+                        if transfer_history:
+                            mediainfo.title = transfer_history.title
+
+                    # 更新媒体图片
+                    self.chain.obtain_images(mediainfo=mediainfo)
+                    if media_key:
+                        batch[media_key] = mediainfo
+                    if media_key and mediainfo.type == file_meta.type:
+                        # 记录系列识别结果，后续各集直接按TMDB ID识别
+                        series_cache.set(remeta.vcb_meta.title,
+                                         tmdb_id=mediainfo.tmdb_id,
+                                         type=remeta.vcb_meta.type)
                 logger.info(f"{file_path.name} 识别为：{mediainfo.type.value} {mediainfo.title_year}")
 
-                # 更新媒体图片
-                self.chain.obtain_images(mediainfo=mediainfo)
-
                 # 获取集数据
                 if mediainfo.type == MediaType.TV:
-                    episodes_info = self.tmdbchain.tmdb_episodes(tmdbid=mediainfo.tmdb_id,
-                                                                 season=file_meta.begin_season or 1)
+                    episodes_key = ("episodes", mediainfo.tmdb_id, file_meta.begin_season or 1)
+                    if episodes_key not in batch:
+                        batch[episodes_key] = self.tmdbchain.tmdb_episodes(tmdbid=mediainfo.tmdb_id,
+                                                                           season=file_meta.begin_season or 1)
+                    episodes_info = batch[episodes_key]
                 else:
                     episodes_info = None
 
@@ -1,8 +1,10 @@
 import concurrent
 import re
+import threading
+import time
 from dataclasses import dataclass
 from pathlib import Path
-from typing import List
+from typing import Dict, List, Optional
 from app.chain.media import MediaChain
 from app.chain.tmdb import TmdbChain
 from app.core.metainfo import MetaInfoPath
@@ -63,11 +65,67 @@ class VCBMetaBase:
 
 
 blocked_words = ["vcb-studio", "360p", "480p", "720p", "1080p", "2160p", "hdr", "x265", "x264", "aac", "flac"]
+# 屏蔽词合并为一个正则，只编译一次
+blocked_pattern = re.compile("|".join(re.escape(word) for word in blocked_words))
+
+
+class SeriesCache:
+    """
+    系列识别结果缓存，按清理后的标题缓存TMDB ID、季度数量、类型
+    同一批次的各集及文件、种子处理共用，避免重复搜索TMDB
+    """
+
+    def __init__(self, ttl: int = 6 * 3600):
+        # 缓存时间（秒）
+        self._ttl = ttl
+        self._data: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def __key(title: str) -> str:
+        return re.sub(r"\s+", " ", str(title or "")).strip().lower()
+
+    def get(self, title: str) -> Optional[dict]:
+        """
+        查询未过期的缓存
+        :return: {"tmdb_id", "seasons", "type"}
+        """
+        key = self.__key(title)
+        if not key:
+            return None
+        with self._lock:
+            item = self._data.get(key)
+            if not item:
+                return None
+            if item.get("expire", 0) <= time.time():
+                self._data.pop(key, None)
+                return None
+            return item
+
+    def set(self, title: str, **kwargs):
+        """
+        更新缓存，仅覆盖传入的非空字段：tmdb_id、seasons、type
+        """
+        key = self.__key(title)
+        if not key:
+            return
+        with self._lock:
+            now = time.time()
+            # 顺便清理已过期的条目
+            if len(self._data) > 1000:
+                self._data = {k: v for k, v in self._data.items() if v.get("expire", 0) > now}
+            item = self._data.setdefault(key, {})
+            item.update({k: v for k, v in kwargs.items() if v is not None})
+            item["expire"] = now + self._ttl
+
+
+series_cache = SeriesCache()
 
 
 class ReMeta:
 
-    def __init__(self, ova_switch: bool = False, custom_season_patterns: list[dict] = None):
+    def __init__(self, ova_switch: bool = False, custom_season_patterns: list[dict] = None,
+                 cache: SeriesCache = None):
         self.meta = None
         # TODO:自定义季度匹配规则
         self.custom_season_patterns = custom_season_patterns
@@ -75,6 +133,7 @@ class ReMeta:
         self.ova_switch = ova_switch
         self.vcb_meta = VCBMetaBase()
         self.is_ova = False
+        self.cache = cache or series_cache
 
     def is_tv(self, title: str) -> bool:
         """
@@ -96,6 +155,11 @@ class ReMeta:
         else:
             self.tv_mode()
         self.is_ova = self.vcb_meta.is_ova
+        # 同系列已识别过时直接带上TMDB ID
+        if self.vcb_meta.tmdb_id is None:
+            cached = self.cache.get(self.vcb_meta.title)
+            if cached and cached.get("tmdb_id") and cached.get("type") == self.vcb_meta.type:
+                self.vcb_meta.tmdb_id = cached.get("tmdb_id")
         meta = MetaInfoPath(file_path)
         meta.title = self.vcb_meta.title
         meta.en_name = self.vcb_meta.title
@@ -146,7 +210,7 @@ class ReMeta:
                 else:
                     self.vcb_meta.season = self.roman_to_int(match.group(pattern["group"]))
                 # 匹配成功后，标题中去除季度信息
-                self.vcb_meta.title = pattern["pattern"].sub("", self.vcb_meta.season_title).strip
+                self.vcb_meta.title = pattern["pattern"].sub("", self.vcb_meta.season_title).strip()
                 logger.info(f"识别出季度为{self.vcb_meta.season}")
                 return
         logger.info(f"正常匹配季度失败，开始匹配ova/oad/最终季度")
@@ -201,28 +265,42 @@ class ReMeta:
         """
         从ep_title中剔除不相关的内容
         """
-        blocked_set = set(blocked_words)  # 将阻止词列表转换为集合
-        result = [ep for ep in self.vcb_meta.ep_title if not any(word in ep for word in blocked_set)]
-        self.vcb_meta.ep_title = result
+        self.vcb_meta.ep_title = [ep for ep in self.vcb_meta.ep_title if not blocked_pattern.search(ep)]
 
     def handle_final_season(self):
+        cached = self.cache.get(self.vcb_meta.title)
+        if cached and cached.get("seasons"):
+            self.vcb_meta.tmdb_id = cached.get("tmdb_id")
+            self.vcb_meta.season = cached.get("seasons")
+            logger.info(f"命中系列缓存，最终季度为{self.vcb_meta.season}")
+            return
+        if self.__resolve_final_season():
+            self.cache.set(self.vcb_meta.title,
+                           tmdb_id=self.vcb_meta.tmdb_id,
+                           seasons=self.vcb_meta.season,
+                           type="TV")
 
+    def __resolve_final_season(self) -> bool:
+        """
+        搜索TMDB获取最终季的季度
+        :return: 是否从TMDB获取成功
+        """
         _, medias = MediaChain().search(title=self.vcb_meta.title)
         if not medias:
             logger.warning("匹配到最终季时无法找到对应的媒体信息！季度返回默认值：1")
             self.vcb_meta.season = 1
-            return
+            return False
 
         filter_medias = [media for media in medias if media.type == MediaType.TV]
         if not filter_medias:
             logger.warning("匹配到最终季时无法找到对应的媒体信息！季度返回默认值：1")
             self.vcb_meta.season = 1
-            return
+            return False
         medias = [media for media in filter_medias if media.popularity or media.vote_average]
         if not medias:
             logger.warning("匹配到最终季时无法找到对应的媒体信息！季度返回默认值：1")
             self.vcb_meta.season = 1
-            return
+            return False
         # 获取欢迎度最高或者评分最高的媒体
         medias_sorted = sorted(medias, key=lambda x: x.popularity or x.vote_average, reverse=True)[0]
         self.vcb_meta.tmdb_id = medias_sorted.tmdb_id
@@ -231,9 +309,10 @@ class ReMeta:
             if seasons_info:
                 self.vcb_meta.season = len(seasons_info)
                 logger.info(f"获取到最终季度，季度为{self.vcb_meta.season}")
-                return
+                return True
         logger.warning("无法获取到最终季度信息，季度返回默认值：1")
         self.vcb_meta.season = 1
+        return False
 
 
 
@@ -1,6 +1,9 @@
 from datetime import datetime, timedelta
 import sqlite3
 import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from app.plugins.zvideohelper.DoubanHelper import *
 from enum import Enum
 
@@ -31,7 +34,7 @@ class ZvideoHelper(_PluginBase):
     # 插件图标
     plugin_icon = "zvideo.png"
     # 插件版本
-    plugin_version = "1.4"
+    plugin_version = "1.5"
     # 插件作者
     plugin_author = "DzAvril"
     # 作者主页
@@ -55,6 +58,16 @@ class ZvideoHelper(_PluginBase):
     _cached_data: dict = {}
     _db_path = ""
     _cookie = ""
+    # 豆瓣查询并发数
+    _lookup_workers = 3
+    # 豆瓣查询请求间隔（秒）
+    _lookup_interval = 5
+    _lookup_lock = threading.Lock()
+    _last_lookup = 0
+    # 豆瓣查询结果缓存时间（秒）：有评分、暂无评分、未找到
+    _score_ttl = 30 * 86400
+    _noscore_ttl = 3 * 86400
+    _miss_ttl = 86400
     # 定时器
     _scheduler: Optional[BackgroundScheduler] = None
 
@@ -85,6 +98,7 @@ class ZvideoHelper(_PluginBase):
             if self._clean_cache:
                 self._cached_data = {}
                 self.save_data("zvideohelper", self._cached_data)
+                self.save_data("douban_search", {})
                 self._clean_cache = False
             # 检查数据库路径是否存在
             path = Path(self._db_path)
@@ -246,284 +260,282 @@ class ZvideoHelper(_PluginBase):
             ]
 
     def do_job(self):
-        if self._sync_douban_status:
-            self.sync_douban_status()
+        # 各子任务共用一个数据库连接
+        with self.__connect() as conn:
+            if self._sync_douban_status:
+                self.sync_douban_status(conn=conn)
 
-        if self._use_douban_score:
-            self.use_douban_score()
-        else:
-            self.use_tmdb_score()
+            if self._use_douban_score:
+                self.use_douban_score(conn=conn)
+            else:
+                self.use_tmdb_score(conn=conn)
 
-    def set_douban_watching(self):
-        watching_douban_id = []
+    @contextmanager
+    def __connect(self, conn: sqlite3.Connection = None):
+        """
+        打开极影视数据库，已传入连接时直接复用
+        """
+        if conn:
+            yield conn
+            return
+        conn = sqlite3.connect(self._db_path, timeout=30)
+        # 使用UTF-8编码处理文本
+        conn.text_factory = str
         try:
-            # 连接到SQLite数据库
-            conn = sqlite3.connect(self._db_path)
-
-            # 创建一个游标对象
-            cursor = conn.cursor()
-
-            # 查询表格zvideo_playlist中的collection_id列
-            cursor.execute("SELECT collection_id FROM zvideo_playlist")
-            collection_ids = cursor.fetchall()
-
-            # 去重collection_id
-            collection_ids = set([collection_id[0] for collection_id in collection_ids])
-
-            # 创建一个列表来保存符合条件的meta_info列的JSON对象
-            meta_info_list = []
-
-            # 查询zvideo_collection表中对应的行并筛选type == 200的记录，只有电视剧才有在看状态
-            for collection_id in collection_ids:
-                cursor.execute(
-                    "SELECT meta_info FROM zvideo_collection WHERE collection_id = ? AND type = 200",
-                    (collection_id,),
-                )
-                rows = cursor.fetchall()
-
-                # 将meta_info列的信息转换为JSON对象并保存到列表中
-                for row in rows:
-                    try:
-                        meta_info_json = json.loads(row[0])
-                        meta_info_list.append(meta_info_json)
-                    except json.JSONDecodeError as e:
-                        logger.error(
-                            f"An error occurred while decoding JSON for collection_id {collection_id}: {e}"
-                        )
-
-            for meta_info in meta_info_list:
-                douban_id = meta_info["relation"]["douban"]["douban_id"]
-                title = meta_info["title"]
-                if self._cached_data.get(title) != None:
-                    logger.info(f"已处理过: {title}，跳过...")
-                    continue
-                if douban_id == 0:
-                    _, douban_id, _ = self.get_douban_info_by_name(title)
-                if douban_id != None:
-                    watching_douban_id.append((title, douban_id))
-                else:
-                    logger.error(f"未找到豆瓣ID: {title}")
-
+            # WAL模式下写入不阻塞极影视读取
+            conn.execute("PRAGMA journal_mode=WAL")
         except sqlite3.Error as e:
-            logger.error(f"An error occurred: {e}")
-
+            logger.warn(f"极影视数据库开启WAL模式失败：{e}")
+        try:
+            yield conn
         finally:
-            # 确保游标和连接在使用完后关闭
-            if cursor:
-                cursor.close()
-            if conn:
-                conn.close()
-            message = ""
-            for item in watching_douban_id:
-                status = DoubanStatus.WATCHING.value
-                ret = self._douban_helper.set_watching_status(
-                    subject_id=item[1], status=status, private=True
-                )
-                if ret:
-                    self._cached_data[item[0]] = status
-                    logger.info(f"title: {item[0]}, douban_id: {item[1]}，已标记为在看")
-                    message += f"{item[0]}，已标记为在看\n"
-                else:
-                    logger.error(
-                        f"title: {item[0]}, douban_id: {item[1]}，标记在看失败"
-                    )
-                    message += f"{item[0]}，***标记在看失败***\n"
-            if self._notify and len(message) > 0:
-                self.post_message(
-                    mtype=NotificationType.SiteMessage,
-                    title="【极影视助手】",
-                    text=message,
+            conn.close()
+
+    def __query_meta_infos(self, conn: sqlite3.Connection, sql: str) -> List[dict]:
+        """
+        查询zvideo_collection中的meta_info并解析
+        """
+        meta_info_list = []
+        for collection_id, meta_info in conn.execute(sql).fetchall():
+            try:
+                meta_info_list.append(json.loads(meta_info))
+            except (json.JSONDecodeError, TypeError) as e:
+                logger.error(
+                    f"An error occurred while decoding JSON for collection_id {collection_id}: {e}"
                 )
+        return meta_info_list
 
-    def set_douban_done(self):
+    def __set_douban_status(self, conn: sqlite3.Connection, sql: str, status: DoubanStatus, skip_cached):
+        """
+        将查询到的条目同步为豆瓣状态
+        :param sql: 查询collection_id、meta_info的语句
+        :param skip_cached: 根据缓存的状态判断是否已处理过
+        """
+        status_text = "在看" if status == DoubanStatus.WATCHING else "已看"
         watching_douban_id = []
         try:
-            # 连接到SQLite数据库
-            conn = sqlite3.connect(self._db_path)
+            meta_info_list = self.__query_meta_infos(conn, sql)
+        except sqlite3.Error as e:
+            logger.error(f"An error occurred: {e}")
+            return
 
-            # 创建一个游标对象
-            cursor = conn.cursor()
+        pending = []
+        for meta_info in meta_info_list:
+            title = meta_info["title"]
+            if skip_cached(self._cached_data.get(title)):
+                logger.info(f"已处理过: {title}，跳过...")
+                continue
+            pending.append((title, meta_info["relation"]["douban"]["douban_id"]))
+        # 没有豆瓣ID的条目批量查询
+        douban_infos = self.get_douban_infos([title for title, douban_id in pending if douban_id == 0])
+        for title, douban_id in pending:
+            if douban_id == 0:
+                _, douban_id, _ = douban_infos.get(title) or (None, None, None)
+            if douban_id != None:
+                watching_douban_id.append((title, douban_id))
+            else:
+                logger.error(f"未找到豆瓣ID: {title}")
 
-            # 通过表格`zvideo_collecion_tags`的`tag_name==是否看过`找到对应的`collcetion_id`，在到`zvideo_collection`中查找将其标记为已看
-            cursor.execute(
-                "SELECT collection_id FROM zvideo_collection_tags WHERE tag_name='是否看过'"
+        message = ""
+        for item in watching_douban_id:
+            ret = self._douban_helper.set_watching_status(
+                subject_id=item[1], status=status.value, private=True
             )
-            collection_ids = cursor.fetchall()
-
-            # 去重collection_id
-            collection_ids = set([collection_id[0] for collection_id in collection_ids])
-
-            # 创建一个列表来保存符合条件的meta_info列的JSON对象
-            meta_info_list = []
-
-            for collection_id in collection_ids:
-                cursor.execute(
-                    "SELECT meta_info FROM zvideo_collection WHERE collection_id = ?",
-                    (collection_id,),
+            if ret:
+                self._cached_data[item[0]] = status.value
+                logger.info(f"title: {item[0]}, douban_id: {item[1]}，已标记为{status_text}")
+                message += f"{item[0]}，已标记为{status_text}\n"
+            else:
+                logger.error(
+                    f"title: {item[0]}, douban_id: {item[1]}，标记{status_text}失败"
                 )
-                rows = cursor.fetchall()
-
-                # 将meta_info列的信息转换为JSON对象并保存到列表中
-                for row in rows:
-                    try:
-                        meta_info_json = json.loads(row[0])
-                        meta_info_list.append(meta_info_json)
-                    except json.JSONDecodeError as e:
-                        logger.error(
-                            f"An error occurred while decoding JSON for collection_id {collection_id}: {e}"
-                        )
-
-            for meta_info in meta_info_list:
-                douban_id = meta_info["relation"]["douban"]["douban_id"]
-                title = meta_info["title"]
-                if self._cached_data.get(title) == DoubanStatus.DONE.value:
-                    logger.info(f"已处理过: {title}，跳过...")
-                    continue
-                if douban_id == 0:
-                    _, douban_id, _ = self.get_douban_info_by_name(title)
-                if douban_id != None:
-                    watching_douban_id.append((title, douban_id))
-                else:
-                    logger.error(f"未找到豆瓣ID: {title}")
+                message += f"{item[0]}，***标记{status_text}失败***\n"
+        if self._notify and len(message) > 0:
+            self.post_message(
+                mtype=NotificationType.SiteMessage,
+                title="【极影视助手】",
+                text=message,
+            )
 
-        except sqlite3.Error as e:
-            logger.error(f"An error occurred: {e}")
+    def set_douban_watching(self, conn: sqlite3.Connection = None):
+        with self.__connect(conn) as conn:
+            # 播放列表中的电视剧（type == 200），只有电视剧才有在看状态，一次查询完成
+            self.__set_douban_status(
+                conn,
+                """
+                SELECT collection_id, meta_info FROM zvideo_collection
+                WHERE type = 200
+                AND collection_id IN (SELECT collection_id FROM zvideo_playlist)
+                """,
+                DoubanStatus.WATCHING,
+                lambda cached: cached != None,
+            )
 
-        finally:
-            # 确保游标和连接在使用完后关闭
-            if cursor:
-                cursor.close()
-            if conn:
-                conn.close()
-            message = ""
-            for item in watching_douban_id:
-                status = DoubanStatus.DONE.value
-                ret = self._douban_helper.set_watching_status(
-                    subject_id=item[1], status=status, private=True
-                )
-                if ret:
-                    self._cached_data[item[0]] = status
-                    logger.info(f"title: {item[0]}, douban_id: {item[1]},已标记为已看")
-                    message += f"{item[0]}，已标记为已看\n"
-                else:
-                    logger.error(
-                        f"title: {item[0]}, douban_id: {item[1]}, 标记已看失败"
-                    )
-                    message += f"{item[0]}，***标记已看失败***\n"
-            if self._notify and len(message) > 0:
-                self.post_message(
-                    mtype=NotificationType.SiteMessage,
-                    title="【极影视助手】",
-                    text=message,
+    def set_douban_done(self, conn: sqlite3.Connection = None):
+        with self.__connect(conn) as conn:
+            # 通过表格`zvideo_collecion_tags`的`tag_name==是否看过`找到对应的`collcetion_id`，在到`zvideo_collection`中查找将其标记为已看
+            self.__set_douban_status(
+                conn,
+                """
+                SELECT collection_id, meta_info FROM zvideo_collection
+                WHERE collection_id IN (
+                    SELECT collection_id FROM zvideo_collection_tags WHERE tag_name='是否看过'
                 )
+                """,
+                DoubanStatus.DONE,
+                lambda cached: cached == DoubanStatus.DONE.value,
+            )
 
-    def get_douban_info_by_name(self, title):
+    def get_douban_info_by_name(self, title) -> Optional[tuple]:
+        """
+        按标题查询豆瓣信息，查询出错时返回None，与未查询到的结果区分
+        """
         logger.info(f"正在查询：{title}")
-        # 延迟10s，以防频繁请求被豆瓣封接口
-        time.sleep(10)
-        subject_name, subject_id, score = self._douban_helper.get_subject_id(
-            title=title
-        )
+        # 控制请求间隔，以防频繁请求被豆瓣封接口
+        with self._lookup_lock:
+            wait = self._last_lookup + self._lookup_interval - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            ZvideoHelper._last_lookup = time.time()
+        try:
+            subject_name, subject_id, score = self._douban_helper.get_subject_id(
+                title=title
+            )
+        except Exception as e:
+            logger.error(f"查询 {title} 出错：{e}")
+            return None
         logger.info(
             f"查询到：subject_name: {subject_name}, subject_id: {subject_id}, score: {score}"
         )
         return subject_name, subject_id, score
 
+    def get_douban_infos(self, titles: List[str]) -> Dict[str, tuple]:
+        """
+        批量查询豆瓣信息，优先使用缓存，未命中的标题并发查询
+        :return: {title: (subject_name, subject_id, score)}
+        """
+        now = time.time()
+        cache: dict = self.get_data("douban_search") or {}
+        cache = {k: v for k, v in cache.items() if v.get("expire", 0) > now}
+        results = {}
+        misses = []
+        for title in dict.fromkeys(titles):
+            if title in cache:
+                item = cache[title]
+                results[title] = (item.get("name"), item.get("id"), item.get("score"))
+            else:
+                misses.append(title)
+        if titles:
+            logger.info(f"豆瓣查询 {len(results)} 条命中缓存，{len(misses)} 条需要查询")
+        if misses:
+            with ThreadPoolExecutor(max_workers=self._lookup_workers) as executor:
+                for title, info in zip(misses, executor.map(self.get_douban_info_by_name, misses)):
+                    if info is None:
+                        # 查询出错不写入缓存，下次重新查询
+                        results[title] = (None, None, None)
+                        continue
+                    results[title] = info
+                    subject_name, subject_id, score = info
+                    if not subject_id:
+                        ttl = self._miss_ttl
+                    elif score and str(score) != "0":
+                        ttl = self._score_ttl
+                    else:
+                        # 暂无评分的条目可能很快会有评分
+                        ttl = self._noscore_ttl
+                    cache[title] = {
+                        "name": subject_name,
+                        "id": subject_id,
+                        "score": score,
+                        "expire": now + ttl,
+                    }
+        self.save_data("douban_search", cache)
+        return results
+
     # 填充zvideo_collection中所有行的douban_score
-    def fill_douban_score(self):
+    def fill_douban_score(self, conn: sqlite3.Connection = None):
         logger.info("获取豆瓣评分...")
-        conn = sqlite3.connect(self._db_path)
-        # 使用UTF-8编码处理文本
-        conn.text_factory = str
-        cursor = conn.cursor()
+        with self.__connect(conn) as conn:
+            rows = conn.execute(
+                "SELECT rowid, extend_type, meta_info FROM zvideo_collection"
+            ).fetchall()
+            pending = []
+            exists = 0
+            for rowid, extend_type, meta_info_json in rows:
+                # 合集，不处理
+                if extend_type == 7:
+                    continue
+                meta_info_dict = json.loads(meta_info_json)
+                # 如果meta_info为空，跳过
+                if meta_info_dict.get("douban_score") == None:
+                    continue
+                if meta_info_dict["douban_score"] == 0:
+                    pending.append((rowid, meta_info_dict))
+                else:
+                    exists += 1
+            logger.info(f"已存在豆瓣评分 {exists} 条，待获取 {len(pending)} 条")
 
-        cursor.execute("SELECT rowid, extend_type, meta_info FROM zvideo_collection")
-        rows = cursor.fetchall()
-        message = ""
-        for row in rows:
-            rowid, extend_type, meta_info_json = row
-            # 合集，不处理
-            if extend_type == 7:
-                continue
-            meta_info_dict = json.loads(meta_info_json)
-            # 如果meta_info为空，跳过
-            if meta_info_dict.get("douban_score") == None:
-                continue
-            if meta_info_dict["douban_score"] == 0:
+            douban_infos = self.get_douban_infos([meta_info_dict["title"] for _, meta_info_dict in pending])
+            message = ""
+            updates = []
+            for rowid, meta_info_dict in pending:
                 title = meta_info_dict["title"]
-                _, _, score = self.get_douban_info_by_name(title)
+                _, _, score = douban_infos.get(title) or (None, None, None)
                 if score:
                     meta_info_dict["douban_score"] = score
                     logger.info(f"更新豆瓣评分：{title} {score}")
                     message += f"{title} 更新豆瓣评分：{score}\n"
+                    # 使用ensure_ascii=False来保持中文字符不变
+                    updates.append((json.dumps(meta_info_dict, ensure_ascii=False), rowid))
                 else:
                     logger.error(f"未找到豆瓣评分：{title}")
-            else:
-                logger.info(
-                    f"已存在豆瓣评分：{meta_info_dict['title']} {meta_info_dict['douban_score']}"
-                )
-                continue
 
-            # 使用ensure_ascii=False来保持中文字符不变
-            updated_meta_info_json = json.dumps(meta_info_dict, ensure_ascii=False)
-            cursor.execute(
-                "UPDATE zvideo_collection SET meta_info = ? WHERE rowid = ?",
-                (updated_meta_info_json, rowid),
-            )
-            conn.commit()
+            # 所有更新在一个事务中写入
+            if updates:
+                with conn:
+                    conn.executemany(
+                        "UPDATE zvideo_collection SET meta_info = ? WHERE rowid = ?",
+                        updates,
+                    )
         if self._notify and len(message) > 0:
             self.post_message(
                 mtype=NotificationType.SiteMessage,
                 title="【极影视助手】",
                 text=message,
             )
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
 
-    def use_douban_score(self):
+    def use_douban_score(self, conn: sqlite3.Connection = None):
         logger.info("使用豆瓣评分...")
-        self.fill_douban_score()
-        conn = sqlite3.connect(self._db_path)
-        cursor = conn.cursor()
-        # 将meta_info的douban_score值同步到zvideo_collection表的score列
-        cursor.execute(
-            """
-            UPDATE zvideo_collection
-            SET meta_info = JSON_SET(meta_info, '$.score', CAST(JSON_EXTRACT(meta_info, '$.douban_score') AS JSON))
-            WHERE CAST(JSON_EXTRACT(meta_info, '$.douban_score') AS DECIMAL(3,1)) <> 0.0
-            """
-        )
-        conn.commit()
-
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
+        with self.__connect(conn) as conn:
+            self.fill_douban_score(conn=conn)
+            # 将meta_info的douban_score值同步到zvideo_collection表的score列
+            with conn:
+                conn.execute(
+                    """
+                    UPDATE zvideo_collection
+                    SET meta_info = JSON_SET(meta_info, '$.score', CAST(JSON_EXTRACT(meta_info, '$.douban_score') AS JSON))
+                    WHERE CAST(JSON_EXTRACT(meta_info, '$.douban_score') AS DECIMAL(3,1)) <> 0.0
+                    """
+                )
         logger.info("更新极影视为豆瓣评分...")
 
-    def use_tmdb_score(self):
+    def use_tmdb_score(self, conn: sqlite3.Connection = None):
         logger.info("使用tmdb评分...")
-        conn = sqlite3.connect(self._db_path)
-        cursor = conn.cursor()
-        # 将meta_info的score值同步到zvideo_collection表的score列
-        cursor.execute(
-            """
-            UPDATE zvideo_collection
-            SET meta_info = JSON_SET(meta_info, '$.score', CAST(score AS JSON))
-            """
-        )
-        conn.commit()
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
+        with self.__connect(conn) as conn:
+            # 将meta_info的score值同步到zvideo_collection表的score列
+            with conn:
+                conn.execute(
+                    """
+                    UPDATE zvideo_collection
+                    SET meta_info = JSON_SET(meta_info, '$.score', CAST(score AS JSON))
+                    """
+                )
         logger.info("更新极影视为tmdb评分...")
 
-    def sync_douban_status(self):
-        self.set_douban_watching()
-        self.set_douban_done()
+    def sync_douban_status(self, conn: sqlite3.Connection = None):
+        with self.__connect(conn) as conn:
+            self.set_douban_watching(conn=conn)
+            self.set_douban_done(conn=conn)
         # 缓存数据
         self.save_data("zvideohelper", self._cached_data)
 